@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark du Generateur de Bulletins
+Genere des cohortes synthetiques (100, 1 000 et 10 000 eleves par defaut) au meme
+format que les fichiers Excel de notes/, chronometre separement chaque etape du
+pipeline de generate_bulletins.py (lecture Excel, notes/statistiques, HTML, PDF,
+PDF sur fond commun --pdf-fond, index) et ecrit les resultats en JSON dans
+bench_results/ pour comparer les executions.
+
+Les classeurs et profils suivent la configuration d'une cohorte de config/
+(la premiere par defaut).
+
+Usage:
+    python bench_bulletins.py [--tailles 100,1000,10000] [--pdf-echantillon 20]
+                              [--cohorte paes_2025] [--sortie bench_results/mon_run.json]
+"""
+
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+from pathlib import Path
+
+from openpyxl import Workbook
+
+import generate_bulletins as gb
+
+try:
+    import resource
+except ImportError:  # Windows : pas de mesure de la memoire
+    resource = None
+
+BENCH_DIR = gb.BASE_DIR / "bench_results"
+TAILLES_DEFAUT = [100, 1000, 10000]
+PDF_ECHANTILLON_DEFAUT = 20
+
+PRENOMS = ["Clélia", "Leïla", "Mohamed", "Inès", "Yanis", "Sarah", "Lucas", "Emma",
+           "Jean-Baptiste", "Aïcha", "Théo", "Chloé", "Adam", "Léa", "Hugo", "Zoé"]
+NOMS = ["Martin", "Bernard", "Dubois", "Thomas", "Robert", "Richard", "Petit", "Durand",
+        "Leroy", "Moreau", "Simon", "Laurent", "Lefèbvre", "Michel", "Garcia", "David"]
+PARCOURSUP = ["La PAES de Diploma Santé", "Le BTS Biologie Médicale à Linova", ""]
+
+NOTES_HEADERS = ["Date", "Classement", "UserId", "Pseudo", "Prenom", "Nom", "Email", "Groupes", "Note"]
+IDENTITES_HEADERS = ["Horodateur", "Mail : ", "Nom ", "Prénom ", "Date de naissance ",
+                     "En 2025/2026, j'ai mis en avant sur Parcoursup : ",
+                     "Je souhaite recevoir le/les bulletins correspondants : ", "Commentaires "]
+
+
+def peak_rss_mb():
+    """Pic de memoire residente du processus (Mo), None si non disponible"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss est en octets sur macOS, en kilo-octets sur Linux
+    if sys.platform == "darwin":
+        return round(peak / (1024 * 1024), 1)
+    return round(peak / 1024, 1)
+
+
+def write_sheet(filepath, headers, rows):
+    """Ecrit un classeur Excel (mode ecriture seule) avec une ligne d'en-tete"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(headers)
+    for row in rows:
+        ws.append(row)
+    wb.save(filepath)
+
+
+def generate_cohort(base_dir, nb_eleves, cohort, seed=1234):
+    """Cree une cohorte synthetique dans base_dir avec les classeurs des sources de la
+    cohorte configuree (notes/, nouveauxresultats/, Identites.xlsx), sa configuration,
+    ses templates et ses images"""
+    rng = random.Random(seed)
+
+    eleves = []
+    for i in range(nb_eleves):
+        prenom = rng.choice(PRENOMS)
+        nom = f"{rng.choice(NOMS)} {i}"
+        eleves.append((prenom, nom, f"eleve{i}@exemple.fr"))
+
+    # 90% des eleves ont des notes dans notes/, les autres n'apparaissent que
+    # dans nouveauxresultats/ ou dans Bulletins PAES
+    nb_notes = int(nb_eleves * 0.9)
+    nb_nouveaux = (nb_eleves - nb_notes) // 2
+
+    def note_rows(population):
+        for j, (prenom, nom, email) in enumerate(population):
+            if rng.random() < 0.1:
+                continue
+            note = f"{rng.uniform(0, 20):.2f} / 20"
+            yield ["10/10/2025 10:39:33", j + 1, str(j), "", prenom, nom.upper(), email, "PAES", note]
+
+    def identity_rows(population, ratio):
+        horodateur = datetime(2026, 2, 3, 12, 0, 0)
+        for prenom, nom, email in population:
+            if rng.random() > ratio:
+                continue
+            naissance = datetime(2005, 1, 1) + timedelta(days=rng.randrange(1500))
+            yield [horodateur, email, nom, prenom, naissance, rng.choice(PARCOURSUP), "Oui", None]
+
+    # Un classeur par source de la configuration, au format de son role
+    # (formulaire d'identite : seul le premier est ecrit, comme seul le premier est lu)
+    sheets = {
+        "notes": (NOTES_HEADERS, lambda: note_rows(eleves[:nb_notes])),
+        "nouveaux": (NOTES_HEADERS, lambda: note_rows(eleves[nb_notes:nb_notes + nb_nouveaux])),
+        "identites_nouveaux": (IDENTITES_HEADERS, lambda: identity_rows(eleves[nb_notes:], 1.0)),
+        "dates": (IDENTITES_HEADERS, lambda: identity_rows(eleves, 0.5)),
+        "identites": (IDENTITES_HEADERS, lambda: identity_rows(eleves, 0.5)),
+        "complement": (NOTES_HEADERS, lambda: note_rows(eleves[:nb_notes])),
+    }
+    identites = [s for s in cohort["sources"] if s["role"] == "identites"][:1]
+    written = set()
+    for role, (headers, rows) in sheets.items():
+        for source in cohort["sources"]:
+            if source["role"] != role or (role == "identites" and source not in identites):
+                continue
+            path = base_dir / source["chemin"].relative_to(gb.BASE_DIR)
+            if path in written:
+                continue
+            path.parent.mkdir(parents=True, exist_ok=True)
+            write_sheet(path, headers, rows())
+            written.add(path)
+
+    # Configuration, templates et images reels : le rendu mesure est celui des vrais bulletins
+    shutil.copytree(gb.CONFIG_DIR, base_dir / gb.CONFIG_DIR.name)
+    for profil in cohort["profils"]:
+        for path in [profil["template"], gb.BASE_DIR / profil["etablissement"]["logo"],
+                     gb.BASE_DIR / profil["etablissement"]["tampon"]]:
+            target = base_dir / path.relative_to(gb.BASE_DIR)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy(path, target)
+    # Polices locales (fonts/) si elles sont presentes : memes polices que les vrais PDF
+    if gb.FONTS_DIR.is_dir():
+        shutil.copytree(gb.FONTS_DIR, base_dir / gb.FONTS_DIR.name)
+
+
+def use_base_dir(base_dir):
+    """Redirige les chemins du generateur vers la cohorte synthetique"""
+    gb.BASE_DIR = base_dir
+    gb.CONFIG_DIR = base_dir / gb.CONFIG_DIR.name
+    gb.WORKBOOK_CACHE_DIR = base_dir / ".cache" / "classeurs"
+    gb.IMAGE_CACHE_DIR = base_dir / ".cache" / "images"
+    gb.BACKGROUND_CACHE_DIR = base_dir / ".cache" / "fonds"
+    gb.DUPLICATES_REPORT_FILE = base_dir / "doublons_eleves.json"
+    gb.FONTS_DIR = base_dir / gb.FONTS_DIR.name
+    gb.LOCAL_ASSET_URLS = {url: gb.FONTS_DIR / path.name for url, path in gb.LOCAL_ASSET_URLS.items()}
+
+
+def timed(etapes, nom, elements, fn, *args):
+    """Execute fn(*args), enregistre duree, debit et pic memoire de l'etape"""
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    etapes[nom] = {
+        "secondes": round(elapsed, 4),
+        "elements": elements if not callable(elements) else elements(result),
+        "rss_max_mo": peak_rss_mb(),
+    }
+    etapes[nom]["par_seconde"] = round(etapes[nom]["elements"] / elapsed, 1) if elapsed > 0 else None
+    return result
+
+
+def ingest(cohort):
+    """Lecture des classeurs et chargement des eleves, comme main()"""
+    gb._workbook_rows.clear()
+    gb._raw_student_ids.clear()
+    gb._student_ids.clear()
+    gb.normalize_key.cache_clear()
+    gb.load_workbooks({cohort["cohorte"]: cohort})
+    students, _ = gb.load_students(cohort)
+    return students
+
+
+def compute_stats(students, cohort):
+    """Notes ajustees, statistiques de classe et contextes de rendu des profils, comme main()"""
+    adjusted_matrix, class_stats = gb.prepare_notes(students, cohort)
+    contexts = gb.build_render_contexts(cohort, class_stats)
+    for _ in gb.iter_adjusted_students(students, adjusted_matrix, cohort["matieres"], contexts):
+        pass
+    return contexts
+
+
+def run_cohort(nb_eleves, pdf_echantillon, cohort_name):
+    """Mesure toutes les etapes pour une cohorte (execute dans un processus dedie
+    pour que le pic memoire soit propre a la cohorte)"""
+    with tempfile.TemporaryDirectory(prefix="bench_bulletins_") as tmp:
+        base_dir = Path(tmp)
+        start = time.perf_counter()
+        generate_cohort(base_dir, nb_eleves, gb.load_registry()[cohort_name])
+        generation = round(time.perf_counter() - start, 2)
+        use_base_dir(base_dir)
+        cohort = gb.load_registry()[cohort_name]
+
+        etapes = {}
+        nb = len
+        students = timed(etapes, "lecture_excel_froid", nb, ingest, cohort)
+        students = timed(etapes, "lecture_excel_cache", nb, ingest, cohort)
+        contexts = timed(etapes, "notes_statistiques", len(students), compute_stats, students, cohort)
+
+        def render_all_html():
+            return [gb.render_bulletin_html(student, ctx) for student in students for ctx in contexts]
+
+        pages = timed(etapes, "html", len(contexts) * len(students), render_all_html)
+
+        pdf_dir = base_dir / "pdf"
+        pdf_dir.mkdir()
+        sample = pages[:len(contexts) * pdf_echantillon]
+
+        def render_sample_pdf():
+            for k, html_string in enumerate(sample):
+                gb.render_pdf(html_string, pdf_dir / f"bulletin_{k}.pdf")
+
+        if sample:
+            timed(etapes, "pdf", len(sample), render_sample_pdf)
+        del pages
+
+        # Meme echantillon en --pdf-fond : fonds communs mis en page une fois, puis champs poses
+        sample_jobs = [(student, ctx) for student in students[:pdf_echantillon] for ctx in contexts]
+        nb_complets = None
+
+        def stamp_sample_pdf():
+            """Nombre de PDF rendus completement (pas de fond ou texte trop long)"""
+            complets = 0
+            for k, (student, ctx) in enumerate(sample_jobs):
+                values = gb.render_bulletin_values(student, ctx)
+                fond = gb.page_background(ctx, values)
+                pdf_path = pdf_dir / f"bulletin_fond_{k}.pdf"
+                if fond is None:
+                    gb.render_pdf(sample[k], pdf_path)
+                    complets += 1
+                elif not gb.stamp_pdf(fond, values, sample[k], pdf_path)["fond"]:
+                    complets += 1
+            return complets
+
+        if sample and timed(etapes, "pdf_fond_preparation", len(contexts),
+                            gb.prepare_page_backgrounds, students, contexts):
+            nb_complets = timed(etapes, "pdf_fond", len(sample), stamp_sample_pdf)
+
+        def build_index():
+            data = gb.generate_index_data(students)
+            return gb.generate_index_html(students, cohort), data
+
+        timed(etapes, "index", len(students), build_index)
+
+    return {
+        "eleves": nb_eleves,
+        "eleves_charges": len(students),
+        "generation_donnees_secondes": generation,
+        "pdf_echantillon": len(sample),
+        "pdf_fond_complets": nb_complets,
+        "etapes": etapes,
+        "rss_max_mo": peak_rss_mb(),
+    }
+
+
+def git_commit():
+    """Commit courant du depot (pour comparer les executions), None hors git"""
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=gb.BASE_DIR,
+                             capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(cohorte):
+    """Affiche le tableau des etapes d'une cohorte"""
+    print(f"\n  Cohorte {cohorte['eleves']} élèves (données générées en {cohorte['generation_donnees_secondes']} s)")
+    print(f"  {'Étape':<22} {'Durée (s)':>10} {'Éléments':>10} {'Débit (/s)':>12} {'RSS max (Mo)':>13}")
+    for nom, etape in cohorte["etapes"].items():
+        print(f"  {nom:<22} {etape['secondes']:>10.3f} {etape['elements']:>10} "
+              f"{etape['par_seconde'] or 0:>12.1f} {etape['rss_max_mo'] or 0:>13.1f}")
+
+
+def main():
+    tailles = [int(t) for t in gb.get_cli_option("--tailles", ",".join(map(str, TAILLES_DEFAUT))).split(",")]
+    pdf_echantillon = int(gb.get_cli_option("--pdf-echantillon", str(PDF_ECHANTILLON_DEFAUT)))
+    horodatage = datetime.now().strftime("%Y%m%d_%H%M%S")
+    sortie = Path(gb.get_cli_option("--sortie", str(BENCH_DIR / f"bench_{horodatage}.json")))
+    registry = gb.load_registry()
+    cohort_name = gb.get_cli_option("--cohorte") or next(iter(registry))
+
+    print("=" * 60)
+    print("BENCHMARK DU GENERATEUR DE BULLETINS")
+    print("=" * 60)
+    if cohort_name not in registry:
+        print(f"[ERREUR] Cohorte inconnue: {cohort_name} (disponibles: {list(registry)})")
+        return
+
+    results = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "plateforme": platform.platform(),
+        "cpu": os.cpu_count(),
+        "configuration": cohort_name,
+        "cohortes": [],
+    }
+
+    for taille in tailles:
+        print(f"\n[...] Cohorte de {taille} élèves...")
+        # Un processus neuf par cohorte : pic memoire et caches propres a la cohorte
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            cohorte = pool.submit(run_cohort, taille, pdf_echantillon, cohort_name).result()
+        results["cohortes"].append(cohorte)
+        print_results(cohorte)
+
+    sortie.parent.mkdir(parents=True, exist_ok=True)
+    with open(sortie, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\n[OK] Résultats écrits dans {sortie}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,245 +5,246 @@ Generateur de Bulletins Scolaires - PAES + Linova Education
 Lit les fichiers Excel du dossier notes/ (1 fichier = 1 matiere),
 applique la formule de reajustement, genere des bulletins HTML/PDF
 pour chaque eleve en version PAES et Linova.
+Cohortes et profils : config/*.json (ou .yaml), voir load_registry().
+Plusieurs cohortes en une execution : --config f1,f2 / --cohortes a,b.
+Courbes de notes : --transformation NOM|JSON ; --dry-run-stats affiche les
+statistiques de classe par matiere sans generer de bulletin.
+Rapports de cohorte (classement, histogrammes, notes ajustees en CSV) : --rapports.
+Doublons d'eleves : proposes dans doublons_eleves.json, fusionnes avec --fusion.
+Rendu rapide : --pdf-fond met en page une fois la partie commune des bulletins d'un
+profil et n'y pose que les champs de chaque eleve (reportlab + pypdf).
 """
 
 import os
 import gc
+import io
+import sys
+import csv
+import json
+import pickle
+import tarfile
+import zipfile
+import hashlib
+import mimetypes
+import time
+import tracemalloc
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from difflib import SequenceMatcher
+from functools import lru_cache
+from html import escape
+from itertools import combinations
+from operator import itemgetter
 from pathlib import Path
+import numpy as np
 from openpyxl import load_workbook
-from weasyprint import HTML
+from PIL import Image
+from weasyprint import HTML, CSS
+from weasyprint.formatting_structure import boxes as layout_boxes
+from weasyprint.text.fonts import FontConfiguration
+from weasyprint.urls import URLFetcher, URLFetcherResponse
+from urllib.request import url2pathname, urlopen
+from urllib.parse import urlsplit
 import unicodedata
 import re
 import random
 
+try:
+    import yaml
+except ImportError:  # configurations YAML optionnelles (PyYAML), JSON sinon
+    yaml = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # export Parquet des rapports optionnel (pyarrow), CSV seul sinon
+    pyarrow = None
+
+try:
+    import pypdf
+except ImportError:  # PDF de cohorte et rendu sur fond commun optionnels (pypdf)
+    pypdf = None
+
+try:
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFError, TTFont
+    from reportlab.pdfgen import canvas as pdf_canvas
+except ImportError:  # rendu sur fond commun optionnel (reportlab), rendu complet sinon
+    pdfmetrics = None
+
 # === CONFIGURATION ===
+# Cohortes et profils decrits dans config/ (JSON, ou YAML si PyYAML est installe) :
+# classeurs sources, matieres, regles de choix, et pour chaque profil l'etablissement,
+# le template, les matieres affichees et les appreciations. Voir load_registry().
 
-# Profil PAES (Diploma Sante)
-PROFIL_PAES = {
-    "nom": "Diploma Santé",
-    "adresse": "85 Avenue Ledru Rollin",
-    "code_postal": "75012",
-    "ville": "Paris",
-    "annee_scolaire": "2025/2026",
-    "classe": "PAES",
-    "charge_etudes": "Shirel Benchetrit",
-    "semestre": "Annuel",
-    "logo": "logo_etablissement.png",
-    "tampon": "tampon.png",
+# Chemins
+BASE_DIR = Path(__file__).parent
+CONFIG_DIR = BASE_DIR / "config"
+CONFIG_EXTENSIONS = (".json", ".yaml", ".yml")
+COHORT_REQUIRED_KEYS = ("cohorte", "sources", "matieres", "profils")
+PROFILE_REQUIRED_KEYS = ("cle", "template", "etablissement", "appreciations")
+
+# Sources des eleves : chaque classeur declare son role, sa matiere et ses colonnes.
+#   notes              : cree les eleves (1 classeur = 1 matiere)
+#   dates              : dates de naissance des eleves de "notes"
+#   nouveaux           : eleves absents de "notes" (1 classeur = 1 matiere)
+#   identites_nouveaux : eleves sans aucune note + leurs identites
+#   complement         : notes ajoutees aux eleves deja charges, jamais de creation
+#   identites          : formulaire d'identite (premier classeur present)
+SOURCE_ROLES = ("notes", "dates", "nouveaux", "identites_nouveaux", "complement", "identites")
+NOTE_SOURCE_ROLES = ("notes", "nouveaux", "complement")
+# Alias des en-tetes de chaque champ (compares sans espaces de bord ni casse),
+# remplacables source par source avec "colonnes"
+SOURCE_COLUMNS = {
+    "prenom": ["Prenom", "Prénom"],
+    "nom": ["Nom"],
+    "email": ["Email", "Mail", "Mail :"],
+    "note": ["Note"],
+    "date_naissance": ["Date de naissance"],
+    "parcoursup": ["En 2025/2026, j'ai mis en avant sur Parcoursup :"],
 }
 
-# Profil Linova Education
-PROFIL_LINOVA = {
-    "nom": "Linova Education",
-    "adresse": "100 Quai de la Rapée",
-    "code_postal": "75012",
-    "ville": "Paris",
-    "annee_scolaire": "2025/2026",
-    "classe": "1",
-    "charge_etudes": "Cyril Robert",
-    "semestre": "Annuel",
-    "logo": "logo_linova.png",
-    "tampon": "tampon_linova.jpeg",
+# Manifeste des bulletins generes : empreinte des donnees d'entree par eleve/profil
+MANIFEST_FILE = BASE_DIR / "bulletins_manifest.json"
+MANIFEST_SAVE_EVERY = 50  # eleves entre deux sauvegardes du manifeste
+
+# Ecriture des sorties : fichier temporaire du meme dossier puis renommage atomique.
+# Synchronisation disque (--fsync) : "aucune", "lot" (dossiers de sortie synchronises
+# a chaque sauvegarde du manifeste) ou "fichier" (chaque fichier en plus des dossiers)
+FSYNC_MODES = ("aucune", "lot", "fichier")
+FSYNC_MODE_DEFAUT = "lot"
+TEMP_FILE_PATTERN = ".*.tmp"
+# Sorties produites (--sorties) : "pdf" (HTML garde en memoire pour le rendu),
+# "html" (pas de rendu PDF), "pdf-html" (les deux, defaut) ou "pdf-html-gz"
+# (PDF + tous les HTML dans une seule archive tar.gz, pour le debogage)
+OUTPUT_MODES = ("pdf", "html", "pdf-html", "pdf-html-gz")
+OUTPUT_MODE_DEFAUT = "pdf-html"
+HTML_ARCHIVE_FILE = BASE_DIR / "bulletins_html.tar.gz"
+# Export des PDF en archives (--export zip|tar) : une archive par profil ou par
+# choix de bulletin (--export-par profil|choix), decoupee en parties de
+# --export-taille-max Mo au plus
+EXPORT_DIR = BASE_DIR / "exports"
+EXPORT_FORMATS = ("zip", "tar")
+EXPORT_GROUPINGS = ("profil", "choix")
+EXPORT_ENTRY_OVERHEAD = 512  # en-tetes d'une entree, estimes pour le decoupage
+# Un PDF complet se termine par %%EOF (suivi au plus de quelques fins de ligne)
+PDF_EOF_WINDOW = 1024
+
+# Cache disque des lignes lues dans les classeurs Excel (invalide si le fichier change)
+WORKBOOK_CACHE_DIR = BASE_DIR / ".cache" / "classeurs"
+WORKBOOK_CACHE_VERSION = 1
+
+# === RESSOURCES LOCALES (polices, logos, tampons) ===
+# Aucun rendu ne passe par le reseau : les feuilles de style distantes sont remplacees
+# par une copie locale dans fonts/ (open_sans.css + fichiers .ttf qu'elle reference en
+# url() relatives, polices Open Sans sous licence OFL). Si la copie manque,
+# check_local_assets() la telecharge une fois au demarrage (puis elle est reutilisee) ;
+# hors ligne, la feuille est vide et les polices de repli du font-family sont utilisees.
+FONTS_DIR = BASE_DIR / "fonts"
+GOOGLE_FONTS_URL = "https://fonts.googleapis.com/css2?family=Open+Sans:wght@400;600;700&display=swap"
+LOCAL_ASSET_URLS = {
+    GOOGLE_FONTS_URL: FONTS_DIR / "open_sans.css",
 }
-
-# Matieres PAES avec mapping vers fichiers Excel
-MATIERES_PAES = [
-    {"nom": "Biochimie", "excel_file": "Resultats-CB1 - Biochimie (1).xlsx", "enseignant": "M. Benramdane"},
-    {"nom": "Biologie Cellulaire", "excel_file": "Resultats-CB1 - Biologie Cellulaire  (1).xlsx", "enseignant": "M. Descatoire"},
-    {"nom": "Biostatistiques", "excel_file": "Resultats-CB1 - Biostatistiques  (1).xlsx", "enseignant": "U. Bederede"},
-    {"nom": "Chimie Médecine", "excel_file": "Resultats-CB1 - Chimie  (2).xlsx", "enseignant": "R. Hadjerci"},
-    {"nom": "Chimie Terminale", "excel_file": "Resultats-CB1 - Chimie  (3).xlsx", "enseignant": "D. Yazidi"},
-    {"nom": "Mathématiques", "excel_file": "Resultats-CB1 - Maths (1).xlsx", "enseignant": "U. Bederede"},
-    {"nom": "Physique", "excel_file": "Resultats-CB1 - Physique (1).xlsx", "enseignant": "H. Diaw"},
-    {"nom": "Physique/Biophysique", "excel_file": "Resultats-CB1 - Physique Biophysique  (1).xlsx", "enseignant": "H. Diaw"},
-    {"nom": "SVT", "excel_file": "Resultats-CB1 - SVT (1).xlsx", "enseignant": "M. Descatoire"},
-]
-
-# Matieres Linova avec mapping vers les matieres PAES (pour reutiliser les notes)
-MATIERES_LINOVA = [
-    {"nom": "Démarche qualité et organisation opérationnelle au sein du laboratoire de biologie médicale",
-     "source_paes": "Biochimie", "enseignant": "M. Benramdane"},
-    {"nom": "Analyses médicales les plus courantes",
-     "source_paes": "Biologie Cellulaire", "enseignant": "M. Descatoire"},
-    {"nom": "Amélioration des méthodes d'analyse de biologie médicale - Pratiques à visée thérapeutique",
-     "source_paes": "Biostatistiques", "enseignant": "M. Descatoire"},
-    {"nom": "Relations, collaboration et développement professionnels",
-     "source_paes": "Chimie Médecine", "enseignant": "M. Benramdane"},
-    {"nom": "Prélèvements de sang et d'autres échantillons biologiques / Culture générale et expression",
-     "source_paes": "Chimie Terminale", "enseignant": "Aurore Pottier"},
-    {"nom": "Anglais",
-     "source_paes": "Physique/Biophysique", "enseignant": "Hanna Charbit"},
-    {"nom": "SVT",
-     "source_paes": "SVT", "enseignant": "M. Descatoire"},
-    {"nom": "Mathématiques",
-     "source_paes": "Mathématiques", "enseignant": "MOKRANE Zahia"},
-    {"nom": "Physique-Chimie",
-     "source_paes": "Physique", "enseignant": "MOKRANE Zahia"},
-]
-
-
-# Appreciations par matiere PAES
-APPRECIATIONS_PAES = {
-    "Biochimie": {
-        "insuffisant": "Les notions de biochimie nécessitent un approfondissement. Un travail régulier permettra de progresser.",
-        "passable": "Les bases en biochimie sont acquises. Poursuivez vos efforts pour consolider vos connaissances.",
-        "assez_bien": "Bonne compréhension des concepts biochimiques. Continuez sur cette voie prometteuse.",
-        "bien": "Très bonne maîtrise de la biochimie. Vos efforts sont récompensés, persévérez.",
-        "excellent": "Excellente maîtrise des notions biochimiques. Félicitations pour ce travail remarquable."
-    },
-    "Biologie Cellulaire": {
-        "insuffisant": "Les mécanismes cellulaires doivent être revus. Un travail plus soutenu est nécessaire.",
-        "passable": "Compréhension correcte de la biologie cellulaire. Des efforts supplémentaires consolideront vos acquis.",
-        "assez_bien": "Bonne assimilation des concepts cellulaires. Maintenez cette dynamique positive.",
-        "bien": "Très bonne compréhension des processus cellulaires. Continuez ainsi.",
-        "excellent": "Maîtrise remarquable de la biologie cellulaire. Travail exemplaire."
-    },
-    "Biostatistiques": {
-        "insuffisant": "Les méthodes statistiques demandent plus de pratique. Un entraînement régulier est conseillé.",
-        "passable": "Les bases statistiques sont comprises. Continuez à vous exercer pour gagner en aisance.",
-        "assez_bien": "Bonne application des outils statistiques. Poursuivez vos efforts.",
-        "bien": "Très bonne maîtrise des biostatistiques. Résultats très satisfaisants.",
-        "excellent": "Excellente compréhension et application des méthodes statistiques. Bravo."
-    },
-    "Chimie Médecine": {
-        "insuffisant": "Les fondamentaux en chimie médicale doivent être renforcés. Travaillez régulièrement.",
-        "passable": "Niveau correct en chimie médicale. Poursuivez vos efforts pour vous améliorer.",
-        "assez_bien": "Bonne compréhension de la chimie appliquée à la médecine. Continuez ainsi.",
-        "bien": "Très bon niveau en chimie médicale. Vos résultats sont encourageants.",
-        "excellent": "Excellente maîtrise de la chimie médicale. Félicitations pour votre investissement."
-    },
-    "Chimie Terminale": {
-        "insuffisant": "Les acquis de chimie terminale nécessitent une révision. Un travail soutenu s'impose.",
-        "passable": "Les notions de chimie terminale sont assimilées. Continuez à progresser.",
-        "assez_bien": "Bonne maîtrise des concepts de chimie terminale. Persévérez dans vos efforts.",
-        "bien": "Très bonne compréhension de la chimie terminale. Résultats très positifs.",
-        "excellent": "Excellents résultats en chimie terminale. Travail remarquable et rigoureux."
-    },
-    "Mathématiques": {
-        "insuffisant": "Les compétences mathématiques doivent être consolidées. Un entraînement quotidien est recommandé.",
-        "passable": "Niveau satisfaisant en mathématiques. Continuez à pratiquer pour progresser.",
-        "assez_bien": "Bonne maîtrise des outils mathématiques. Maintenez vos efforts.",
-        "bien": "Très bon niveau en mathématiques. Vos compétences sont solides.",
-        "excellent": "Excellente maîtrise des mathématiques. Résultats impressionnants, félicitations."
-    },
-    "Physique": {
-        "insuffisant": "Les concepts physiques nécessitent plus de travail. Revoyez les notions fondamentales.",
-        "passable": "Compréhension correcte des phénomènes physiques. Poursuivez vos efforts.",
-        "assez_bien": "Bonne assimilation des lois physiques. Continuez sur cette lancée positive.",
-        "bien": "Très bonne maîtrise de la physique. Vos efforts portent leurs fruits.",
-        "excellent": "Excellente compréhension de la physique. Travail exemplaire et rigoureux."
-    },
-    "Physique/Biophysique": {
-        "insuffisant": "Les notions de biophysique demandent un approfondissement. Travaillez régulièrement.",
-        "passable": "Les bases en biophysique sont acquises. Continuez à consolider vos connaissances.",
-        "assez_bien": "Bonne compréhension des applications physiques en biologie. Persévérez.",
-        "bien": "Très bon niveau en biophysique. Résultats très encourageants.",
-        "excellent": "Maîtrise excellente de la biophysique. Félicitations pour ce parcours remarquable."
-    },
-    "SVT": {
-        "insuffisant": "Les connaissances en SVT doivent être renforcées. Un travail plus régulier est nécessaire.",
-        "passable": "Niveau correct en SVT. Poursuivez vos efforts pour améliorer vos résultats.",
-        "assez_bien": "Bonne compréhension des sciences de la vie et de la Terre. Continuez ainsi.",
-        "bien": "Très bonne maîtrise des SVT. Vos résultats reflètent un travail sérieux.",
-        "excellent": "Excellents résultats en SVT. Travail remarquable et approfondi, bravo."
-    }
+LOCAL_ASSET_TIMEOUT = 10  # secondes par fichier telecharge
+CSS_URL_RE = re.compile(r"""url\((['"]?)([^)'"]+)\1\)""")
+
+# Logos et tampons reduits une fois a la resolution d'impression avant le rendu
+# (cache disque) : chaque PDF embarque la version reduite au lieu de l'original.
+# Cadres d'affichage en px CSS (96 px = 1 pouce) : le plus grand des deux templates.
+PRINT_DPI = 300
+PRINT_BOXES_PX = {"logo": (180, 70), "tampon": (130, 90)}
+IMAGE_CACHE_DIR = BASE_DIR / ".cache" / "images"
+IMAGE_CACHE_VERSION = 1
+
+# Donnees de la plateforme index.html (liste des eleves chargee par la page)
+INDEX_DATA_FILE = BASE_DIR / "index_data.js"
+
+# Rapports de cohorte (--rapports) : classement, histogrammes et notes ajustees,
+# tires de la matrice et des statistiques deja calculees (ni relecture ni rendu de bulletin)
+REPORT_DIR = BASE_DIR / "rapports"
+REPORT_HISTOGRAM_BINS = np.linspace(0.0, 20.0, 11)  # tranches de 2 points
+REPORT_BAR_HEIGHT_PX = 60
+
+# Rapport de profilage (--profile) : mesures par etape, au format Chrome trace
+PROFILE_FILE = BASE_DIR / "profil_execution.json"
+
+# Rapport des doublons detectes avant le rendu (fusions proposees ou faites avec
+# --fusion, signalements a verifier)
+DUPLICATES_REPORT_FILE = BASE_DIR / "doublons_eleves.json"
+# Au-dela de cette taille, un bloc (ex: email generique) n'est pas compare
+# paire a paire pour garder une detection quasi lineaire
+DUPLICATE_BLOCK_MAX = 20
+# Similarite minimale des noms (tokens tries) pour une faute de frappe
+DUPLICATE_NAME_RATIO = 0.9
+
+# === RENDU PDF PARALLELE ===
+# Nombre de bulletins rendus par un worker avant qu'il soit recycle
+# (WeasyPrint garde des caches internes : on borne ainsi la memoire par processus)
+PDF_TASKS_PER_WORKER = 25
+
+# Bloc <style> des templates : analyse une seule fois par processus et par profil
+STYLE_BLOCK_RE = re.compile(r"<style[^>]*>(.*?)</style>", re.S | re.I)
+
+# === RENDU SUR FOND COMMUN (--pdf-fond) ===
+# Tout ce qui est identique pour les eleves d'un profil (en-tete, logo, cadre du tableau,
+# matieres, enseignants, statistiques de classe, tampon) est mis en page une seule fois
+# par WeasyPrint et ecrit en PDF de fond ; pour chaque eleve, seuls ses champs sont poses
+# en texte par-dessus (reportlab, polices Open Sans locales) puis fusionnes au fond (pypdf).
+# La mise en page est figee sur les valeurs les plus longues de la cohorte ; un texte qui
+# ne tient pas dans sa zone est rendu completement. Fonds et zones gardes en cache disque.
+BACKGROUND_CACHE_DIR = BASE_DIR / ".cache" / "fonds"
+BACKGROUND_CACHE_VERSION = 1
+PX_TO_PT = 0.75  # 96 px CSS = 72 pt PDF
+BACKGROUND_FIT_TOLERANCE_PX = 0.5  # ecart de largeur admis (crenage de WeasyPrint)
+FONT_FACE_RE = re.compile(r"@font-face\s*\{([^}]*)\}")
+CSS_DECLARATION_RE = re.compile(r"([a-z-]+)\s*:\s*([^;]+)")
+
+
+# === TRANSFORMATIONS DES NOTES ===
+# Courbe appliquee aux notes brutes, colonne par colonne (une matiere a la fois) :
+# {"nom": <cle de GRADE_TRANSFORMS>, <parametres>...} ou le nom seul. Configurable par
+# cohorte et par matiere ("transformation" dans config/) ou pour tout le lancement
+# (--transformation).
+# Defaut : f(x) = 0.57x + 8.74, plafonnee a 20.
+TRANSFORMATION_DEFAUT = {"nom": "lineaire", "a": 0.57, "b": 8.74, "max": 20.0}
+
+
+# === APPRECIATIONS ===
+# Niveaux d'appreciation, du plus faible au meilleur : une note tombe dans le niveau
+# bisect_right(seuils, note) ; seuils par defaut 10/12/14/16, modifiables par profil
+# ("seuils_appreciation" dans config/)
+APPRECIATION_NIVEAUX = ("insuffisant", "passable", "assez_bien", "bien", "excellent")
+APPRECIATION_SEUILS_DEFAUT = (10, 12, 14, 16)
+NOTE_APPRECIATION_DEFAUT = 10.5  # note retenue pour l'appreciation quand il n'y en a pas
+
+# Appreciation d'une matiere sans texte pour ce niveau dans le profil
+APPRECIATIONS_DEFAUT = {
+    "insuffisant": "Des efforts sont nécessaires pour progresser.",
+    "passable": "Résultats encourageants. Continuez vos efforts.",
+    "assez_bien": "Bon travail. Poursuivez dans cette voie.",
+    "bien": "Très bon travail. Continuez ainsi.",
+    "excellent": "Excellents résultats. Félicitations.",
 }
 
-# Appreciations par matiere Linova
-APPRECIATIONS_LINOVA = {
-    "Démarche qualité et organisation opérationnelle au sein du laboratoire de biologie médicale": {
-        "insuffisant": "Les notions de démarche qualité en laboratoire nécessitent un approfondissement. Un travail régulier permettra de progresser.",
-        "passable": "Les bases de la démarche qualité sont acquises. Poursuivez vos efforts pour consolider vos connaissances.",
-        "assez_bien": "Bonne compréhension de l'organisation opérationnelle en laboratoire. Continuez sur cette voie prometteuse.",
-        "bien": "Très bonne maîtrise de la démarche qualité et de l'organisation en laboratoire. Persévérez.",
-        "excellent": "Excellente maîtrise de la démarche qualité en laboratoire. Félicitations pour ce travail remarquable."
-    },
-    "Analyses médicales les plus courantes": {
-        "insuffisant": "Les techniques d'analyses médicales doivent être revues. Un travail plus soutenu est nécessaire.",
-        "passable": "Compréhension correcte des analyses médicales courantes. Des efforts supplémentaires consolideront vos acquis.",
-        "assez_bien": "Bonne assimilation des méthodes d'analyses médicales. Maintenez cette dynamique positive.",
-        "bien": "Très bonne compréhension des analyses médicales courantes. Continuez ainsi.",
-        "excellent": "Maîtrise remarquable des analyses médicales les plus courantes. Travail exemplaire."
-    },
-    "Amélioration des méthodes d'analyse de biologie médicale - Pratiques à visée thérapeutique": {
-        "insuffisant": "Les méthodes d'amélioration des analyses demandent plus de pratique. Un entraînement régulier est conseillé.",
-        "passable": "Les bases des méthodes d'analyse sont comprises. Continuez à vous exercer pour gagner en aisance.",
-        "assez_bien": "Bonne application des méthodes d'analyse de biologie médicale. Poursuivez vos efforts.",
-        "bien": "Très bonne maîtrise des méthodes d'analyse à visée thérapeutique. Résultats très satisfaisants.",
-        "excellent": "Excellente compréhension et application des méthodes d'analyse de biologie médicale. Bravo."
-    },
-    "Relations, collaboration et développement professionnels": {
-        "insuffisant": "Les compétences relationnelles et collaboratives doivent être renforcées. Travaillez régulièrement.",
-        "passable": "Niveau correct en relations et collaboration professionnelles. Poursuivez vos efforts.",
-        "assez_bien": "Bonne compréhension des enjeux de collaboration et développement professionnel. Continuez ainsi.",
-        "bien": "Très bon niveau en relations et développement professionnels. Résultats encourageants.",
-        "excellent": "Excellente maîtrise des compétences relationnelles et professionnelles. Félicitations."
-    },
-    "Prélèvements de sang et d'autres échantillons biologiques / Culture générale et expression": {
-        "insuffisant": "Les techniques de prélèvement et les compétences en expression nécessitent une révision. Un travail soutenu s'impose.",
-        "passable": "Les notions de prélèvement et de culture générale sont assimilées. Continuez à progresser.",
-        "assez_bien": "Bonne maîtrise des techniques de prélèvement et de l'expression. Persévérez dans vos efforts.",
-        "bien": "Très bonne compréhension des prélèvements biologiques et de la culture générale. Résultats très positifs.",
-        "excellent": "Excellents résultats en prélèvements et culture générale. Travail remarquable et rigoureux."
-    },
-    "Anglais": {
-        "insuffisant": "Les compétences en anglais doivent être consolidées. Un entraînement quotidien est recommandé.",
-        "passable": "Niveau satisfaisant en anglais. Continuez à pratiquer pour progresser.",
-        "assez_bien": "Bonne maîtrise de l'anglais. Maintenez vos efforts.",
-        "bien": "Très bon niveau en anglais. Vos compétences linguistiques sont solides.",
-        "excellent": "Excellente maîtrise de l'anglais. Résultats impressionnants, félicitations."
-    },
-    "SVT": {
-        "insuffisant": "Les connaissances en SVT doivent être renforcées. Un travail plus régulier est nécessaire.",
-        "passable": "Niveau correct en SVT. Poursuivez vos efforts pour améliorer vos résultats.",
-        "assez_bien": "Bonne compréhension des sciences de la vie et de la Terre. Continuez ainsi.",
-        "bien": "Très bonne maîtrise des SVT. Vos résultats reflètent un travail sérieux.",
-        "excellent": "Excellents résultats en SVT. Travail remarquable et approfondi, bravo."
-    },
-    "Mathématiques": {
-        "insuffisant": "Les compétences mathématiques doivent être consolidées. Un entraînement quotidien est recommandé.",
-        "passable": "Niveau satisfaisant en mathématiques. Continuez à pratiquer pour progresser.",
-        "assez_bien": "Bonne maîtrise des outils mathématiques. Maintenez vos efforts.",
-        "bien": "Très bon niveau en mathématiques. Vos compétences sont solides.",
-        "excellent": "Excellente maîtrise des mathématiques. Résultats impressionnants, félicitations."
-    },
-    "Physique-Chimie": {
-        "insuffisant": "Les concepts de physique-chimie nécessitent plus de travail. Revoyez les notions fondamentales.",
-        "passable": "Compréhension correcte de la physique-chimie. Poursuivez vos efforts.",
-        "assez_bien": "Bonne assimilation des lois de physique-chimie. Continuez sur cette lancée positive.",
-        "bien": "Très bonne maîtrise de la physique-chimie. Vos efforts portent leurs fruits.",
-        "excellent": "Excellente compréhension de la physique-chimie. Travail exemplaire et rigoureux."
-    }
-}
+# Appreciation generale par niveau de moyenne, precedee du prenom de l'eleve
+APPRECIATIONS_GENERALES = (
+    " doit fournir davantage d'efforts pour progresser. Un travail régulier et soutenu permettra d'améliorer les résultats l'année prochaine.",
+    " montre des résultats encourageants. Avec plus de régularité dans le travail, les résultats continueront de s'améliorer.",
+    " fournit un bon travail cette année. Les bases sont acquises et les efforts doivent être maintenus pour progresser davantage.",
+    " a fourni un travail régulier et rigoureux tout au long de l'année. Les résultats sont très satisfaisants. Continuez ainsi.",
+    " a fourni un travail remarquable tout au long de l'année. Félicitations pour ces excellents résultats.",
+)
 
-# Chemins
-BASE_DIR = Path(__file__).parent
-NOTES_DIR = BASE_DIR / "notes"
-TEMPLATE_FILE = BASE_DIR / "bulletin_template.html"
-TEMPLATE_LINOVA_FILE = BASE_DIR / "bulletin_template_linova.html"
-
-# === NOUVEAUX RESULTATS ===
-NOUVEAUX_RESULTATS_DIR = BASE_DIR / "nouveauxresultats"
-
-NOUVEAUX_RESULT_FILES = [
-    {"file": "Resultats-CB1 général - Biochimie.xlsx", "paes_matiere": "Biochimie"},
-    {"file": "Resultats-CB1 général - Biologie cellulaire .xlsx", "paes_matiere": "Biologie Cellulaire"},
-    {"file": "Resultats-CB général -Biostatistique.xlsx", "paes_matiere": "Biostatistiques"},
-    {"file": "Resultats-CB1 général - Chimie.xlsx", "paes_matiere": "Chimie Médecine"},
-    {"file": "Resultats-CB1 général - Physique.xlsx", "paes_matiere": "Physique"},
-]
-
-def adjust_grade(note):
-    """Applique la formule f(x) = 0.57x + 8.74, plafonnee a 20
-    Si pas de note, retourne une note aleatoire entre 9.5 et 12"""
-    if note is None or note == "-" or note == "":
-        return round(random.uniform(9.5, 12.0), 1)
-    try:
-        note_float = float(note)
-        adjusted = 0.57 * note_float + 8.74
-        return min(adjusted, 20.0)
-    except (ValueError, TypeError):
-        return round(random.uniform(9.5, 12.0), 1)
+
+# === TEMPLATES ===
+PLACEHOLDER_RE = re.compile(r"\{\{([A-Z0-9_]+)\}\}")
+
+# Lignes du template supprimees entierement quand le champ est vide
+OPTIONAL_TEMPLATE_LINES = {
+    "DATE_NAISSANCE": '<div><span class="label">Né le : </span><span class="value field">{{DATE_NAISSANCE}}</span></div>',
+}
 
 
 def parse_note_string(note_str):
@@ -261,40 +262,43 @@ def parse_note_string(note_str):
         return None
 
 
-def get_appreciation(note, matiere_nom, appreciations_dict):
-    """Genere une appreciation basee sur la note et la matiere"""
+def compile_appreciations(matieres_config, appreciations_dict, seuils=APPRECIATION_SEUILS_DEFAUT):
+    """Compile les appreciations d'un profil une seule fois en table plate :
+    le texte de la matiere d'indice i (ordre de matieres_config) au niveau n est
+    textes[i * nb_niveaux + n]. Retourne {"seuils", "nb_niveaux", "textes"}."""
+    textes = []
+    for matiere in matieres_config:
+        appreciations = appreciations_dict.get(matiere["nom"], {})
+        textes.extend(appreciations.get(niveau, APPRECIATIONS_DEFAUT[niveau])
+                      for niveau in APPRECIATION_NIVEAUX)
+    return {"seuils": tuple(seuils), "nb_niveaux": len(APPRECIATION_NIVEAUX), "textes": textes}
+
+
+def appreciation_band(note, seuils):
+    """Niveau d'appreciation d'une note (0 = insuffisant ... 4 = excellent)"""
     if note is None:
-        note = 10.5
-
-    appreciations = appreciations_dict.get(matiere_nom, {})
-
-    if note < 10:
-        return appreciations.get("insuffisant", "Des efforts sont nécessaires pour progresser.")
-    elif note < 12:
-        return appreciations.get("passable", "Résultats encourageants. Continuez vos efforts.")
-    elif note < 14:
-        return appreciations.get("assez_bien", "Bon travail. Poursuivez dans cette voie.")
-    elif note < 16:
-        return appreciations.get("bien", "Très bon travail. Continuez ainsi.")
-    else:
-        return appreciations.get("excellent", "Excellents résultats. Félicitations.")
-
-
-def get_appreciation_generale(prenom, moyenne):
-    """Genere une appreciation generale personnalisee"""
-    if moyenne is None:
-        moyenne = 10.5
-
-    if moyenne < 10:
-        return f"{prenom} doit fournir davantage d'efforts pour progresser. Un travail régulier et soutenu permettra d'améliorer les résultats l'année prochaine."
-    elif moyenne < 12:
-        return f"{prenom} montre des résultats encourageants. Avec plus de régularité dans le travail, les résultats continueront de s'améliorer."
-    elif moyenne < 14:
-        return f"{prenom} fournit un bon travail cette année. Les bases sont acquises et les efforts doivent être maintenus pour progresser davantage."
-    elif moyenne < 16:
-        return f"{prenom} a fourni un travail régulier et rigoureux tout au long de l'année. Les résultats sont très satisfaisants. Continuez ainsi."
-    else:
-        return f"{prenom} a fourni un travail remarquable tout au long de l'année. Félicitations pour ces excellents résultats."
+        note = NOTE_APPRECIATION_DEFAUT
+    return bisect_right(seuils, note)
+
+
+def appreciation_bands(notes, seuils):
+    """Version vectorisee de appreciation_band : niveaux de toute une matrice
+    de notes (NaN = pas de note)"""
+    notes = np.where(np.isnan(notes), NOTE_APPRECIATION_DEFAUT, notes)
+    return np.searchsorted(np.asarray(seuils, dtype=float), notes, side="right")
+
+
+def get_appreciation(note, matiere_id, table, band=None):
+    """Appreciation de la matiere d'indice matiere_id (table de compile_appreciations).
+    band: niveau deja calcule (appreciation_bands), sinon deduit de la note"""
+    if band is None:
+        band = appreciation_band(note, table["seuils"])
+    return table["textes"][matiere_id * table["nb_niveaux"] + band]
+
+
+def get_appreciation_generale(prenom, moyenne, table):
+    """Appreciation generale personnalisee selon le niveau de la moyenne"""
+    return str(prenom) + APPRECIATIONS_GENERALES[appreciation_band(moyenne, table["seuils"])]
 
 
 def format_note(note):
@@ -331,6 +335,7 @@ def capitalize_name(name):
     return ' '.join(result)
 
 
+@lru_cache(maxsize=None)
 def normalize_key(name):
     """Normalise un nom pour comparaison: minuscules, sans accents, espaces/tirets unifies"""
     if not name:
@@ -347,6 +352,25 @@ def make_student_key(prenom, nom):
     return (normalize_key(prenom), normalize_key(nom))
 
 
+# Index des identites, construit une fois par execution :
+# (prenom, nom) bruts -> identifiant entier, cle normalisee -> identifiant entier
+_raw_student_ids = {}
+_student_ids = {}
+
+
+def student_id(prenom, nom):
+    """Identifiant entier d'un etudiant. Toutes les jointures entre notes/,
+    nouveauxresultats/, Identites.xlsx et Bulletins PAES passent par cet
+    identifiant : un meme couple (prenom, nom) n'est normalise qu'une fois."""
+    raw = (prenom, nom)
+    sid = _raw_student_ids.get(raw)
+    if sid is None:
+        key = make_student_key(prenom, nom)
+        sid = _student_ids.setdefault(key, len(_student_ids))
+        _raw_student_ids[raw] = sid
+    return sid
+
+
 def sanitize_filename(text):
     """Nettoie un texte pour en faire un nom de fichier valide"""
     text = unicodedata.normalize('NFKD', str(text))
@@ -356,330 +380,629 @@ def sanitize_filename(text):
     return text.lower()
 
 
-def load_excel_data():
-    """Charge les donnees depuis les fichiers Excel du dossier notes/
-    Chaque fichier = 1 matiere. Les eleves sont fusionnes par prenom+nom."""
-    students_map = {}  # cle = (prenom_lower, nom_lower) -> student dict
-
-    for matiere in MATIERES_PAES:
-        excel_file = matiere.get("excel_file")
-        if not excel_file:
-            continue
+def read_config_file(path):
+    """Lit un fichier de configuration JSON ou YAML.
+    Un fichier peut decrire une cohorte (objet) ou plusieurs (liste)."""
+    text = path.read_text(encoding="utf-8")
+    if path.suffix == ".json":
+        data = json.loads(text)
+    elif yaml is None:
+        raise ValueError(f"{path.name}: PyYAML requis pour lire les configurations YAML")
+    else:
+        data = yaml.safe_load(text)
+    return data if isinstance(data, list) else [data]
+
+
+def prepare_cohort(config, source):
+    """Valide une configuration de cohorte et resout ses chemins depuis BASE_DIR.
+    Les profils sans "matieres" affichent les matieres de la cohorte (sauf celles
+    marquees "bulletin": false) ; une matiere de profil peut reprendre les notes d'une matiere de la cohorte via "source"."""
+    missing = [key for key in COHORT_REQUIRED_KEYS if key not in config]
+    if missing:
+        raise ValueError(f"{source}: clés manquantes {missing}")
+    noms = {m["nom"] for m in config["matieres"]}
+
+    cohort = dict(config)
+    cohort["source"] = source
+    cohort.setdefault("choix", [])
+    try:
+        cohort["transformation"] = grade_transform_spec(cohort.get("transformation", TRANSFORMATION_DEFAUT))
+        cohort["matieres"] = [dict(m, transformation=grade_transform_spec(m["transformation"]))
+                              if "transformation" in m else m for m in config["matieres"]]
+        for spec in [cohort["transformation"]] + [m["transformation"] for m in cohort["matieres"]
+                                                  if "transformation" in m]:
+            apply_grade_transform(spec, np.array([10.0]))
+    except ValueError as e:
+        raise ValueError(f"{source}: {e}")
+
+    sources = []
+    for source_config in config["sources"]:
+        entry = dict(source_config)
+        if entry.get("role") not in SOURCE_ROLES:
+            raise ValueError(f"{source}: rôle {entry.get('role')!r} invalide pour {entry.get('fichier')} "
+                             f"(rôles: {list(SOURCE_ROLES)})")
+        if entry["role"] in NOTE_SOURCE_ROLES and entry.get("matiere") not in noms:
+            raise ValueError(f"{source}: matière inconnue {entry.get('matiere')!r} pour {entry['fichier']}")
+        entry["chemin"] = BASE_DIR / entry.get("dossier", ".") / entry["fichier"]
+        # Alias normalises et hashables : la detection des colonnes est memorisee
+        aliases = {**SOURCE_COLUMNS, **entry.get("colonnes", {})}
+        entry["colonnes"] = tuple((champ, tuple(alias.strip().lower() for alias in noms_colonne))
+                                  for champ, noms_colonne in aliases.items())
+        sources.append(entry)
+    cohort["sources"] = sources
+
+    profils = []
+    for profil_config in config["profils"]:
+        missing = [key for key in PROFILE_REQUIRED_KEYS if key not in profil_config]
+        if missing:
+            raise ValueError(f"{source}: clés manquantes {missing} dans un profil")
+        profil = dict(profil_config)
+        profil.setdefault("libelle", profil["cle"].upper())
+        profil.setdefault("matieres", [m for m in config["matieres"] if m.get("bulletin", True)])
+        profil["template"] = BASE_DIR / profil["template"]
+        seuils = tuple(profil.get("seuils_appreciation", APPRECIATION_SEUILS_DEFAUT))
+        if len(seuils) != len(APPRECIATION_NIVEAUX) - 1 or list(seuils) != sorted(seuils):
+            raise ValueError(f"{source}: profil {profil['cle']}, seuils_appreciation doit contenir "
+                             f"{len(APPRECIATION_NIVEAUX) - 1} notes croissantes: {list(seuils)}")
+        profil["seuils_appreciation"] = seuils
+        for matiere in profil["matieres"]:
+            if matiere.get("source", matiere["nom"]) not in noms:
+                raise ValueError(f"{source}: profil {profil['cle']}, matière source inconnue "
+                                 f"{matiere.get('source', matiere['nom'])!r}")
+        profils.append(profil)
+    cohort["profils"] = profils
+    return cohort
+
+
+def load_registry(paths=None):
+    """Charge les cohortes decrites dans config/ (ou dans les fichiers donnes).
+    Retourne {nom de cohorte: cohorte}, dans l'ordre des fichiers.
+    Leve ValueError si la configuration est absente, invalide ou ambigue."""
+    if paths is None:
+        paths = sorted(p for p in CONFIG_DIR.glob("*") if p.suffix in CONFIG_EXTENSIONS)
+    if not paths:
+        raise ValueError(f"Aucune configuration de cohorte dans {CONFIG_DIR}")
+
+    registry = {}
+    profil_keys = set()
+    for path in paths:
+        for config in read_config_file(Path(path)):
+            cohort = prepare_cohort(config, Path(path).name)
+            if cohort["cohorte"] in registry:
+                raise ValueError(f"{cohort['source']}: cohorte {cohort['cohorte']!r} déjà définie")
+            # Les dossiers de sortie et le manifeste sont indexes par cle de profil
+            for profil in cohort["profils"]:
+                if profil["cle"] in profil_keys:
+                    raise ValueError(f"{cohort['source']}: profil {profil['cle']!r} déjà défini")
+                profil_keys.add(profil["cle"])
+            cohort["rang"] = len(registry)
+            registry[cohort["cohorte"]] = cohort
+    return registry
+
+
+def get_cli_transform():
+    """Transformation imposee a toutes les matieres par --transformation
+    (nom seul, ex: rang, ou objet JSON, ex: '{"nom": "zscore", "moyenne": 12}'), ou None"""
+    value = get_cli_option("--transformation")
+    if value is None:
+        return None
+    spec = json.loads(value) if value.lstrip().startswith("{") else {"nom": value}
+    apply_grade_transform(spec, np.array([10.0]))
+    return spec
 
-        filepath = NOTES_DIR / excel_file
-        if not filepath.exists():
-            print(f"  [WARN] Fichier non trouvé: {filepath}")
-            continue
 
-        wb = load_workbook(filepath)
-        ws = wb.active
+def get_registry():
+    """Cohortes a generer : --config f1,f2 (defaut: config/*), --cohortes a,b (defaut: toutes).
+    Avec --transformation, la transformation remplace celles de la configuration."""
+    paths = get_cli_option("--config")
+    registry = load_registry(paths.split(",") if paths else None)
+    selection = get_cli_option("--cohortes")
+    if selection:
+        names = [name.strip() for name in selection.split(",")]
+        unknown = [name for name in names if name not in registry]
+        if unknown:
+            raise ValueError(f"Cohortes inconnues: {unknown} (disponibles: {list(registry)})")
+        registry = {name: registry[name] for name in names}
 
-        # Lire les en-tetes pour identifier les colonnes
-        headers = []
-        for cell in ws[1]:
-            headers.append(str(cell.value or "").strip())
+    transform = get_cli_transform()
+    if transform is not None:
+        for cohort in registry.values():
+            cohort["transformation_imposee"] = transform
+    return registry
 
-        # Trouver les index des colonnes
-        def find_col(names):
-            for name in names:
-                for i, h in enumerate(headers):
-                    if h.lower() == name.lower():
-                        return i
-            return None
 
-        col_prenom = find_col(["Prenom", "Prénom"])
-        col_nom = find_col(["Nom"])
-        col_email = find_col(["Email", "Mail"])
-        col_note = find_col(["Note"])
+def cohort_transforms(cohort):
+    """Transformation de chaque matiere de la cohorte : --transformation, sinon celle
+    de la matiere, sinon celle de la cohorte"""
+    return [cohort.get("transformation_imposee") or m.get("transformation", cohort["transformation"])
+            for m in cohort["matieres"]]
 
-        if col_prenom is None or col_nom is None:
-            print(f"  [WARN] Colonnes Prenom/Nom non trouvées dans {excel_file}: {headers}")
-            continue
 
-        for row in ws.iter_rows(min_row=2, values_only=True):
-            if row[col_nom] is None:
-                continue
+def registry_profiles(registry):
+    """Tous les profils des cohortes chargees"""
+    return [profil for cohort in registry.values() for profil in cohort["profils"]]
 
-            prenom = capitalize_name(str(row[col_prenom] or ""))
-            nom = capitalize_name(str(row[col_nom] or ""))
-            email = str(row[col_email] or "").strip() if col_email is not None else ""
 
-            if not prenom and not nom:
-                continue
+def parse_choix(cohort, parcoursup):
+    """Choix de bulletin d'apres la colonne Parcoursup (regles "choix" de la cohorte)"""
+    for regle in cohort["choix"]:
+        if any(mot in parcoursup for mot in regle["mots"]):
+            return regle["choix"]
+    return "Formulaire non rempli"
 
-            key = make_student_key(prenom, nom)
 
-            if key not in students_map:
-                students_map[key] = {
-                    "nom": nom,
-                    "prenom": prenom,
-                    "date_naissance": None,
-                    "email": email,
-                    "notes": {}
-                }
-            elif email and not students_map[key]["email"]:
-                students_map[key]["email"] = email
+# Lignes des classeurs deja lues : {chemin: [ligne d'en-tete, lignes...]}
+# Chaque classeur n'est ouvert qu'une fois, tous les chargeurs partagent ses lignes.
+_workbook_rows = {}
 
-            # Parser la note
-            note_raw = row[col_note] if col_note is not None else None
-            note_value = parse_note_string(note_raw)
-            students_map[key]["notes"][matiere["nom"]] = note_value
 
+def read_workbook_rows(filepath):
+    """Lit la feuille active d'un classeur en mode lecture seule (streaming).
+    Retourne toutes les lignes (tuples de valeurs), en-tete compris, completees
+    par des None a la largeur de la plus longue ligne."""
+    wb = load_workbook(filepath, read_only=True)
+    try:
+        rows = [tuple(row) for row in wb.active.iter_rows(values_only=True)]
+    finally:
         wb.close()
+    # En lecture seule, une feuille sans dimensions renvoie des lignes de longueurs variables
+    width = max((len(row) for row in rows), default=0)
+    return [row + (None,) * (width - len(row)) for row in rows]
 
-    # Charger les dates de naissance depuis Identites.xlsx
-    identites_file = BASE_DIR / "Identites.xlsx"
-    if identites_file.exists():
-        print(f"  [OK] Chargement des identités depuis Identites.xlsx...")
-        wb_id = load_workbook(identites_file)
-        ws_id = wb_id.active
-        matched = 0
 
-        for row in ws_id.iter_rows(min_row=2, values_only=True):
-            if row[2] is None or row[3] is None:
-                continue
-            nom_id = capitalize_name(str(row[2] or ""))
-            prenom_id = capitalize_name(str(row[3] or ""))
-            date_naiss = row[4]  # datetime object
-            key = make_student_key(prenom_id, nom_id)
+def file_sha256(filepath):
+    """Empreinte SHA-256 du contenu d'un fichier"""
+    with open(filepath, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
 
-            if key in students_map:
-                students_map[key]["date_naissance"] = date_naiss
-                matched += 1
 
-        wb_id.close()
-        print(f"  [OK] {matched} dates de naissance associées")
-    else:
-        print(f"  [WARN] Fichier Identites.xlsx non trouvé")
+def workbook_cache_path(filepath):
+    """Chemin du fichier cache associe a un classeur"""
+    rel = os.path.relpath(filepath, BASE_DIR)
+    digest = hashlib.sha1(rel.encode("utf-8")).hexdigest()[:12]
+    return WORKBOOK_CACHE_DIR / f"{sanitize_filename(Path(rel).stem)}_{digest}.pickle"
 
-    return list(students_map.values())
 
+def load_cached_rows(filepath):
+    """Retourne les lignes en cache d'un classeur, ou None si le cache est absent ou perime.
+    Le cache est valide si taille et date de modification sont inchangees, ou si
+    seule la date a change mais que le contenu (SHA-256) est identique."""
+    cache_path = workbook_cache_path(filepath)
+    if not cache_path.exists():
+        return None
+    try:
+        with open(cache_path, 'rb') as f:
+            cached = pickle.load(f)
+    except Exception:
+        return None
+    if cached.get("version") != WORKBOOK_CACHE_VERSION:
+        return None
+    st = os.stat(filepath)
+    if cached["size"] != st.st_size:
+        return None
+    if cached["mtime_ns"] != st.st_mtime_ns:
+        if cached["sha256"] != file_sha256(filepath):
+            return None
+        save_cached_rows(filepath, cached["rows"], cached["sha256"])
+    return cached["rows"]
+
+
+def save_cached_rows(filepath, rows, sha256=None):
+    """Enregistre les lignes d'un classeur dans le cache disque"""
+    st = os.stat(filepath)
+    cached = {
+        "version": WORKBOOK_CACHE_VERSION,
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "sha256": sha256 or file_sha256(filepath),
+        "rows": rows,
+    }
+    cache_path = workbook_cache_path(filepath)
+    try:
+        WORKBOOK_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(".tmp")
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(cached, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"  [WARN] Cache non écrit pour {Path(filepath).name}: {e}")
+
+
+def get_workbook_rows(filepath):
+    """Retourne les lignes d'un classeur (lu une seule fois, puis partage).
+    Le cache disque est consulte avant d'ouvrir le fichier avec openpyxl."""
+    key = str(filepath)
+    if key not in _workbook_rows:
+        rows = load_cached_rows(filepath)
+        if rows is None:
+            rows = read_workbook_rows(filepath)
+            save_cached_rows(filepath, rows)
+        _workbook_rows[key] = rows
+    return _workbook_rows[key]
+
+
+def workbook_sources(registry):
+    """Liste des classeurs Excel lus par les sources de toutes les cohortes
+    (fichiers presents uniquement, chacun une seule fois)"""
+    paths = [source["chemin"] for cohort in registry.values() for source in cohort["sources"]]
+    return [path for path in dict.fromkeys(paths) if path.exists()]
+
+
+def preload_workbooks(registry, workers=1):
+    """Lit tous les classeurs sources : depuis le cache disque si possible,
+    sinon avec openpyxl (en parallele si workers > 1).
+    Retourne (nombre de classeurs, nombre lus depuis le cache)."""
+    paths = [path for path in workbook_sources(registry) if str(path) not in _workbook_rows]
+    to_read = []
+    for path in paths:
+        rows = load_cached_rows(path)
+        if rows is None:
+            to_read.append(path)
+        else:
+            _workbook_rows[str(path)] = rows
 
-def load_identity_choices():
-    """Charge Identites.xlsx et retourne un dict pour enrichir l'index.
-    Retourne: {(prenom_lower, nom_lower): {"date_naissance": ..., "choix": ...}}
-    choix = "Bulletin PAES" | "Bulletin Linova"
-    """
-    for filename in ("identity.xlsx", "Identites.xlsx"):
-        filepath = BASE_DIR / filename
-        if not filepath.exists():
-            continue
-        wb = load_workbook(filepath)
-        ws = wb.active
-        out = {}
-        for row in ws.iter_rows(min_row=2, values_only=True):
-            if len(row) <= 3 or (row[2] is None and row[3] is None):
-                continue
-            nom = capitalize_name(str(row[2] or ""))
-            prenom = capitalize_name(str(row[3] or ""))
-            if not nom and not prenom:
-                continue
-            key = make_student_key(prenom, nom)
-            date_naiss = row[4] if len(row) > 4 else None
-            parcoursup = str(row[5] or "").strip() if len(row) > 5 else ""
-            if "PAES" in parcoursup or "Diploma" in parcoursup:
-                choix = "Bulletin PAES"
-            elif "Linova" in parcoursup or "BTS" in parcoursup:
-                choix = "Bulletin Linova"
-            else:
-                choix = "Formulaire non rempli"
-            out[key] = {"date_naissance": date_naiss, "choix": choix}
-        wb.close()
-        print(f"  [OK] Identités chargées depuis {filename}: {len(out)} élèves")
-        return out
-    print(f"  [WARN] Aucun fichier identité trouvé (identity.xlsx / Identites.xlsx)")
-    return {}
+    if workers > 1 and len(to_read) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(to_read))) as pool:
+            for path, rows in zip(to_read, pool.map(read_workbook_rows, to_read)):
+                _workbook_rows[str(path)] = rows
+                save_cached_rows(path, rows)
+    else:
+        for path in to_read:
+            get_workbook_rows(path)
+    return len(paths), len(paths) - len(to_read)
+
+
+def source_headers(row):
+    """En-tetes d'un classeur normalises pour la detection des colonnes
+    (sans espaces de bord, minuscules)"""
+    return tuple(str(value or "").strip().lower() for value in row)
+
+
+@lru_cache(maxsize=None)
+def find_source_columns(headers, colonnes):
+    """Index de chaque champ d'une source dans sa ligne d'en-tete (None si absent).
+    colonnes: ((champ, (alias normalises, ...)), ...), le premier alias present l'emporte.
+    Les classeurs d'un meme export partagent leur en-tete : analyse une seule fois."""
+    positions = {}
+    for i, header in enumerate(headers):
+        positions.setdefault(header, i)
+    return {champ: next((positions[alias] for alias in aliases if alias in positions), None)
+            for champ, aliases in colonnes}
+
+
+def read_source(source):
+    """Lit une source de la cohorte en un seul passage sur les lignes du classeur.
+    Retourne la liste des enregistrements {"_id", "prenom", "nom", "email", "note",
+    "date_naissance", "parcoursup"} (champ sans colonne : None ou ""),
+    [] si les colonnes Prenom/Nom sont introuvables, None si le classeur est absent."""
+    filepath = source["chemin"]
+    if not filepath.exists():
+        return None
+    rows = get_workbook_rows(filepath)
+    if not rows:
+        return []
 
+    colonnes = find_source_columns(source_headers(rows[0]), source["colonnes"])
+    if colonnes["prenom"] is None or colonnes["nom"] is None:
+        print(f"  [WARN] Colonnes Prenom/Nom non trouvées dans {source['fichier']}: "
+              f"{[str(value or '').strip() for value in rows[0]]}")
+        return []
 
-def load_nouveaux_resultats(existing_keys):
-    """Charge les resultats depuis nouveauxresultats/ pour les etudiants
-    qui n'existent PAS deja dans les donnees notes/.
-    existing_keys: set de (prenom_lower, nom_lower)
-    Retourne une liste de nouveaux etudiants avec notes mappees aux matieres PAES.
-    """
-    new_students_map = {}
+    # Conversion en bloc : un seul itemgetter extrait tous les champs presents d'une ligne
+    champs = [champ for champ, i in colonnes.items() if i is not None]
+    extract = itemgetter(*(colonnes[champ] for champ in champs))
+    # Classeur de resultats : ligne ignoree sans nom ; formulaire : sans nom ni prenom
+    note_source = source["role"] in NOTE_SOURCE_ROLES
 
-    for entry in NOUVEAUX_RESULT_FILES:
-        filepath = NOUVEAUX_RESULTATS_DIR / entry["file"]
-        if not filepath.exists():
-            print(f"  [WARN] Fichier nouveaux résultats non trouvé: {filepath}")
+    records = []
+    for values in map(extract, rows[1:]):
+        row = dict(zip(champs, values))
+        if row["nom"] is None and (note_source or row["prenom"] is None):
             continue
-
-        paes_matiere = entry["paes_matiere"]
-
-        wb = load_workbook(filepath)
-        ws = wb.active
-
-        headers = []
-        for cell in ws[1]:
-            headers.append(str(cell.value or "").strip())
-
-        def find_col(names):
-            for name in names:
-                for i, h in enumerate(headers):
-                    if h.lower() == name.lower():
-                        return i
-            return None
-
-        col_prenom = find_col(["Prenom", "Prénom"])
-        col_nom = find_col(["Nom"])
-        col_email = find_col(["Email", "Mail"])
-        col_note = find_col(["Note"])
-
-        if col_prenom is None or col_nom is None:
-            print(f"  [WARN] Colonnes Prenom/Nom non trouvées dans {entry['file']}: {headers}")
-            wb.close()
+        prenom = capitalize_name(str(row["prenom"] or ""))
+        nom = capitalize_name(str(row["nom"] or ""))
+        if not prenom and not nom:
             continue
+        records.append({
+            "_id": student_id(prenom, nom),
+            "prenom": prenom,
+            "nom": nom,
+            "email": str(row.get("email") or "").strip(),
+            "note": parse_note_string(row.get("note")),
+            "date_naissance": row.get("date_naissance"),
+            "parcoursup": str(row.get("parcoursup") or "").strip(),
+        })
+    return records
 
-        for row in ws.iter_rows(min_row=2, values_only=True):
-            if row[col_nom] is None:
-                continue
-
-            prenom = capitalize_name(str(row[col_prenom] or ""))
-            nom = capitalize_name(str(row[col_nom] or ""))
-            email = str(row[col_email] or "").strip() if col_email is not None else ""
-
-            if not prenom and not nom:
-                continue
-
-            key = make_student_key(prenom, nom)
 
-            if key in existing_keys:
+def students_from_note_sources(sources, skip_ids=frozenset(), is_new=False):
+    """Eleves des sources de notes lues [(source, enregistrements)] : 1 source = 1 matiere,
+    eleves fusionnes par identifiant, ceux de skip_ids ignores"""
+    students_map = {}
+    for source, records in sources:
+        for record in records or ():
+            sid = record["_id"]
+            if sid in skip_ids:
                 continue
-
-            if key not in new_students_map:
-                new_students_map[key] = {
-                    "nom": nom,
-                    "prenom": prenom,
+            student = students_map.get(sid)
+            if student is None:
+                student = students_map[sid] = {
+                    "_id": sid,
+                    "nom": record["nom"],
+                    "prenom": record["prenom"],
                     "date_naissance": None,
-                    "email": email,
+                    "email": record["email"],
                     "notes": {},
-                    "_is_new": True,
                 }
-            elif email and not new_students_map[key]["email"]:
-                new_students_map[key]["email"] = email
-
-            note_raw = row[col_note] if col_note is not None else None
-            note_value = parse_note_string(note_raw)
-            new_students_map[key]["notes"][paes_matiere] = note_value
-
-        wb.close()
-
-    return list(new_students_map.values())
+                if is_new:
+                    student["_is_new"] = True
+            elif record["email"] and not student["email"]:
+                student["email"] = record["email"]
+            student["notes"][source["matiere"]] = record["note"]
+    return list(students_map.values())
 
 
-def load_bulletins_paes_identities():
-    """Charge les identites depuis nouveauxresultats/Bulletins PAES .xlsx.
-    Retourne: {(prenom_lower, nom_lower): {"date_naissance": ..., "choix": ...}}
+def apply_birth_dates(sources, students):
+    """Dates de naissance des sources "dates" pour les eleves des classeurs de notes.
+    Retourne le nombre de dates associees."""
+    par_id = {s["_id"]: s for s in students}
+    matched = 0
+    for _, records in sources:
+        for record in records or ():
+            student = par_id.get(record["_id"])
+            if student is not None:
+                student["date_naissance"] = record["date_naissance"]
+                matched += 1
+    return matched
+
+
+def apply_complement_notes(sources, students):
+    """Notes des sources "complement" (ex: concours blanc) ajoutees aux eleves deja
+    charges ; un eleve absent des autres sources n'est jamais cree.
+    Retourne le nombre de notes ajoutees."""
+    par_id = {}
+    for student in students:
+        par_id.setdefault(student["_id"], student)
+    added = 0
+    for source, records in sources:
+        for record in records or ():
+            student = par_id.get(record["_id"])
+            if student is not None:
+                student["notes"][source["matiere"]] = record["note"]
+                added += 1
+    return added
+
+
+def identity_choices(cohort, sources):
+    """Date de naissance et choix de bulletin de la premiere source d'identites presente.
+    Retourne: {student_id: {"date_naissance": ..., "choix": ...}}
+    choix = un des choix de la cohorte (ex: "Bulletin PAES" | "Bulletin Linova")
     """
-    filepath = NOUVEAUX_RESULTATS_DIR / "Bulletins PAES .xlsx"
-    if not filepath.exists():
-        print(f"  [WARN] Bulletins PAES .xlsx non trouvé dans nouveauxresultats/")
-        return {}
-
-    wb = load_workbook(filepath)
-    ws = wb.active
-
-    out = {}
-    for row in ws.iter_rows(min_row=2, values_only=True):
-        if row[2] is None and row[3] is None:
-            continue
-        nom = capitalize_name(str(row[2] or ""))
-        prenom = capitalize_name(str(row[3] or ""))
-        if not nom and not prenom:
+    for source, records in sources:
+        if records is None:
             continue
-        key = make_student_key(prenom, nom)
-        date_naiss = row[4] if len(row) > 4 else None
-        parcoursup = str(row[5] or "").strip() if len(row) > 5 else ""
-
-        if "PAES" in parcoursup or "Diploma" in parcoursup:
-            choix = "Bulletin PAES"
-        elif "Linova" in parcoursup or "BTS" in parcoursup:
-            choix = "Bulletin Linova"
-        else:
-            choix = "Formulaire non rempli"
-
-        out[key] = {"date_naissance": date_naiss, "choix": choix}
-
-    wb.close()
-    print(f"  [OK] Identités Bulletins PAES chargées: {len(out)} élèves")
-    return out
-
-
-def load_bulletins_paes_only_students(existing_keys, nouveaux_keys):
-    """Charge les etudiants de Bulletins PAES .xlsx qui n'ont aucune note
-    ni dans notes/ ni dans nouveauxresultats/.
-    Retourne une liste d'etudiants avec notes vides (seront aleatoires).
-    """
-    filepath = NOUVEAUX_RESULTATS_DIR / "Bulletins PAES .xlsx"
-    if not filepath.exists():
-        return []
+        out = {r["_id"]: {"date_naissance": r["date_naissance"], "choix": parse_choix(cohort, r["parcoursup"])}
+               for r in records}
+        print(f"  [OK] Identités chargées depuis {source['fichier'].strip()}: {len(out)} élèves")
+        return out
+    if sources:
+        print(f"  [WARN] Aucun fichier identité trouvé ({' / '.join(s['fichier'] for s, _ in sources)})")
+    return {}
 
-    wb = load_workbook(filepath)
-    ws = wb.active
 
+def students_from_identity_sources(cohort, sources, skip_ids):
+    """Eleves des sources "identites_nouveaux" qui n'ont aucune note dans les autres
+    sources (skip_ids). Retourne une liste d'eleves aux notes vides (seront aleatoires)."""
     students = []
-    for row in ws.iter_rows(min_row=2, values_only=True):
-        if row[2] is None and row[3] is None:
-            continue
-        nom = capitalize_name(str(row[2] or ""))
-        prenom = capitalize_name(str(row[3] or ""))
-        if not nom and not prenom:
-            continue
-        key = make_student_key(prenom, nom)
-
-        if key in existing_keys or key in nouveaux_keys:
-            continue
+    for _, records in sources:
+        for record in records or ():
+            if record["_id"] in skip_ids:
+                continue
+            students.append({
+                "_id": record["_id"],
+                "nom": record["nom"],
+                "prenom": record["prenom"],
+                "date_naissance": record["date_naissance"],
+                "email": record["email"],
+                "notes": {},
+                "choix": parse_choix(cohort, record["parcoursup"]),
+                "_is_new": True,
+            })
+    return students
 
-        email = str(row[1] or "").strip() if len(row) > 1 else ""
-        date_naiss = row[4] if len(row) > 4 else None
-        parcoursup = str(row[5] or "").strip() if len(row) > 5 else ""
 
-        if "PAES" in parcoursup or "Diploma" in parcoursup:
-            choix = "Bulletin PAES"
-        elif "Linova" in parcoursup or "BTS" in parcoursup:
-            choix = "Bulletin Linova"
+@lru_cache(maxsize=None)
+def compile_template(template):
+    """Decoupe un template une seule fois en segments (texte fixe / champ {{NOM}}).
+    Retourne {"segments": [...], "placeholders": frozenset(...)}.
+    Un segment champ est un tuple (nom, prefixe, suffixe) : prefixe et suffixe
+    ne sont non vides que pour les lignes de OPTIONAL_TEMPLATE_LINES, qui
+    disparaissent entierement quand la valeur est vide."""
+    optional_lines = {line: name for name, line in OPTIONAL_TEMPLATE_LINES.items()}
+    pattern = "|".join([re.escape(line) for line in optional_lines] + [PLACEHOLDER_RE.pattern])
+
+    segments = []
+    placeholders = set()
+    pos = 0
+    for match in re.finditer(pattern, template):
+        if match.start() > pos:
+            segments.append(template[pos:match.start()])
+        text = match.group(0)
+        if text in optional_lines:
+            name = optional_lines[text]
+            prefix, suffix = text.split("{{" + name + "}}", 1)
         else:
-            choix = "Formulaire non rempli"
-
-        students.append({
-            "nom": nom,
-            "prenom": prenom,
-            "date_naissance": date_naiss,
-            "email": email,
-            "notes": {},
-            "choix": choix,
-            "_is_new": True,
-        })
-
-    wb.close()
-    return students
+            name = PLACEHOLDER_RE.fullmatch(text).group(1)
+            prefix, suffix = "", ""
+        segments.append((name, prefix, suffix))
+        placeholders.add(name)
+        pos = match.end()
+    if pos < len(template):
+        segments.append(template[pos:])
+
+    return {"segments": segments, "placeholders": frozenset(placeholders)}
+
+
+def render_template(compiled, values):
+    """Remplit un template compile en une seule passe.
+    Leve ValueError si un champ du template n'a pas de valeur ou si une
+    valeur ne correspond a aucun champ du template."""
+    placeholders = compiled["placeholders"]
+    if placeholders != values.keys():
+        missing = sorted(placeholders - values.keys())
+        unknown = sorted(values.keys() - placeholders)
+        raise ValueError(f"Champs de template incoherents (manquants: {missing}, inconnus: {unknown})")
+
+    parts = []
+    for segment in compiled["segments"]:
+        if isinstance(segment, str):
+            parts.append(segment)
+            continue
+        name, prefix, suffix = segment
+        value = values[name]
+        if prefix or suffix:
+            if value:
+                parts.append(prefix)
+                parts.append(value)
+                parts.append(suffix)
+        else:
+            parts.append(value)
+    return "".join(parts)
 
 
-def calculate_class_stats(students, matieres_config, notes_key_fn=None):
-    """Calcule les statistiques de classe pour chaque matiere.
-    notes_key_fn: fonction qui prend une matiere et retourne la cle dans student['notes']
-    """
+def build_grade_matrix(students, matieres_config, notes_key_fn=None):
+    """Construit la matrice eleves x matieres des notes brutes (NaN = pas de note)"""
     if notes_key_fn is None:
         notes_key_fn = lambda m: m["nom"]
 
-    stats = {}
+    keys = [notes_key_fn(m) for m in matieres_config]
+    matrix = np.full((len(students), len(keys)), np.nan)
+    for i, student in enumerate(students):
+        notes = student["notes"]
+        for j, key in enumerate(keys):
+            note = notes.get(key)
+            if note is None or note == "-" or note == "":
+                continue
+            try:
+                matrix[i, j] = float(note)
+            except (ValueError, TypeError):
+                pass
+    return matrix
+
+
+def linear_transform(notes, a=1.0, b=0.0, min=None, max=None):
+    """Transformation lineaire a * x + b, bornee par min/max"""
+    adjusted = a * notes + b
+    if max is not None:
+        adjusted = np.minimum(adjusted, max)
+    if min is not None:
+        adjusted = np.maximum(adjusted, min)
+    return adjusted
+
+
+def piecewise_transform(notes, points):
+    """Interpolation lineaire entre les points [[note brute, note ajustee], ...]
+    (notes brutes strictement croissantes ; constante au-dela des extremites)"""
+    xs, ys = zip(*points)
+    if any(x1 >= x2 for x1, x2 in zip(xs, xs[1:])):
+        raise ValueError(f"notes brutes des points non strictement croissantes: {list(xs)}")
+    return np.where(np.isnan(notes), np.nan, np.interp(notes, xs, ys))
+
+
+def rank_transform(notes, bas=8.0, haut=18.0):
+    """Rang centile dans la matiere ramene lineairement entre bas et haut
+    (ex aequo : rang moyen ; une seule note : milieu de l'intervalle)"""
+    adjusted = np.full(notes.shape, np.nan)
+    valid = ~np.isnan(notes)
+    values = notes[valid]
+    if values.size == 0:
+        return adjusted
+    ordered = np.sort(values)
+    rangs = (np.searchsorted(ordered, values, "left") + np.searchsorted(ordered, values, "right") - 1) / 2
+    centiles = rangs / (values.size - 1) if values.size > 1 else np.full(values.size, 0.5)
+    adjusted[valid] = bas + centiles * (haut - bas)
+    return adjusted
+
+
+def zscore_transform(notes, moyenne=12.0, ecart_type=2.0, min=0.0, max=20.0):
+    """Recentrage de la matiere sur une moyenne et un ecart-type cibles, borne par min/max"""
+    valid = notes[~np.isnan(notes)]
+    if valid.size == 0:
+        return notes.copy()
+    std = valid.std()
+    # Toutes les notes egales : chacune recoit la moyenne cible, les absentes restent NaN
+    scores = (notes - valid.mean()) / std if std > 0 else np.where(np.isnan(notes), np.nan, 0.0)
+    return np.clip(scores * ecart_type + moyenne, min, max)
+
+
+# Transformations disponibles : fonction(colonne de notes brutes, NaN = pas de note, **parametres)
+GRADE_TRANSFORMS = {
+    "lineaire": linear_transform,
+    "par_morceaux": piecewise_transform,
+    "rang": rank_transform,
+    "zscore": zscore_transform,
+}
 
-    for matiere in matieres_config:
-        note_key = notes_key_fn(matiere)
-        notes = []
 
-        for student in students:
-            raw_note = student["notes"].get(note_key)
-            adjusted = adjust_grade(raw_note)
-            if adjusted is not None:
-                notes.append(adjusted)
+def grade_transform_spec(spec):
+    """Forme complete d'une transformation : un nom seul ("rang") vaut {"nom": "rang"}.
+    Leve ValueError si ce n'est ni un nom ni un objet."""
+    if isinstance(spec, str):
+        return {"nom": spec}
+    if not isinstance(spec, dict):
+        raise ValueError(f"Transformation invalide: {spec!r} (nom ou objet {{\"nom\": ...}} attendu)")
+    return spec
+
+
+def apply_grade_transform(spec, notes):
+    """Applique une transformation {"nom": ..., parametres} (ou son nom seul) a une
+    colonne de notes. Leve ValueError si la transformation ou ses parametres sont invalides."""
+    spec = grade_transform_spec(spec)
+    params = {key: value for key, value in spec.items() if key != "nom"}
+    transform = GRADE_TRANSFORMS.get(spec.get("nom"))
+    if transform is None:
+        raise ValueError(f"Transformation inconnue: {spec.get('nom')!r} (disponibles: {list(GRADE_TRANSFORMS)})")
+    try:
+        return transform(notes, **params)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Transformation {spec['nom']}: paramètres invalides {params} ({e})")
+
+
+def adjust_grade_matrix(raw_matrix, transforms=None, fillable=None):
+    """Notes ajustees de toute la matrice des notes brutes.
+    transforms: une transformation par colonne (defaut: TRANSFORMATION_DEFAUT partout),
+    appliquee a la colonne entiere en une operation.
+    Les notes manquantes recoivent une note aleatoire entre 9.5 et 12 : tirages dans
+    l'ordre ligne par ligne (eleve puis matiere) avec le module random (seed fixe).
+    fillable: colonnes completees ainsi (defaut: toutes) ; les autres gardent NaN."""
+    missing = np.isnan(raw_matrix)
+    if fillable is not None:
+        missing &= np.asarray(fillable, dtype=bool)[None, :]
+    if transforms is None:
+        transforms = [TRANSFORMATION_DEFAUT] * raw_matrix.shape[1]
+    adjusted = np.empty_like(raw_matrix)
+    for j, spec in enumerate(transforms):
+        adjusted[:, j] = apply_grade_transform(spec, raw_matrix[:, j])
+    fills = [round(random.uniform(9.5, 12.0), 1) for _ in range(int(missing.sum()))]
+    adjusted[missing] = fills
+    return adjusted
+
+
+def class_stats_from_matrix(adjusted_matrix, matieres_config):
+    """Statistiques de classe (moyenne/min/max) de chaque colonne de la matrice"""
+    valid = ~np.isnan(adjusted_matrix)
+    counts = valid.sum(axis=0)
+    sums = np.where(valid, adjusted_matrix, 0.0).sum(axis=0)
+    mins = np.where(valid, adjusted_matrix, np.inf).min(axis=0, initial=np.inf)
+    maxs = np.where(valid, adjusted_matrix, -np.inf).max(axis=0, initial=-np.inf)
 
-        if notes:
+    stats = {}
+    for j, matiere in enumerate(matieres_config):
+        if counts[j]:
             stats[matiere["nom"]] = {
-                "moyenne": sum(notes) / len(notes),
-                "min": min(notes),
-                "max": max(notes)
+                "moyenne": float(sums[j] / counts[j]),
+                "min": float(mins[j]),
+                "max": float(maxs[j])
             }
         else:
             stats[matiere["nom"]] = {
@@ -687,98 +1010,69 @@ def calculate_class_stats(students, matieres_config, notes_key_fn=None):
                 "min": None,
                 "max": None
             }
-
     return stats
 
 
-def calculate_class_stats_from_adjusted(students, matieres_config, notes_key_fn=None):
-    """Calcule les statistiques de classe a partir des notes PRE-CALCULEES (adjusted_notes).
-    notes_key_fn: fonction qui retourne la cle dans student['adjusted_notes']
-    """
-    if notes_key_fn is None:
-        notes_key_fn = lambda m: m["nom"]
+def remap_class_stats(source_stats, matieres_config, notes_key_fn):
+    """Statistiques d'un profil dont les matieres reprennent les notes d'un autre
+    profil (ex: Linova via "source") : simple remappage des colonnes"""
+    empty = {"moyenne": None, "min": None, "max": None}
+    return {m["nom"]: dict(source_stats.get(notes_key_fn(m), empty)) for m in matieres_config}
 
-    stats = {}
-
-    for matiere in matieres_config:
-        note_key = notes_key_fn(matiere)
-        notes = []
-
-        for student in students:
-            adj = student.get("adjusted_notes", {}).get(note_key)
-            if adj is not None:
-                notes.append(adj)
 
-        if notes:
-            stats[matiere["nom"]] = {
-                "moyenne": sum(notes) / len(notes),
-                "min": min(notes),
-                "max": max(notes)
-            }
-        else:
-            stats[matiere["nom"]] = {
-                "moyenne": None,
-                "min": None,
-                "max": None
-            }
-
-    return stats
-
-
-def generate_bulletin_html(student, class_stats, template, profil, matieres_config,
-                           appreciations_dict, notes_key_fn=None):
-    """Genere le HTML d'un bulletin pour un eleve"""
+def bulletin_values(student, class_stats, profil, matieres_config, appreciations,
+                    notes_key_fn=None, bands=None):
+    """Valeurs des champs du template du bulletin d'un eleve ({NOM: texte}).
+    appreciations: table compilee (compile_appreciations) pour matieres_config
+    bands: niveaux d'appreciation des matieres deja calcules pour l'eleve (optionnel)"""
     if notes_key_fn is None:
         notes_key_fn = lambda m: m["nom"]
 
-    html = template
+    values = {}
 
     # Informations etablissement
-    html = html.replace("{{NOM_ETABLISSEMENT}}", profil["nom"])
-    html = html.replace("{{ADRESSE_ETABLISSEMENT}}", profil["adresse"])
-    html = html.replace("{{CODE_POSTAL}}", profil["code_postal"])
-    html = html.replace("{{VILLE}}", profil["ville"])
-    html = html.replace("{{ANNEE_SCOLAIRE}}", profil["annee_scolaire"])
-    html = html.replace("{{CLASSE}}", profil["classe"])
-    html = html.replace("{{CHARGE_ETUDES}}", profil["charge_etudes"])
-    html = html.replace("{{SEMESTRE}}", profil["semestre"])
-    html = html.replace("{{LOGO_FILE}}", profil["logo"])
-    html = html.replace("{{TAMPON_FILE}}", profil["tampon"])
+    values["NOM_ETABLISSEMENT"] = profil["nom"]
+    values["ADRESSE_ETABLISSEMENT"] = profil["adresse"]
+    values["CODE_POSTAL"] = profil["code_postal"]
+    values["VILLE"] = profil["ville"]
+    values["ANNEE_SCOLAIRE"] = profil["annee_scolaire"]
+    values["CLASSE"] = profil["classe"]
+    values["CHARGE_ETUDES"] = profil["charge_etudes"]
+    values["SEMESTRE"] = profil["semestre"]
+    values["LOGO_FILE"] = profil["logo"]
+    values["TAMPON_FILE"] = profil["tampon"]
 
     # Informations eleve
-    html = html.replace("{{PRENOM_ELEVE}}", str(student["prenom"] or ""))
-    html = html.replace("{{NOM_ELEVE}}", str(student["nom"] or ""))
-    date_naiss = format_date(student.get("date_naissance"))
-    if date_naiss:
-        html = html.replace("{{DATE_NAISSANCE}}", date_naiss)
-    else:
-        # Pas de date de naissance : supprimer toute la ligne "Né le : ..."
-        html = html.replace('<div><span class="label">Né le : </span><span class="value field">{{DATE_NAISSANCE}}</span></div>', '')
+    values["PRENOM_ELEVE"] = str(student["prenom"] or "")
+    values["NOM_ELEVE"] = str(student["nom"] or "")
+    # Pas de date de naissance : la ligne "Né le : ..." est supprimee (OPTIONAL_TEMPLATE_LINES)
+    values["DATE_NAISSANCE"] = format_date(student.get("date_naissance"))
 
     # Notes et appreciations par matiere
     student_notes = []
 
     for i, matiere in enumerate(matieres_config, start=1):
         note_key = notes_key_fn(matiere)
-        # Utiliser les notes pre-calculees si disponibles (pour coherence PAES/Linova)
+        band = bands[i - 1] if bands is not None else None
+        # Notes pre-calculees par iter_adjusted_students (identiques PAES/Linova)
         adjusted_note = student.get("adjusted_notes", {}).get(note_key)
-        if adjusted_note is None:
-            raw_note = student["notes"].get(note_key)
-            adjusted_note = adjust_grade(raw_note)
+        # Matiere "bulletin": false reprise par un profil : pas de note completee (NaN),
+        # affichee "NN" et hors de la moyenne generale
+        if adjusted_note is not None and np.isnan(adjusted_note):
+            adjusted_note = None
 
-        html = html.replace(f"{{{{MATIERE_{i}}}}}", matiere["nom"])
-        html = html.replace(f"{{{{ENSEIGNANT_{i}}}}}", matiere["enseignant"])
-        html = html.replace(f"{{{{MOY_ELEVE_{i}}}}}", format_note(adjusted_note))
+        values[f"MATIERE_{i}"] = matiere["nom"]
+        values[f"ENSEIGNANT_{i}"] = matiere["enseignant"]
+        values[f"MOY_ELEVE_{i}"] = format_note(adjusted_note)
 
         # Statistiques de classe
         stats = class_stats.get(matiere["nom"], {})
-        html = html.replace(f"{{{{MOY_CLASSE_{i}}}}}", format_note(stats.get("moyenne")))
-        html = html.replace(f"{{{{NOTE_MIN_{i}}}}}", format_note(stats.get("min")))
-        html = html.replace(f"{{{{NOTE_MAX_{i}}}}}", format_note(stats.get("max")))
+        values[f"MOY_CLASSE_{i}"] = format_note(stats.get("moyenne"))
+        values[f"NOTE_MIN_{i}"] = format_note(stats.get("min"))
+        values[f"NOTE_MAX_{i}"] = format_note(stats.get("max"))
 
         # Appreciation specifique a la matiere
-        html = html.replace(f"{{{{APPRECIATION_{i}}}}}",
-                           get_appreciation(adjusted_note, matiere["nom"], appreciations_dict))
+        values[f"APPRECIATION_{i}"] = get_appreciation(adjusted_note, i - 1, appreciations, band)
 
         if adjusted_note is not None:
             student_notes.append(adjusted_note)
@@ -801,86 +1095,78 @@ def generate_bulletin_html(student, class_stats, template, profil, matieres_conf
     else:
         moyenne_classe = None
 
-    html = html.replace("{{MOYENNE_GENERALE_ELEVE}}", format_note(moyenne_eleve))
-    html = html.replace("{{MOYENNE_GENERALE_CLASSE}}", format_note(moyenne_classe))
+    values["MOYENNE_GENERALE_ELEVE"] = format_note(moyenne_eleve)
+    values["MOYENNE_GENERALE_CLASSE"] = format_note(moyenne_classe)
 
     # Absences et appreciation generale
-    html = html.replace("{{ABSENCES}}", "RAS")
-    html = html.replace("{{APPRECIATION_GENERALE}}",
-                       get_appreciation_generale(student["prenom"], moyenne_eleve))
-
-    return html
-
+    values["ABSENCES"] = "RAS"
+    values["APPRECIATION_GENERALE"] = get_appreciation_generale(student["prenom"], moyenne_eleve, appreciations)
+    return values
 
-def generate_index_html(students, profil_paes, profil_linova):
-    """Genere la page index.html avec la liste des eleves et acces aux deux types de bulletins"""
 
+def generate_bulletin_html(student, class_stats, template, profil, matieres_config,
+                           appreciations, notes_key_fn=None, bands=None):
+    """Genere le HTML d'un bulletin pour un eleve.
+    template: texte du template ou template deja compile (compile_template)
+    appreciations, bands: voir bulletin_values"""
+    if isinstance(template, str):
+        template = compile_template(template)
+    return render_template(template, bulletin_values(student, class_stats, profil, matieres_config,
+                                                     appreciations, notes_key_fn, bands))
+
+
+def generate_index_data(students):
+    """Genere le fichier de donnees de l'index : liste compacte des eleves (JSON)
+    affectee a window.BULLETINS_DATA, chargee par index.html via <script src>
+    (fonctionne aussi en ouvrant index.html directement depuis le disque).
+    Chaque eleve = [prenom, nom, email, date_naissance, choix, fichier, nouveau, recherche]
+    ou "recherche" est le texte normalise (minuscules, sans accents) pour le filtre."""
     sorted_students = sorted(students, key=lambda s: (s["nom"] or "", s["prenom"] or ""))
 
-    rows = []
+    eleves = []
     for student in sorted_students:
+        prenom = student['prenom'] or ''
+        nom = student['nom'] or ''
+        email = student.get('email') or ''
+        date_naiss = format_date(student.get("date_naissance"))
+        choix = student.get("choix", "Formulaire non rempli")
         filename_base = f"bulletin_{sanitize_filename(student['prenom'])}_{sanitize_filename(student['nom'])}"
-        pdf_paes = f"bulletins_pdf_paes/{filename_base}.pdf"
-        pdf_linova = f"bulletins_pdf_linova/{filename_base}.pdf"
+        recherche = normalize_key(" ".join([prenom, nom, email, date_naiss or "Formulaire non rempli", choix]))
+        eleves.append([prenom, nom, email, date_naiss, choix, filename_base,
+                       1 if student.get("_is_new") else 0, recherche])
 
-        date_naiss = format_date(student.get("date_naissance"))
-        if not date_naiss:
-            date_naiss_html = '<span class="no-date">Formulaire non rempli</span>'
-        else:
-            date_naiss_html = date_naiss
+    data = json.dumps({"eleves": eleves}, ensure_ascii=False, separators=(",", ":"))
+    return f"window.BULLETINS_DATA = {data};\n"
 
-        choix = student.get("choix", "Formulaire non rempli")
-        nouveau_badge = ' <span class="badge-nouveau">Nouveau</span>' if student.get("_is_new") else ''
-
-        row = f"""
-            <tr>
-                <td>{student['prenom'] or ''}{nouveau_badge}</td>
-                <td>{student['nom'] or ''}</td>
-                <td><a href="mailto:{student.get('email') or ''}">{student.get('email') or ''}</a></td>
-                <td>{date_naiss_html}</td>
-                <td class="choix-cell">{choix}</td>
-                <td class="pdf-cell pdf-cell-paes">
-                    <a href="{pdf_paes}" class="btn-pdf btn-paes" target="_blank" title="Bulletin PAES">
-                        <svg xmlns="http://www.w3.org/2000/svg" width="14" height="14" fill="currentColor" viewBox="0 0 16 16">
-                            <path d="M14 14V4.5L9.5 0H4a2 2 0 0 0-2 2v12a2 2 0 0 0 2 2h8a2 2 0 0 0 2-2zM9.5 3A1.5 1.5 0 0 0 11 4.5h2V14a1 1 0 0 1-1 1H4a1 1 0 0 1-1-1V2a1 1 0 0 1 1-1h5.5v2z"/>
-                        </svg>
-                        PAES
-                    </a>
-                    <a href="{pdf_paes}" class="btn-download" download="{filename_base}_paes.pdf" title="Télécharger PAES">
-                        <svg xmlns="http://www.w3.org/2000/svg" width="14" height="14" fill="currentColor" viewBox="0 0 16 16">
-                            <path d="M.5 9.9a.5.5 0 0 1 .5.5v2.5a1 1 0 0 0 1 1h12a1 1 0 0 0 1-1v-2.5a.5.5 0 0 1 1 0v2.5a2 2 0 0 1-2 2H2a2 2 0 0 1-2-2v-2.5a.5.5 0 0 1 .5-.5z"/>
-                            <path d="M7.646 11.854a.5.5 0 0 0 .708 0l3-3a.5.5 0 0 0-.708-.708L8.5 10.293V1.5a.5.5 0 0 0-1 0v8.793L5.354 8.146a.5.5 0 1 0-.708.708l3 3z"/>
-                        </svg>
-                    </a>
-                </td>
-                <td class="pdf-cell pdf-cell-linova">
-                    <a href="{pdf_linova}" class="btn-pdf btn-linova" target="_blank" title="Bulletin Linova">
-                        <svg xmlns="http://www.w3.org/2000/svg" width="14" height="14" fill="currentColor" viewBox="0 0 16 16">
-                            <path d="M14 14V4.5L9.5 0H4a2 2 0 0 0-2 2v12a2 2 0 0 0 2 2h8a2 2 0 0 0 2-2zM9.5 3A1.5 1.5 0 0 0 11 4.5h2V14a1 1 0 0 1-1 1H4a1 1 0 0 1-1-1V2a1 1 0 0 1 1-1h5.5v2z"/>
-                        </svg>
-                        Linova
-                    </a>
-                    <a href="{pdf_linova}" class="btn-download btn-dl-linova" download="{filename_base}_linova.pdf" title="Télécharger Linova">
-                        <svg xmlns="http://www.w3.org/2000/svg" width="14" height="14" fill="currentColor" viewBox="0 0 16 16">
-                            <path d="M.5 9.9a.5.5 0 0 1 .5.5v2.5a1 1 0 0 0 1 1h12a1 1 0 0 0 1-1v-2.5a.5.5 0 0 1 1 0v2.5a2 2 0 0 1-2 2H2a2 2 0 0 1-2-2v-2.5a.5.5 0 0 1 .5-.5z"/>
-                            <path d="M7.646 11.854a.5.5 0 0 0 .708 0l3-3a.5.5 0 0 0-.708-.708L8.5 10.293V1.5a.5.5 0 0 0-1 0v8.793L5.354 8.146a.5.5 0 1 0-.708.708l3 3z"/>
-                        </svg>
-                    </a>
-                </td>
-            </tr>"""
-        rows.append(row)
+
+def generate_index_html(students, cohort, data_file_name=INDEX_DATA_FILE.name, data_version=""):
+    """Genere la page index.html avec la liste des eleves et acces aux bulletins de chaque
+    profil de la cohorte. Les lignes ne sont pas incluses dans la page : elles sont lues dans
+    data_file_name (generate_index_data) et seules les lignes visibles sont construites
+    (defilement virtuel)."""
 
     nb_students = len(students)
-    nb_matieres = len(MATIERES_PAES)
+    nb_matieres = sum(1 for m in cohort["matieres"] if m.get("bulletin", True))
+    profils = cohort["profils"]
+    etablissements = " / ".join(p["etablissement"]["nom"] for p in profils)
+    premier = profils[0]["etablissement"]
+    colonnes = "\n                        ".join(f"<th>Bulletin {p['libelle']}</th>" for p in profils)
+    cellules = "\n                    ".join(
+        f"pdfCell('{p['cle']}', '{p['libelle']}', fichier, '{' btn-dl-' + p['cle'] if i else ''}') +"
+        for i, p in enumerate(profils))
+
+    # Polices servies localement si elles sont fournies dans fonts/
+    font_css = LOCAL_ASSET_URLS[GOOGLE_FONTS_URL]
+    font_url = font_css.relative_to(BASE_DIR).as_posix() if font_css.exists() else GOOGLE_FONTS_URL
 
     index_html = f"""<!DOCTYPE html>
 <html lang="fr">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Bulletins Scolaires - {profil_paes['nom']} / {profil_linova['nom']}</title>
+    <title>Bulletins Scolaires - {etablissements}</title>
     <style>
-        @import url('https://fonts.googleapis.com/css2?family=Open+Sans:wght@400;600;700&display=swap');
+        @import url('{font_url}');
 
         * {{
             margin: 0;
@@ -965,8 +1251,9 @@ def generate_index_html(students, profil_paes, profil_linova):
         }}
 
         .table-container {{
-            padding: 20px 40px 40px;
-            overflow-x: auto;
+            margin: 20px 40px 40px;
+            overflow: auto;
+            height: 70vh;
         }}
 
         table {{
@@ -975,6 +1262,9 @@ def generate_index_html(students, profil_paes, profil_linova):
         }}
 
         th {{
+            position: sticky;
+            top: 0;
+            z-index: 1;
             background: #f8f9fa;
             padding: 15px 12px;
             text-align: left;
@@ -987,9 +1277,21 @@ def generate_index_html(students, profil_paes, profil_linova):
         }}
 
         td {{
-            padding: 15px 12px;
+            height: 53px;
+            padding: 0 12px;
             border-bottom: 1px solid #eee;
             vertical-align: middle;
+            white-space: nowrap;
+        }}
+
+        tr.spacer, tr.spacer:hover {{
+            background: none;
+        }}
+
+        tr.spacer td {{
+            height: auto;
+            padding: 0;
+            border: none;
         }}
 
         tr:hover {{
@@ -1005,10 +1307,14 @@ def generate_index_html(students, profil_paes, profil_linova):
             text-decoration: underline;
         }}
 
-        .pdf-cell {{
-            display: flex;
-            gap: 6px;
-            align-items: center;
+        .pdf-cell a {{
+            margin-right: 6px;
+        }}
+
+        .btn-pdf svg, .btn-download svg {{
+            width: 14px;
+            height: 14px;
+            fill: currentColor;
         }}
 
         .btn-pdf, .btn-download {{
@@ -1109,11 +1415,16 @@ def generate_index_html(students, profil_paes, profil_linova):
                 border-radius: 0;
             }}
 
-            .header, .search-container, .table-container {{
+            .header, .search-container {{
                 padding-left: 20px;
                 padding-right: 20px;
             }}
 
+            .table-container {{
+                margin-left: 20px;
+                margin-right: 20px;
+            }}
+
             .stats {{
                 flex-direction: column;
                 gap: 15px;
@@ -1130,7 +1441,7 @@ def generate_index_html(students, profil_paes, profil_linova):
     <div class="container">
         <div class="header">
             <h1>Bulletins Annuels</h1>
-            <p>{profil_paes['nom']} / {profil_linova['nom']} - Année scolaire {profil_paes['annee_scolaire']} - Classe {profil_paes['classe']}</p>
+            <p>{etablissements} - Année scolaire {premier['annee_scolaire']} - Classe {premier['classe']}</p>
             <div class="stats">
                 <div class="stat">
                     <div class="stat-value">{nb_students}</div>
@@ -1148,7 +1459,7 @@ def generate_index_html(students, profil_paes, profil_linova):
                    placeholder="Rechercher un élève par nom, prénom ou email...">
         </div>
 
-        <div class="table-container">
+        <div class="table-container" id="tableContainer">
             <table id="studentsTable">
                 <thead>
                     <tr>
@@ -1157,12 +1468,10 @@ def generate_index_html(students, profil_paes, profil_linova):
                         <th>Email</th>
                         <th>Date de naissance</th>
                         <th>Choix</th>
-                        <th>Bulletin PAES</th>
-                        <th>Bulletin Linova</th>
+                        {colonnes}
                     </tr>
                 </thead>
-                <tbody>
-                    {''.join(rows)}
+                <tbody id="studentsBody">
                 </tbody>
             </table>
             <div class="no-results" id="noResults">
@@ -1171,22 +1480,105 @@ def generate_index_html(students, profil_paes, profil_linova):
         </div>
     </div>
 
+    <svg xmlns="http://www.w3.org/2000/svg" style="display: none">
+        <symbol id="icon-pdf" viewBox="0 0 16 16">
+            <path d="M14 14V4.5L9.5 0H4a2 2 0 0 0-2 2v12a2 2 0 0 0 2 2h8a2 2 0 0 0 2-2zM9.5 3A1.5 1.5 0 0 0 11 4.5h2V14a1 1 0 0 1-1 1H4a1 1 0 0 1-1-1V2a1 1 0 0 1 1-1h5.5v2z"/>
+        </symbol>
+        <symbol id="icon-download" viewBox="0 0 16 16">
+            <path d="M.5 9.9a.5.5 0 0 1 .5.5v2.5a1 1 0 0 0 1 1h12a1 1 0 0 0 1-1v-2.5a.5.5 0 0 1 1 0v2.5a2 2 0 0 1-2 2H2a2 2 0 0 1-2-2v-2.5a.5.5 0 0 1 .5-.5z"/>
+            <path d="M7.646 11.854a.5.5 0 0 0 .708 0l3-3a.5.5 0 0 0-.708-.708L8.5 10.293V1.5a.5.5 0 0 0-1 0v8.793L5.354 8.146a.5.5 0 1 0-.708.708l3 3z"/>
+        </symbol>
+    </svg>
+
+    <script src="{data_file_name}?v={data_version}"></script>
     <script>
-        document.getElementById('searchInput').addEventListener('input', function() {{
-            const searchTerm = this.value.toLowerCase();
-            const rows = document.querySelectorAll('#studentsTable tbody tr');
-            let visibleCount = 0;
-
-            rows.forEach(row => {{
-                const text = row.textContent.toLowerCase();
-                const isVisible = text.includes(searchTerm);
-                row.style.display = isVisible ? '' : 'none';
-                if (isVisible) visibleCount++;
+        (function() {{
+            const PRENOM = 0, NOM = 1, EMAIL = 2, DATE = 3, CHOIX = 4, FICHIER = 5, NOUVEAU = 6, RECHERCHE = 7;
+            const ROW_HEIGHT = 53;
+            const BUFFER = 10;
+
+            const eleves = window.BULLETINS_DATA.eleves;
+            const container = document.getElementById('tableContainer');
+            const tbody = document.getElementById('studentsBody');
+            const noResults = document.getElementById('noResults');
+            let visibles = eleves;
+            let scheduled = false;
+
+            function normalize(text) {{
+                return text.normalize('NFD').replace(/[\\u0300-\\u036f]/g, '')
+                    .toLowerCase().replace(/[-\\s]+/g, ' ').trim();
+            }}
+
+            function escapeHtml(text) {{
+                return String(text).replace(/[&<>"']/g, c => ({{
+                    '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'
+                }})[c]);
+            }}
+
+            function pdfCell(profil, label, fichier, extraClass) {{
+                const href = `bulletins_pdf_${{profil}}/${{fichier}}.pdf`;
+                return `<td class="pdf-cell pdf-cell-${{profil}}">` +
+                    `<a href="${{href}}" class="btn-pdf btn-${{profil}}" target="_blank" title="Bulletin ${{label}}">` +
+                    `<svg><use href="#icon-pdf"></use></svg> ${{label}}</a>` +
+                    `<a href="${{href}}" class="btn-download${{extraClass}}" download="${{fichier}}_${{profil}}.pdf" title="Télécharger ${{label}}">` +
+                    `<svg><use href="#icon-download"></use></svg></a></td>`;
+            }}
+
+            function rowHtml(e) {{
+                const fichier = escapeHtml(e[FICHIER]);
+                const email = escapeHtml(e[EMAIL]);
+                const badge = e[NOUVEAU] ? ' <span class="badge-nouveau">Nouveau</span>' : '';
+                const date = e[DATE] ? escapeHtml(e[DATE]) : '<span class="no-date">Formulaire non rempli</span>';
+                return '<tr>' +
+                    `<td>${{escapeHtml(e[PRENOM])}}${{badge}}</td>` +
+                    `<td>${{escapeHtml(e[NOM])}}</td>` +
+                    `<td><a href="mailto:${{email}}">${{email}}</a></td>` +
+                    `<td>${{date}}</td>` +
+                    `<td class="choix-cell">${{escapeHtml(e[CHOIX])}}</td>` +
+                    {cellules}
+                    '</tr>';
+            }}
+
+            function spacer(height) {{
+                return `<tr class="spacer"><td colspan="{5 + len(profils)}" style="height: ${{height}}px"></td></tr>`;
+            }}
+
+            // Seules les lignes visibles (plus une marge) sont construites
+            function render() {{
+                scheduled = false;
+                const first = Math.max(0, Math.floor(container.scrollTop / ROW_HEIGHT) - BUFFER);
+                const count = Math.ceil(container.clientHeight / ROW_HEIGHT) + 2 * BUFFER;
+                const last = Math.min(visibles.length, first + count);
+                const parts = [spacer(first * ROW_HEIGHT)];
+                for (let i = first; i < last; i++) {{
+                    parts.push(rowHtml(visibles[i]));
+                }}
+                parts.push(spacer((visibles.length - last) * ROW_HEIGHT));
+                tbody.innerHTML = parts.join('');
+                noResults.style.display = visibles.length === 0 ? 'block' : 'none';
+            }}
+
+            function scheduleRender() {{
+                if (!scheduled) {{
+                    scheduled = true;
+                    requestAnimationFrame(render);
+                }}
+            }}
+
+            container.addEventListener('scroll', scheduleRender);
+            window.addEventListener('resize', scheduleRender);
+
+            // Recherche sur le texte normalise precalcule : tous les mots doivent apparaitre
+            document.getElementById('searchInput').addEventListener('input', function() {{
+                const terms = normalize(this.value).split(' ').filter(Boolean);
+                visibles = terms.length === 0 ? eleves :
+                    eleves.filter(e => terms.every(t => e[RECHERCHE].includes(t)));
+                container.scrollTop = 0;
+                scheduleRender();
             }});
 
-            document.getElementById('noResults').style.display =
-                visibleCount === 0 ? 'block' : 'none';
-        }});
+            render();
+        }})();
     </script>
 </body>
 </html>"""
@@ -1194,203 +1586,2045 @@ def generate_index_html(students, profil_paes, profil_linova):
     return index_html
 
 
-def main():
-    print("=" * 60)
-    print("GENERATEUR DE BULLETINS SCOLAIRES")
-    print("PAES (Diploma Santé) + Linova Education")
+def temp_output_path(path):
+    """Fichier temporaire (cache) utilise pendant l'ecriture de path, propre au processus :
+    deux processus de rendu qui ecrivent la meme image reduite ne se genent pas"""
+    path = Path(path)
+    return path.with_name(f".{path.name}.{os.getpid()}.tmp")
+
+
+def write_atomic(path, write_fn, fsync=False):
+    """Ecrit path via write_fn(f) dans un fichier temporaire du meme dossier puis le
+    renomme : un crash ne laisse jamais de fichier tronque sous son nom final"""
+    tmp_path = temp_output_path(path)
+    try:
+        with open(tmp_path, 'wb') as f:
+            write_fn(f)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+
+
+def write_text_atomic(path, text, fsync=False):
+    """Ecrit un fichier texte UTF-8 de maniere atomique"""
+    write_atomic(path, lambda f: f.write(text.encode("utf-8")), fsync)
+
+
+def sync_directories(dirs):
+    """Synchronise sur disque les entrees (renommages) des dossiers de sortie"""
+    if os.name == "nt":  # pas de fsync de dossier sous Windows
+        return
+    for d in dirs:
+        fd = os.open(d, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def remove_temp_files(dirs):
+    """Supprime les fichiers temporaires laisses par un crash. Retourne leur nombre."""
+    removed = 0
+    for d in dirs:
+        for path in Path(d).glob(TEMP_FILE_PATTERN):
+            path.unlink()
+            removed += 1
+    return removed
+
+
+def is_complete_pdf(path):
+    """Verifie qu'un PDF existant est complet : en-tete %PDF- et marqueur %%EOF final"""
+    try:
+        with open(path, 'rb') as f:
+            if f.read(5) != b"%PDF-":
+                return False
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - PDF_EOF_WINDOW))
+            return b"%%EOF" in f.read()
+    except OSError:
+        return False
+
+
+class HtmlArchive:
+    """Archive tar.gz unique des bulletins HTML (--sorties pdf-html-gz).
+    Les HTML sont ajoutes au fil du rendu dans une archive temporaire ; a la fermeture,
+    les bulletins non regeneres sont repris de l'archive precedente, puis la nouvelle
+    archive remplace l'ancienne par renommage atomique. Un bulletin a jour absent de
+    l'archive precedente (premiere execution en pdf-html-gz, archive illisible) doit
+    etre rendu quand meme : voir missing()."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.tmp_path = temp_output_path(self.path)
+        self.previous = self._previous_names()
+        self.tar = tarfile.open(self.tmp_path, "w:gz")
+        self.names = set()
+
+    def _previous_names(self):
+        """Bulletins de l'archive precedente (vide si absente ou illisible)"""
+        if not self.path.exists():
+            return set()
+        try:
+            with tarfile.open(self.path, "r:gz") as old:
+                return {member.name for member in old if member.isfile()}
+        except (tarfile.TarError, OSError, EOFError) as e:
+            print(f"[WARN] Archive HTML précédente illisible, bulletins à jour rendus à nouveau: {e}")
+            return set()
+
+    def missing(self, name):
+        """Vrai si le bulletin n'est ni deja ajoute ni repris de l'archive precedente"""
+        return name not in self.names and name not in self.previous
+
+    def add(self, name, text):
+        data = text.encode("utf-8")
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self.tar.addfile(info, io.BytesIO(data))
+        self.names.add(name)
+
+    def close(self, keep_names=None, fsync=False):
+        """Reprend les bulletins de l'archive precedente (seulement keep_names si
+        fourni, pour oublier les eleves disparus) puis remplace l'archive"""
+        if self.previous:
+            with tarfile.open(self.path, "r:gz") as old:
+                for member in old:
+                    if not member.isfile() or member.name in self.names:
+                        continue
+                    if keep_names is not None and member.name not in keep_names:
+                        continue
+                    self.tar.addfile(member, old.extractfile(member))
+        self.tar.close()
+        if fsync:
+            with open(self.tmp_path, 'rb') as f:
+                os.fsync(f.fileno())
+        os.replace(self.tmp_path, self.path)
+
+
+class BulletinExporter:
+    """Export des PDF dans des archives ZIP ou tar, alimentees au fil du rendu depuis
+    la memoire (seuls les PDF deja a jour sont relus sur disque). Par choix, un eleve
+    n'a que le bulletin choisi ; sans formulaire, ses deux bulletins sont exportes.
+    Chaque archive est ecrite sous un nom temporaire puis renommee a sa fermeture."""
+
+    def __init__(self, export_dir, fmt="zip", group_by="profil", max_bytes=None, choix_profils=None,
+                 profil_keys=None):
+        self.export_dir = Path(export_dir)
+        self.choix_profils = choix_profils or {}  # choix -> {cles de profil}
+        self.profil_keys = profil_keys  # profils de l'execution (None : tous)
+        self.groups = set()  # groupes ouverts pendant l'execution
+        self.fmt = fmt
+        self.group_by = group_by
+        self.max_bytes = max_bytes
+        self.archives = {}  # groupe -> {"archive", "partie", "taille", "chemin"}
+        self.written = []
+        self.export_dir.mkdir(exist_ok=True)
+
+    def entry(self, student, profil_key, filename_base):
+        """(groupe, nom dans l'archive) d'un bulletin, None s'il n'est pas exporte"""
+        if self.group_by == "profil":
+            return profil_key, f"{filename_base}.pdf"
+        choix = student.get("choix") or "Formulaire non rempli"
+        wanted = self.choix_profils.get(choix)
+        if wanted is not None and profil_key not in wanted:
+            return None
+        group = profil_key if wanted else sanitize_filename(choix)
+        return f"choix_{group}", f"{profil_key}/{filename_base}.pdf"
+
+    def add(self, student, profil_key, filename_base, data):
+        target = self.entry(student, profil_key, filename_base)
+        if target is None:
+            return
+        group, name = target
+        state = self.archives.get(group)
+        if state is None or (self.max_bytes and state["taille"] > 0
+                             and state["taille"] + len(data) > self.max_bytes):
+            partie = state["partie"] + 1 if state else 1
+            if state:
+                self._close(state)
+            state = self.archives[group] = self._open(group, partie)
+        if self.fmt == "zip":
+            state["archive"].writestr(zipfile.ZipInfo(name, time.localtime()[:6]), data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            state["archive"].addfile(info, io.BytesIO(data))
+        state["taille"] += len(data) + EXPORT_ENTRY_OVERHEAD
+
+    def add_from_disk(self, student, profil_key, pdf_path):
+        """Ajoute un PDF deja a jour (non rendu pendant cette execution)"""
+        pdf_path = Path(pdf_path)
+        if self.entry(student, profil_key, pdf_path.stem) is not None and pdf_path.exists():
+            self.add(student, profil_key, pdf_path.stem, pdf_path.read_bytes())
+
+    def _open(self, group, partie):
+        self.groups.add(group)
+        suffix = f"_{partie}" if self.max_bytes else ""
+        path = self.export_dir / f"bulletins_{group}{suffix}.{self.fmt}"
+        tmp_path = temp_output_path(path)
+        if self.fmt == "zip":
+            # PDF deja compresses : stockage sans recompression
+            archive = zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_STORED)
+        else:
+            archive = tarfile.open(tmp_path, "w")
+        return {"archive": archive, "partie": partie, "taille": 0, "chemin": path}
+
+    def _close(self, state):
+        state["archive"].close()
+        os.replace(temp_output_path(state["chemin"]), state["chemin"])
+        self.written.append(state["chemin"])
+
+    def close(self):
+        """Ferme les archives et supprime celles d'un export precedent devenues
+        obsoletes (dans tous les formats : un export zip remplace un export tar).
+        Seules les archives des profils de l'execution sont concernees : celles des
+        cohortes non selectionnees (--cohortes) sont gardees.
+        Retourne la liste des archives ecrites."""
+        for state in self.archives.values():
+            self._close(state)
+        self.archives = {}
+        for fmt in EXPORT_FORMATS:
+            for path in self.export_dir.glob(f"bulletins_*.{fmt}"):
+                if path not in self.written and self._owns(path):
+                    path.unlink()
+        return self.written
+
+    def _owns(self, path):
+        """Vrai si l'archive appartient a un groupe de l'execution (decoupee ou non,
+        regroupee par profil ou par choix)"""
+        if self.profil_keys is None:
+            return True
+        groups = self.groups | {prefix + key for key in self.profil_keys for prefix in ("", "choix_")}
+        return any(re.fullmatch(rf"bulletins_{re.escape(group)}(_\d+)?", path.stem) for group in groups)
+
+
+def create_exporter(registry):
+    """Exporteur d'archives selon --export / --export-par / --export-taille-max
+    (None sans --export)"""
+    fmt = get_cli_option("--export")
+    if fmt is None:
+        return None
+    if fmt not in EXPORT_FORMATS:
+        print(f"[WARN] Valeur --export invalide: {fmt}, pas d'export")
+        return None
+    group_by = get_cli_option("--export-par", "profil")
+    if group_by not in EXPORT_GROUPINGS:
+        print(f"[WARN] Valeur --export-par invalide: {group_by}, export par profil")
+        group_by = "profil"
+    max_mb = get_cli_option("--export-taille-max")
+    try:
+        max_bytes = int(float(max_mb) * 1024 * 1024) if max_mb else None
+    except ValueError:
+        print(f"[WARN] Valeur --export-taille-max invalide: {max_mb}, pas de découpage")
+        max_bytes = None
+    choix_profils = {}
+    for cohort in registry.values():
+        for regle in cohort["choix"]:
+            choix_profils.setdefault(regle["choix"], set()).add(regle["profil"])
+    return BulletinExporter(EXPORT_DIR, fmt, group_by, max_bytes, choix_profils,
+                            [profil["cle"] for profil in registry_profiles(registry)])
+
+
+def html_archive_name(profil_key, filename_base):
+    """Nom d'un bulletin HTML dans l'archive (un dossier par profil)"""
+    return f"{profil_key}/{filename_base}.html"
+
+
+def load_manifest(profil_keys=()):
+    """Charge le manifeste des bulletins generes.
+    Retourne: {cle de profil: {filename_base: hash}}, avec une entree pour chaque
+    profil de profil_keys (les profils des cohortes non generees sont conserves)"""
+    manifest = {}
+    if MANIFEST_FILE.exists():
+        try:
+            with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            manifest = {key: dict(value) for key, value in data.items() if isinstance(value, dict)}
+        except (ValueError, OSError) as e:
+            print(f"  [WARN] Manifeste illisible, tous les bulletins seront régénérés: {e}")
+    for profil_key in profil_keys:
+        manifest.setdefault(profil_key, {})
+    return manifest
+
+
+def save_manifest(manifest):
+    """Ecrit le manifeste (fichier temporaire puis renommage)"""
+    tmp_path = MANIFEST_FILE.with_suffix(".json.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_FILE)
+
+
+def local_assets_digest():
+    """Empreinte des copies locales de fonts/ : feuilles de style et polices qu'elles
+    referencent (ou leur absence). Les bulletins rendus avec les polices de repli sont
+    refaits quand les polices sont ajoutees."""
+    h = hashlib.sha256()
+    for path in dict.fromkeys(LOCAL_ASSET_URLS.values()):
+        if not path.exists():
+            h.update(f"absent:{path.name}".encode("utf-8"))
+            continue
+        css = path.read_bytes()
+        h.update(css)
+        for _, ref in CSS_URL_RE.findall(css.decode("utf-8", "replace")):
+            ref_path = path.parent / url2pathname(ref)
+            if ":" not in ref and ref_path.is_file():
+                h.update(ref_path.read_bytes())
+    return h.hexdigest()
+
+
+def profile_inputs_digest(template_text, profil, matieres_config, appreciations_dict, class_stats,
+                          seuils=APPRECIATION_SEUILS_DEFAUT):
+    """Empreinte des entrees communes a tous les bulletins d'un profil :
+    template, profil, matieres, appreciations et leurs seuils, statistiques de classe,
+    contenu des images (logo, tampon) referencees par le profil et polices locales"""
+    h = hashlib.sha256()
+    h.update(template_text.encode("utf-8"))
+    h.update(json.dumps([profil, matieres_config, appreciations_dict, class_stats, list(seuils)],
+                        sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    for asset in (profil["logo"], profil["tampon"]):
+        asset_path = BASE_DIR / asset
+        if asset_path.exists():
+            h.update(asset_path.read_bytes())
+    h.update(f"images:{IMAGE_CACHE_VERSION}:{PRINT_DPI}".encode("utf-8"))
+    h.update(local_assets_digest().encode("utf-8"))
+    return h.hexdigest()
+
+
+def student_inputs_hash(student, profile_digest, matieres_config, notes_key_fn=None):
+    """Empreinte des entrees d'un bulletin : identite de l'eleve, notes ajustees
+    des matieres du profil et empreinte commune du profil"""
+    if notes_key_fn is None:
+        notes_key_fn = lambda m: m["nom"]
+    adjusted_notes = student.get("adjusted_notes", {})
+    payload = [
+        profile_digest,
+        student["prenom"] or "",
+        student["nom"] or "",
+        format_date(student.get("date_naissance")),
+        [adjusted_notes.get(notes_key_fn(m)) for m in matieres_config],
+    ]
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+# Mesures collectees quand --profile est actif (None = instrumentation desactivee)
+_profile_events = None
+
+
+# Pic de memoire tracee de chaque mesure en cours (mesures imbriquees) : tracemalloc
+# n'a qu'un pic, remis a zero au debut de chaque mesure
+_memory_peaks = []
+
+
+def enable_profiling():
+    """Active la collecte des mesures par etape et le suivi des allocations (tracemalloc ;
+    ralentit l'execution). Les processus de rendu, lances en spawn des que
+    max_tasks_per_child est utilise, le demarrent dans init_render_worker."""
+    global _profile_events
+    _profile_events = []
+    tracemalloc.start()
+
+
+def measure_start():
+    """Debut d'une mesure : horloge murale, temps CPU, memoire tracee"""
+    mesure = {"debut": time.time(), "_t0": time.perf_counter(), "_cpu0": time.process_time()}
+    if tracemalloc.is_tracing():
+        courante, pic = tracemalloc.get_traced_memory()
+        if _memory_peaks:
+            _memory_peaks[-1] = max(_memory_peaks[-1], pic)
+        _memory_peaks.append(courante)
+        tracemalloc.reset_peak()
+        mesure["_mem0"] = courante
+    return mesure
+
+
+def measure_end(mesure):
+    """Fin d'une mesure : duree, temps CPU et, si tracemalloc est actif, memoire nette
+    (octets encore alloues a la fin) et pic (octets au-dela du debut, allocations
+    temporaires comprises) depuis measure_start ; None sinon"""
+    resultat = {
+        "debut": mesure["debut"],
+        "duree": time.perf_counter() - mesure["_t0"],
+        "cpu": time.process_time() - mesure["_cpu0"],
+        "memoire_nette": None,
+        "pic_memoire": None,
+        "pid": os.getpid(),
+    }
+    if "_mem0" in mesure and tracemalloc.is_tracing() and _memory_peaks:
+        courante, pic = tracemalloc.get_traced_memory()
+        pic = max(_memory_peaks.pop(), pic)
+        if _memory_peaks:
+            _memory_peaks[-1] = max(_memory_peaks[-1], pic)
+        resultat["memoire_nette"] = courante - mesure["_mem0"]
+        resultat["pic_memoire"] = pic - mesure["_mem0"]
+    return resultat
+
+
+def record_profile_event(nom, mesure, **details):
+    """Enregistre une mesure deja prise (ex: rendu PDF fait dans un worker)"""
+    if _profile_events is not None:
+        _profile_events.append({"nom": nom, **mesure, **details})
+
+
+@contextmanager
+def profile_stage(nom, **details):
+    """Mesure le bloc si --profile est actif (sinon ne fait rien)"""
+    if _profile_events is None:
+        yield
+        return
+    mesure = measure_start()
+    try:
+        yield
+    finally:
+        record_profile_event(nom, measure_end(mesure), **details)
+
+
+def kilo_octets(value):
+    """Octets -> Ko arrondis"""
+    return round(value / 1024, 1)
+
+
+def print_profile_report(events, nb_lents=5):
+    """Affiche le tableau recapitulatif par etape : nombre d'appels, temps mural et CPU,
+    memoire nette cumulee et plus haut pic (Ko, tracemalloc), percentiles de latence,
+    puis les bulletins les plus lents a rendre"""
+    etapes = {}
+    for event in events:
+        etapes.setdefault(event["nom"], []).append(event)
+
+    print("\n" + "=" * 60)
+    print("PROFIL D'EXECUTION")
     print("=" * 60)
+    print(f"  {'Étape':<34} {'Appels':>7} {'Mur (s)':>9} {'CPU (s)':>9} {'Net (Ko)':>9} {'Pic (Ko)':>9}"
+          f" {'p50 (ms)':>9} {'p90 (ms)':>9} {'p99 (ms)':>9} {'max (ms)':>9}")
+    resume = {}
+    for nom, items in etapes.items():
+        durees = np.array([e["duree"] for e in items]) * 1000
+        p50, p90, p99 = np.percentile(durees, [50, 90, 99])
+        nettes = [e["memoire_nette"] for e in items if e["memoire_nette"] is not None]
+        pics = [e["pic_memoire"] for e in items if e["pic_memoire"] is not None]
+        resume[nom] = {
+            "appels": len(items),
+            "mur_s": round(float(durees.sum()) / 1000, 4),
+            "cpu_s": round(sum(e["cpu"] for e in items), 4),
+            # Memoire non mesuree (processus sans tracemalloc) : None
+            "memoire_nette_ko": kilo_octets(sum(nettes)) if nettes else None,
+            "pic_memoire_ko": kilo_octets(max(pics)) if pics else None,
+            "p50_ms": round(float(p50), 2),
+            "p90_ms": round(float(p90), 2),
+            "p99_ms": round(float(p99), 2),
+            "max_ms": round(float(durees.max()), 2),
+        }
+        r = resume[nom]
+        net = "-" if r["memoire_nette_ko"] is None else f"{r['memoire_nette_ko']:.0f}"
+        pic = "-" if r["pic_memoire_ko"] is None else f"{r['pic_memoire_ko']:.0f}"
+        print(f"  {nom:<34} {r['appels']:>7} {r['mur_s']:>9.3f} {r['cpu_s']:>9.3f} {net:>9} {pic:>9}"
+              f" {r['p50_ms']:>9.1f} {r['p90_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['max_ms']:>9.1f}")
+
+    rendus = sorted((e for e in events if e["nom"] == "write_pdf"), key=lambda e: e["duree"], reverse=True)
+    if rendus:
+        print(f"\n  Rendus PDF les plus lents :")
+        for e in rendus[:nb_lents]:
+            print(f"    {e['duree'] * 1000:>8.1f} ms  {e.get('profil', '')}  {e.get('eleve', '')}")
+    return resume
+
+
+def write_profile_trace(events, resume, path):
+    """Ecrit les mesures au format Chrome trace (chrome://tracing, Perfetto),
+    avec le tableau recapitulatif sous la cle "resume" """
+    origine = min((e["debut"] for e in events), default=0)
+    trace = []
+    for e in events:
+        details = {k: v for k, v in e.items() if k not in ("nom", "debut", "duree", "pid")}
+        trace.append({
+            "name": e["nom"],
+            "ph": "X",
+            "ts": round((e["debut"] - origine) * 1e6),
+            "dur": round(e["duree"] * 1e6),
+            "pid": e["pid"],
+            "tid": e["pid"],
+            "args": details,
+        })
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"traceEvents": trace, "resume": resume}, f, ensure_ascii=False)
 
-    # Creer les dossiers de sortie
-    html_paes_dir = BASE_DIR / "bulletins_html_paes"
-    pdf_paes_dir = BASE_DIR / "bulletins_pdf_paes"
-    html_linova_dir = BASE_DIR / "bulletins_html_linova"
-    pdf_linova_dir = BASE_DIR / "bulletins_pdf_linova"
 
-    for d in [html_paes_dir, pdf_paes_dir, html_linova_dir, pdf_linova_dir]:
-        d.mkdir(exist_ok=True)
+def get_cli_option(name, default=None):
+    """Lit la valeur d'une option de ligne de commande (--name N ou --name=N)"""
+    for i, arg in enumerate(sys.argv):
+        if arg == name and i + 1 < len(sys.argv):
+            return sys.argv[i + 1]
+        if arg.startswith(name + "="):
+            return arg.split("=", 1)[1]
+    return default
 
-    print(f"\n[OK] Dossiers de sortie créés")
 
-    # Charger les templates
-    print(f"[...] Chargement des templates...")
-    with open(TEMPLATE_FILE, 'r', encoding='utf-8') as f:
-        template = f.read()
-    with open(TEMPLATE_LINOVA_FILE, 'r', encoding='utf-8') as f:
-        template_linova = f.read()
-    print(f"[OK] Templates chargés: PAES + Linova (1 page)")
+def get_fsync_mode():
+    """Mode de synchronisation disque des sorties (--fsync aucune|lot|fichier)"""
+    value = get_cli_option("--fsync", FSYNC_MODE_DEFAUT)
+    if value not in FSYNC_MODES:
+        print(f"[WARN] Valeur --fsync invalide: {value}, mode {FSYNC_MODE_DEFAUT}")
+        return FSYNC_MODE_DEFAUT
+    return value
+
+
+def get_output_mode():
+    """Sorties produites (--sorties pdf|html|pdf-html|pdf-html-gz)"""
+    value = get_cli_option("--sorties", OUTPUT_MODE_DEFAUT)
+    if value not in OUTPUT_MODES:
+        print(f"[WARN] Valeur --sorties invalide: {value}, mode {OUTPUT_MODE_DEFAUT}")
+        return OUTPUT_MODE_DEFAUT
+    return value
+
 
-    # Charger les donnees Excel
-    print(f"[...] Chargement des données Excel depuis {NOTES_DIR}...")
-    students = load_excel_data()
-    print(f"[OK] {len(students)} élèves chargés depuis notes/")
+def get_workers_count():
+    """Nombre de processus de rendu PDF (--workers N, 0 = tous les coeurs)"""
+    value = get_cli_option("--workers", "1")
+    try:
+        workers = int(value)
+    except ValueError:
+        print(f"[WARN] Valeur --workers invalide: {value}, rendu sequentiel")
+        return 1
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def create_render_pool(workers, mp_context=None, min_workers=2):
+    """Cree le pool de processus de rendu PDF (None sous min_workers : rendu sequentiel).
+    Les cadres des logos et tampons sont calcules ici, dans le processus principal,
+    et transmis a chaque processus par init_render_worker avec l'etat de --profile."""
+    if workers < min_workers:
+        return None
+    options = {"initializer": init_render_worker,
+               "initargs": (get_print_asset_boxes(), _profile_events is not None)}
+    if sys.version_info >= (3, 11):
+        options["max_tasks_per_child"] = PDF_TASKS_PER_WORKER
+    return ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, **options)
+
+
+def init_render_worker(boxes, profiling=False):
+    """Initialisation d'un processus de rendu : cadres des images recus du parent
+    (pas de relecture de la configuration, meme lance en spawn/forkserver) et, avec
+    --profile, suivi des allocations pour les colonnes memoire de write_pdf"""
+    global _print_asset_boxes
+    _print_asset_boxes = boxes
+    if profiling and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def print_asset_boxes(profils):
+    """{chemin image: cadre d'affichage (px CSS)} des logos et tampons des profils"""
+    boxes = {}
+    for profil in profils:
+        for role, box in PRINT_BOXES_PX.items():
+            boxes[(BASE_DIR / profil["etablissement"][role]).resolve()] = box
+    return boxes
+
+
+def downsample_image(path, box):
+    """Reduit une image pour qu'elle tienne dans box a PRINT_DPI (jamais agrandie)
+    et la reencode (PNG optimise ou JPEG). Retourne les octets de l'image."""
+    max_w = round(box[0] * PRINT_DPI / 96)
+    max_h = round(box[1] * PRINT_DPI / 96)
+    with Image.open(path) as im:
+        im.load()
+        palette = im.mode == "P"
+        scale = min(1.0, max_w / im.width, max_h / im.height)
+        if scale < 1.0:
+            if palette:
+                im = im.convert("RGBA")
+            size = (max(1, round(im.width * scale)), max(1, round(im.height * scale)))
+            im = im.resize(size, Image.Resampling.LANCZOS)
+            if palette:
+                im = im.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+        buf = io.BytesIO()
+        if path.suffix.lower() in (".jpg", ".jpeg"):
+            im.save(buf, "JPEG", quality=90, optimize=True, dpi=(PRINT_DPI, PRINT_DPI))
+        else:
+            im.save(buf, "PNG", optimize=True, dpi=(PRINT_DPI, PRINT_DPI))
+    return buf.getvalue()
+
+
+# Image servie au rendu pour chaque logo/tampon : version reduite ou original
+_print_assets = {}
+
+
+def optimized_image_path(path, box):
+    """Chemin de l'image reduite a la resolution d'impression (cache disque, cle =
+    contenu + parametres). Retourne l'original si la reduction ne gagne rien."""
+    path = Path(path)
+    if path not in _print_assets:
+        h = hashlib.sha256(f"{IMAGE_CACHE_VERSION}:{PRINT_DPI}:{box}".encode("utf-8"))
+        h.update(path.read_bytes())
+        cache_path = IMAGE_CACHE_DIR / f"{path.stem}_{h.hexdigest()[:16]}{path.suffix.lower()}"
+        if not cache_path.exists():
+            IMAGE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            data = downsample_image(path, box)
+            write_atomic(cache_path, lambda f: f.write(data))
+        if cache_path.stat().st_size < path.stat().st_size:
+            _print_assets[path] = cache_path
+        else:
+            _print_assets[path] = path
+    return _print_assets[path]
+
+
+def prepare_print_assets(registry):
+    """Etape images : prepare une fois les logos et tampons de tous les profils.
+    Retourne {profil: (octets des images originales, octets des images servies)}."""
+    global _print_asset_boxes
+    profils = registry_profiles(registry)
+    boxes = _print_asset_boxes = print_asset_boxes(profils)
+    tailles = {}
+    for profil in profils:
+        avant = apres = 0
+        for role in PRINT_BOXES_PX:
+            path = (BASE_DIR / profil["etablissement"][role]).resolve()
+            if not path.exists():
+                continue
+            avant += path.stat().st_size
+            apres += optimized_image_path(path, boxes[path]).stat().st_size
+        tailles[profil["cle"]] = (avant, apres)
+    return tailles
+
+
+class LocalAssetFetcher(URLFetcher):
+    """Sert les ressources des bulletins depuis le disque, sans acces reseau.
+    Les logos et tampons sont servis dans leur version reduite (optimized_image_path).
+    Les fichiers lus restent en memoire pour tous les rendus du processus."""
+
+    def fetch(self, url, headers=None):
+        if url in LOCAL_ASSET_URLS:
+            path = LOCAL_ASSET_URLS[url]
+            if not path.exists():
+                # Deja signale par check_local_assets dans le processus principal
+                return URLFetcherResponse(url, b"", {"Content-Type": "text/css"})
+        elif url.startswith("file:"):
+            path = Path(url2pathname(urlsplit(url).path))
+        elif url.startswith("data:"):
+            return super().fetch(url, headers)
+        else:
+            raise ValueError(f"Ressource distante refusée (rendu hors ligne): {url}")
+
+        if path not in _asset_cache:
+            mime_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            box = get_print_asset_boxes().get(path.resolve())
+            source = optimized_image_path(path.resolve(), box) if box and path.exists() else path
+            _asset_cache[path] = (source.read_bytes(), mime_type)
+        body, mime_type = _asset_cache[path]
+        return URLFetcherResponse(path.as_uri(), body, {"Content-Type": mime_type})
+
+
+# Ressources de rendu partagees par tous les bulletins d'un meme processus :
+# feuilles de style analysees (par contenu CSS), polices, fichiers lus et images decodees
+_font_config = None
+_url_fetcher = None
+_stylesheets = {}
+_image_cache = {}
+_asset_cache = {}
+_print_asset_boxes = None
+
+
+def download_local_asset(url, css_path):
+    """Telecharge une feuille de style distante et les polices qu'elle reference dans le
+    dossier de css_path ; ses url() deviennent relatives. La feuille est ecrite en dernier :
+    si elle existe, la copie est complete."""
+    def fetch(remote_url):
+        # Agent par defaut (Python-urllib) : Google Fonts sert des polices .ttf
+        with urlopen(remote_url, timeout=LOCAL_ASSET_TIMEOUT) as response:
+            return response.read()
+
+    css = fetch(url).decode("utf-8")
+    fonts = {}
+    for _, font_url in CSS_URL_RE.findall(css):
+        if font_url.startswith(("http://", "https://")) and font_url not in fonts:
+            name = Path(urlsplit(font_url).path)
+            digest = hashlib.sha256(font_url.encode("utf-8")).hexdigest()[:8]
+            fonts[font_url] = f"{name.stem}_{digest}{name.suffix}"
+    css_path.parent.mkdir(parents=True, exist_ok=True)
+    for font_url, name in fonts.items():
+        data = fetch(font_url)
+        write_atomic(css_path.parent / name, lambda f: f.write(data))
+    write_text_atomic(css_path, CSS_URL_RE.sub(
+        lambda m: f"url('{fonts.get(m.group(2), m.group(2))}')", css))
+    return len(fonts)
+
+
+def check_local_assets():
+    """Avant tout rendu, telecharge une fois les copies locales absentes de fonts/ et
+    signale celles qui restent introuvables (hors ligne) : sans elles, les PDF changent
+    de police (Arial / sans-serif au lieu d'Open Sans).
+    Retourne la liste des fichiers manquants."""
+    missing = []
+    for url, path in LOCAL_ASSET_URLS.items():
+        if path.exists():
+            continue
+        try:
+            nb_fonts = download_local_asset(url, path)
+            print(f"[OK] {path.relative_to(BASE_DIR)} téléchargé ({nb_fonts} polices), réutilisé ensuite")
+        except (OSError, ValueError) as e:
+            missing.append(path)
+            print(f"[WARN] {path.relative_to(BASE_DIR)} absent et non téléchargeable ({e}) : les PDF "
+                  f"utiliseront les polices de repli (Arial, sans-serif) au lieu d'Open Sans. Copiez "
+                  f"Open Sans (licence OFL) et sa feuille de style dans {FONTS_DIR.name}/")
+    return missing
+
+
+def get_print_asset_boxes():
+    """Cadres d'affichage des logos et tampons (calcules une fois, par
+    prepare_print_assets ou ici ; recus du parent dans les processus de rendu)"""
+    global _print_asset_boxes
+    if _print_asset_boxes is None:
+        _print_asset_boxes = print_asset_boxes(registry_profiles(get_registry()))
+    return _print_asset_boxes
+
+
+def get_url_fetcher():
+    """Retourne le fetcher de ressources locales du processus"""
+    global _url_fetcher
+    if _url_fetcher is None:
+        _url_fetcher = LocalAssetFetcher()
+    return _url_fetcher
+
+
+def get_shared_stylesheet(css_text):
+    """Retourne la feuille de style analysee pour ce CSS (analysee une seule fois)"""
+    global _font_config
+    if _font_config is None:
+        _font_config = FontConfiguration()
+    if css_text not in _stylesheets:
+        _stylesheets[css_text] = CSS(string=css_text, base_url=str(BASE_DIR),
+                                     url_fetcher=get_url_fetcher(), font_config=_font_config)
+    return _stylesheets[css_text]
+
+
+def prepare_document(html_string):
+    """Prepare le rendu d'un bulletin avec les ressources partagees.
+    Les blocs <style> sont retires du HTML et passes comme feuilles deja analysees.
+    Retourne (document HTML, options de rendu WeasyPrint)."""
+    stylesheets = [get_shared_stylesheet(css) for css in STYLE_BLOCK_RE.findall(html_string)]
+    document = HTML(string=STYLE_BLOCK_RE.sub("", html_string), base_url=str(BASE_DIR),
+                    url_fetcher=get_url_fetcher())
+    options = {"stylesheets": stylesheets, "font_config": _font_config, "cache": _image_cache}
+    return document, options
+
+
+def render_pdf(html_string, pdf_path, fsync=False, return_bytes=False):
+    """Rend un bulletin HTML en PDF (dans le processus principal ou un worker du pool),
+    ecrit de maniere atomique. Retourne la mesure du rendu (voir measure_start / measure_end),
+    avec le contenu du PDF dans "pdf" si return_bytes (export d'archives)."""
+    mesure = measure_start()
+    document, options = prepare_document(html_string)
+    if return_bytes:
+        data = document.write_pdf(**options)
+        write_atomic(pdf_path, lambda f: f.write(data), fsync)
+    else:
+        write_atomic(pdf_path, lambda f: document.write_pdf(f, **options), fsync)
+    resultat = measure_end(mesure)
+    if return_bytes:
+        resultat["pdf"] = data
+    return resultat
+
+
+def write_cohort_pdf(pdf_paths, pdf_path):
+    """Concatene les PDF individuels deja ecrits d'une cohorte dans un seul PDF
+    multi-pages, sans refaire la mise en page. Retourne le nombre de pages ecrites."""
+    writer = pypdf.PdfWriter()
+    for path in pdf_paths:
+        writer.append(path)
+    nb_pages = len(writer.pages)
+    if nb_pages:
+        write_atomic(pdf_path, writer.write)
+    writer.close()
+    return nb_pages
+
+
+# Fonds deja lus et polices deja enregistrees dans reportlab, par processus
+_background_pages = {}
+_stamp_fonts = {}
+
+
+def local_font_faces():
+    """Polices declarees (@font-face) par les copies locales de fonts/, style normal :
+    {famille en minuscules: {graisse: [fichiers .ttf]}}. Un fichier partage par plusieurs
+    graisses (police variable) est ignore : reportlab n'en dessine que l'instance par defaut."""
+    faces = {}
+    for css_path in dict.fromkeys(LOCAL_ASSET_URLS.values()):
+        if not css_path.exists():
+            continue
+        for block in FONT_FACE_RE.findall(css_path.read_text(encoding="utf-8")):
+            declarations = {name: value.strip() for name, value in CSS_DECLARATION_RE.findall(block)}
+            refs = [ref for _, ref in CSS_URL_RE.findall(declarations.get("src", ""))]
+            weight = declarations.get("font-weight", "400").replace("normal", "400").replace("bold", "700")
+            if declarations.get("font-style", "normal") != "normal" or not weight.isdigit() or not refs:
+                continue
+            path = css_path.parent / url2pathname(refs[0])
+            if ":" in refs[0] or path.suffix.lower() != ".ttf" or not path.is_file():
+                continue
+            family = declarations.get("font-family", "").strip("'\" ").lower()
+            faces.setdefault(family, {}).setdefault(int(weight), []).append(str(path))
+    for weights in faces.values():
+        shared = [w for w, paths in weights.items()
+                  if any(p in other for v, other in weights.items() if v != w for p in paths)]
+        for weight in shared:
+            del weights[weight]
+    return {family: weights for family, weights in faces.items() if weights}
+
+
+def match_font_weight(weight, available):
+    """Graisse retenue parmi available pour weight (algorithme de correspondance CSS)"""
+    if weight in available:
+        return weight
+    lighter = sorted((w for w in available if w < weight), reverse=True)
+    bolder = sorted(w for w in available if w > weight)
+    if 400 <= weight <= 500:
+        candidates = [w for w in bolder if w <= 500] + lighter + [w for w in bolder if w > 500]
+    elif weight < 400:
+        candidates = lighter + bolder
+    else:
+        candidates = bolder + lighter
+    return candidates[0] if candidates else None
+
+
+def text_box_style(box, faces):
+    """Style d'un segment de texte de la sonde : taille (px), couleur RGB et fichiers de
+    police locaux de sa famille et de sa graisse. Leve ValueError si le texte ne peut pas
+    etre reproduit a l'identique (famille absente de fonts/, italique, transformation...)"""
+    style = box.style
+    if style["font_style"] != "normal" or style["text_transform"] != "none" \
+            or style["letter_spacing"] != "normal" or style["word_spacing"] != 0:
+        raise ValueError(f"style de texte non reproductible: {box.text!r}")
+    family = next((name.lower() for name in style["font_family"] if name.lower() in faces), None)
+    if family is None:
+        raise ValueError(f"police {style['font_family'][0]} absente de {FONTS_DIR.name}/")
+    weight = match_font_weight(style["font_weight"], faces[family])
+    color = style["color"]
+    rgb = color.to("srgb").coordinates if hasattr(color, "to") else tuple(color)[:3]
+    return {"taille": style["font_size"], "couleur": [float(c) for c in rgb],
+            "polices": faces[family][weight]}
+
+
+def page_text_zones(page_box, faces):
+    """Zones variables d'une page mise en page (sonde de build_page_background) : blocs dont
+    une ligne contient un champ <span data-champ="NOM">. Chaque zone garde sa geometrie
+    (px CSS), son alignement et ses segments (texte fixe ou champ) avec leur style.
+    Retourne (zones, boites de texte des zones)."""
+    zones = []
+    zone_text_boxes = []
+    for box in page_box.descendants():
+        lines = [child for child in getattr(box, "children", ()) if isinstance(child, layout_boxes.LineBox)]
+        texts = [[child for child in line.descendants() if isinstance(child, layout_boxes.TextBox)]
+                 for line in lines]
+        if not any(text.element is not None and text.element.get("data-champ")
+                   for line_texts in texts for text in line_texts):
+            continue
+        if len(lines) != len(box.children) or any(
+                not isinstance(child, (layout_boxes.LineBox, layout_boxes.InlineBox, layout_boxes.TextBox))
+                for line in lines for child in line.descendants()):
+            raise ValueError(f"zone {box.element_tag} melangeant texte et autres boites")
+
+        segments = []
+        for n, (line, line_texts) in enumerate(zip(lines, texts)):
+            for k, text in enumerate(line_texts):
+                champ = text.element.get("data-champ") if text.element is not None else None
+                if champ and segments and segments[-1]["champ"] == champ:
+                    continue  # suite du meme champ coupe sur la ligne suivante
+                # Coupure de ligne de la sonde : l'espace supprime en fin de ligne est remis
+                if n and not k and segments and not segments[-1]["texte"].endswith(("-", " ")):
+                    segments.append({**segments[-1], "champ": None, "texte": " "})
+                segment = text_box_style(text, faces)
+                segment["champ"] = champ
+                segment["texte"] = "" if champ else text.text
+                segment["base"] = text.position_y + text.baseline - line.position_y
+                segments.append(segment)
+        zone_text_boxes.extend(text for line_texts in texts for text in line_texts)
+
+        align = box.style["text_align_all"]
+        vertical = box.vertical_align if isinstance(box, layout_boxes.TableCellBox) else "top"
+        zones.append({
+            "x": box.content_box_x(), "largeur": box.width, "haut": lines[0].position_y,
+            "lignes": len(lines),
+            "pas": lines[1].position_y - lines[0].position_y if len(lines) > 1 else lines[0].height,
+            "alignement": {"right": "right", "end": "right", "center": "center"}.get(align, "left"),
+            "vertical": vertical, "segments": segments,
+        })
+    return zones, zone_text_boxes
+
+
+def build_page_background(html_string, digest, faces):
+    """Met en page une fois la sonde d'un profil (champs variables a leur valeur la plus
+    longue, dans des <span data-champ>), releve ses zones variables (page_text_zones) puis
+    ecrit la meme page sans le texte de ces zones : le fond commun.
+    Fond (.pdf) et zones (.json) sont gardes en cache disque par empreinte.
+    Retourne {"fond": chemin du PDF, "largeur", "hauteur" (px CSS), "zones", "empreinte"}."""
+    json_path = BACKGROUND_CACHE_DIR / f"{digest}.json"
+    pdf_path = BACKGROUND_CACHE_DIR / f"{digest}.pdf"
+    if json_path.exists() and pdf_path.exists():
+        layout = json.loads(json_path.read_text(encoding="utf-8"))
+    else:
+        document, options = prepare_document(html_string)
+        rendered = document.render(**options)
+        if len(rendered.pages) != 1:
+            raise ValueError(f"sonde sur {len(rendered.pages)} pages")
+        page = rendered.pages[0]
+        zones, zone_text_boxes = page_text_zones(page._page_box, faces)
+        # Meme mise en page, texte des zones masque (la place reste reservee)
+        for text in zone_text_boxes:
+            text.style = text.style.copy()
+            text.style["visibility"] = "hidden"
+        BACKGROUND_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        write_atomic(pdf_path, rendered.write_pdf)
+        layout = {"largeur": page.width, "hauteur": page.height, "zones": zones, "empreinte": digest}
+        write_text_atomic(json_path, json.dumps(layout, ensure_ascii=False))
+    layout["fond"] = str(pdf_path)
+    return layout
+
+
+def layout_variant(compiled, values):
+    """Variante de mise en page d'un bulletin : champs de OPTIONAL_TEMPLATE_LINES vides
+    (leur ligne est supprimee)"""
+    return tuple(name for name in OPTIONAL_TEMPLATE_LINES
+                 if name in compiled["placeholders"] and not values[name])
+
+
+def prepare_page_backgrounds(students, contexts):
+    """--pdf-fond : pour chaque profil, champs qui varient d'un eleve a l'autre et fond
+    commun de chaque variante de mise en page (layout_variant), dans ctx["fonds"].
+    L'empreinte du profil integre celle des fonds : un fond modifie refait les bulletins.
+    Retourne le nombre de fonds prets."""
+    if pdfmetrics is None or pypdf is None:
+        print("[WARN] --pdf-fond ignoré : reportlab et pypdf requis (pip install reportlab pypdf)")
+        return 0
+    faces = local_font_faces()
+    try:
+        # Chaque fichier enregistre une fois ici : une police illisible est signalee avant le rendu
+        for weights in faces.values():
+            for path in (path for paths in weights.values() for path in paths):
+                stamp_font([path], "")
+    except (OSError, TTFError) as e:
+        print(f"[WARN] Police locale illisible par reportlab ({e})")
+        faces = {}
+    if not faces:
+        print(f"[WARN] --pdf-fond ignoré : polices locales .ttf absentes de {FONTS_DIR.name}/ "
+              f"(rendu complet de chaque bulletin)")
+        return 0
+
+    nb_fonds = 0
+    for ctx in contexts:
+        template = ctx["template"]
+        all_values = [render_bulletin_values(student, ctx) for student in students]
+        if not all_values:
+            continue
+        champs = [name for name in all_values[0] if len({values[name] for values in all_values}) > 1]
+        variants = {}
+        for values in all_values:
+            variants.setdefault(layout_variant(template, values), []).append(values)
+
+        fonds = {}
+        for variant, group in variants.items():
+            probe = dict(group[0])
+            for name in champs:
+                longest = max((values[name] for values in group), key=len)
+                probe[name] = f'<span data-champ="{name}">{escape(longest)}</span>' if longest else ""
+            probe_html = render_template(template, probe)
+            digest = hashlib.sha256(f"{BACKGROUND_CACHE_VERSION}:{ctx['digest']}:{FONTS_DIR}:{probe_html}"
+                                    .encode("utf-8")).hexdigest()
+            try:
+                with profile_stage("fond_pdf", profil=ctx["cle"]):
+                    fonds[variant] = build_page_background(probe_html, digest, faces)
+            # Boites de mise en page WeasyPrint (API interne) : toute incoherence => rendu complet
+            except (OSError, ValueError, AttributeError, KeyError) as e:
+                print(f"[WARN] Fond commun {ctx['cle'].upper()} impossible ({e}) : rendu complet")
+        if fonds:
+            ctx["fonds"] = fonds
+            empreintes = ",".join(sorted(fond["empreinte"] for fond in fonds.values()))
+            ctx["digest"] = hashlib.sha256(f"{ctx['digest']}:fond:{empreintes}".encode("utf-8")).hexdigest()
+            nb_fonds += len(fonds)
+            print(f"[OK] Fond commun {ctx['cle'].upper()}: {len(fonds)} mise(s) en page, "
+                  f"{len(champs)} champs propres à chaque élève")
+    return nb_fonds
+
+
+def page_background(ctx, values):
+    """Fond commun du bulletin de valeurs values, None s'il doit etre rendu completement"""
+    return ctx.get("fonds", {}).get(layout_variant(ctx["template"], values))
+
+
+def stamp_font(paths, text):
+    """Nom reportlab de la premiere police de paths qui contient tous les caracteres de
+    text (enregistree une fois par processus), None si aucune"""
+    for path in paths:
+        if path not in _stamp_fonts:
+            name = f"fond_{hashlib.sha256(path.encode('utf-8')).hexdigest()[:12]}"
+            pdfmetrics.registerFont(TTFont(name, path))
+            _stamp_fonts[path] = (name, frozenset(pdfmetrics.getFont(name).face.charToGlyph))
+        name, glyphs = _stamp_fonts[path]
+        if all(ord(c) in glyphs for c in text):
+            return name
+    return None
+
+
+def layout_zone_lines(zone, values):
+    """Decoupe le texte d'une zone pour un eleve en lignes de morceaux
+    (texte, segment, police, largeur en px) et leurs largeurs, comme le navigateur
+    (coupures aux espaces seulement). None si le texte ne tient pas dans les lignes de la
+    sonde, contient du balisage ou un caractere absent des polices."""
+    words = []  # ([(texte, segment)], segment de l'espace qui precede ou None)
+    space = None
+    new_word = True
+    for segment in zone["segments"]:
+        text = values[segment["champ"]] if segment["champ"] else segment["texte"]
+        if segment["champ"] and ("<" in text or "&" in text):
+            return None
+        for token in re.split(r"(\s+)", text):
+            if not token:
+                continue
+            if token.isspace():
+                space, new_word = segment, True
+            elif new_word or not words:
+                words.append(([(token, segment)], space if words else None))
+                new_word = False
+            else:
+                words[-1][0].append((token, segment))
 
+    def measure(text, segment):
+        font = stamp_font(segment["polices"], text)
+        if font is None:
+            return None
+        return text, segment, font, pdfmetrics.stringWidth(text, font, segment["taille"])
+
+    max_width = zone["largeur"] + BACKGROUND_FIT_TOLERANCE_PX
+    lines, widths = [[]], [0.0]
+    for pieces, space_segment in words:
+        measured = [measure(text, segment) for text, segment in pieces]
+        if None in measured:
+            return None
+        width = sum(piece[3] for piece in measured)
+        if width > max_width:
+            return None
+        space_piece = measure(" ", space_segment) if space_segment and lines[-1] else None
+        space_width = space_piece[3] if space_piece else 0.0
+        if lines[-1] and widths[-1] + space_width + width > max_width:
+            lines.append([])
+            widths.append(0.0)
+        elif space_piece:
+            lines[-1].append(space_piece)
+            widths[-1] += space_width
+        lines[-1].extend(measured)
+        widths[-1] += width
+    if len(lines) > zone["lignes"]:
+        return None
+    return lines, widths
+
+
+def stamp_overlay(fond, values):
+    """Calque PDF (octets) des champs d'un eleve a la position de leurs zones sur le fond,
+    None si un texte ne tient pas (layout_zone_lines)"""
+    buffer = io.BytesIO()
+    page_height = fond["hauteur"]
+    pdf = pdf_canvas.Canvas(buffer, pagesize=(fond["largeur"] * PX_TO_PT, page_height * PX_TO_PT),
+                            invariant=1)
+    for zone in fond["zones"]:
+        result = layout_zone_lines(zone, values)
+        if result is None:
+            return None
+        lines, widths = result
+        # Cellule centree verticalement : moins de lignes que la sonde => bloc decale
+        shift = (zone["lignes"] - len(lines)) * zone["pas"]
+        shift = {"middle": shift / 2, "bottom": shift}.get(zone["vertical"], 0.0)
+        for i, (line, width) in enumerate(zip(lines, widths)):
+            x = zone["x"] + {"right": zone["largeur"] - width,
+                             "center": (zone["largeur"] - width) / 2}.get(zone["alignement"], 0.0)
+            top = zone["haut"] + shift + i * zone["pas"]
+            # Morceaux voisins de meme segment et police : un seul texte (copier-coller du PDF)
+            runs = []
+            for text, segment, font, text_width in line:
+                if runs and runs[-1][1] is segment and runs[-1][2] == font:
+                    runs[-1][0] += text
+                    runs[-1][3] += text_width
+                else:
+                    runs.append([text, segment, font, text_width])
+            for text, segment, font, text_width in runs:
+                if not text.isspace():
+                    pdf.setFont(font, segment["taille"] * PX_TO_PT)
+                    pdf.setFillColorRGB(*segment["couleur"])
+                    pdf.drawString(x * PX_TO_PT, (page_height - top - segment["base"]) * PX_TO_PT, text)
+                x += text_width
+    pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def stamp_pdf(fond, values, html_string, pdf_path, fsync=False, return_bytes=False):
+    """--pdf-fond : ecrit le PDF d'un bulletin en posant les champs de l'eleve sur le fond
+    commun de son profil ; rendu complet (render_pdf) si un texte ne tient pas.
+    Retourne la mesure comme render_pdf, avec "fond" a True si le fond a servi."""
+    mesure = measure_start()
+    overlay = stamp_overlay(fond, values)
+    if overlay is None:
+        resultat = render_pdf(html_string, pdf_path, fsync, return_bytes)
+        resultat["fond"] = False
+        return resultat
+
+    if fond["fond"] not in _background_pages:
+        _background_pages[fond["fond"]] = pypdf.PdfReader(fond["fond"])
+    background = _background_pages[fond["fond"]]
+    writer = pypdf.PdfWriter()
+    page = writer.add_page(background.pages[0])
+    page.merge_page(pypdf.PdfReader(io.BytesIO(overlay)).pages[0])
+    page.compress_content_streams()
+    if background.metadata:
+        writer.add_metadata(background.metadata)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    data = buffer.getvalue()
+    write_atomic(pdf_path, lambda f: f.write(data), fsync)
+    resultat = measure_end(mesure)
+    resultat["fond"] = True
+    if return_bytes:
+        resultat["pdf"] = data
+    return resultat
+
+
+# === PIPELINE DE GENERATION ===
+# ingestion -> enrichissement -> notes ajustees -> rendu HTML -> ecriture/PDF
+# Les eleves ne sont jamais copies ; seule la reduction des statistiques de classe
+# demande un passage complet, le reste s'enchaine eleve par eleve (generateurs).
+
+def matiere_notes_key(matiere):
+    """Cle de la note ajustee d'une matiere de profil (matiere source de la cohorte)"""
+    return matiere.get("source", matiere["nom"])
+
+
+def profile_output_dirs(profil_key):
+    """Dossiers de sortie (HTML, PDF) d'un profil"""
+    return BASE_DIR / f"bulletins_html_{profil_key}", BASE_DIR / f"bulletins_pdf_{profil_key}"
+
+
+def enrich_students(students, identity_dict, bulletins_paes_identities):
+    """Etape enrichissement : complete chaque eleve (sur place) avec la date de
+    naissance et le choix de bulletin des formulaires d'identite"""
+    for s in students:
+        sid = s["_id"]
+        if sid in identity_dict:
+            s["date_naissance"] = identity_dict[sid]["date_naissance"]
+            s["choix"] = identity_dict[sid]["choix"]
+        elif sid in bulletins_paes_identities:
+            s["date_naissance"] = s.get("date_naissance") or bulletins_paes_identities[sid]["date_naissance"]
+            s["choix"] = s.get("choix") or bulletins_paes_identities[sid]["choix"]
+        else:
+            s["choix"] = s.get("choix", "Formulaire non rempli")
+
+
+def name_tokens(student):
+    """Tokens normalises et tries du prenom + nom (ordre et tirets ignores)"""
+    full = f"{normalize_key(student.get('prenom'))} {normalize_key(student.get('nom'))}"
+    return tuple(sorted(full.split()))
+
+
+def blocking_keys(student):
+    """Cles de blocage d'un eleve : seuls les eleves partageant une cle sont compares.
+    Chaque token du nom de famille avec l'initiale du prenom ("juston a") rapproche
+    aussi les noms composes ou incomplets (Ambre Juston / Ambre Juston-Chimot)."""
+    tokens = name_tokens(student)
+    if tokens:
+        yield ("noms", " ".join(tokens))
+    prenom = normalize_key(student.get("prenom"))
+    if prenom:
+        for token in dict.fromkeys(normalize_key(student.get("nom")).split()):
+            yield ("nom_initiale", f"{token} {prenom[0]}")
+    email = (student.get("email") or "").strip().lower()
+    if "@" in email and email.split("@", 1)[0]:
+        yield ("email", email.split("@", 1)[0])
+    date_naiss = format_date(student.get("date_naissance"))
+    if date_naiss:
+        yield ("naissance", date_naiss)
+
+
+def similar_names(tokens_a, tokens_b):
+    """Ressemblance de deux noms : "identiques" (memes tokens, ordre ignore),
+    "inclusion" (l'un inclus dans l'autre : nom compose, second prenom),
+    "proches" (simple faute de frappe possible, ex: Louis / Louise) ou None"""
+    if tokens_a == tokens_b:
+        return "identiques"
+    set_a, set_b = set(tokens_a), set(tokens_b)
+    if min(len(set_a), len(set_b)) >= 2 and (set_a <= set_b or set_b <= set_a):
+        return "inclusion"
+    ratio = SequenceMatcher(None, " ".join(tokens_a), " ".join(tokens_b)).ratio()
+    return "proches" if ratio >= DUPLICATE_NAME_RATIO else None
+
+
+def student_email(student):
+    """Email normalise d'un eleve ("" si absent)"""
+    return (student.get("email") or "").strip().lower()
+
+
+def merge_student(primary, other):
+    """Complete l'eleve conserve avec les donnees du doublon absorbe"""
+    for matiere, note in other["notes"].items():
+        if primary["notes"].get(matiere) is None:
+            primary["notes"][matiere] = note
+    if not primary.get("email"):
+        primary["email"] = other.get("email", "")
+    if primary.get("date_naissance") is None:
+        primary["date_naissance"] = other.get("date_naissance")
+    if primary.get("choix", "Formulaire non rempli") == "Formulaire non rempli" and other.get("choix"):
+        primary["choix"] = other["choix"]
+
+
+def find_duplicates(students, merge=False):
+    """Etape doublons : detecte les eleves probablement identiques via les cles de
+    blocage (tokens du nom tries, partie locale de l'email, date de naissance).
+    Seuls les noms identiques ou inclus l'un dans l'autre, sans emails ni dates
+    differents, sont des doublons surs : fusionnes avec merge=True (--fusion),
+    sinon proposes dans le rapport. Noms seulement proches (faute de frappe ou
+    prenoms differents), emails ou dates en conflit, ou meme email seul : signalement,
+    jamais de fusion. Retourne (eleves conserves, rapport)"""
+    blocks = {}
+    for i, student in enumerate(students):
+        for key in blocking_keys(student):
+            blocks.setdefault(key, []).append(i)
+
+    pairs = {}
+    for (kind, _), members in blocks.items():
+        if len(members) < 2 or len(members) > DUPLICATE_BLOCK_MAX:
+            continue
+        for a, b in combinations(members, 2):
+            pairs.setdefault((a, b), set()).add(kind)
+
+    # Groupes de doublons (union-find) : A ~ B et B ~ C -> un seul eleve, tant que
+    # le groupe ne reunit pas deux emails ou deux dates de naissance differents
+    parent = list(range(len(students)))
+    emails = [{student_email(s)} - {""} for s in students]
+    dates = [{format_date(s.get("date_naissance"))} - {""} for s in students]
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def signal(sa, sb, kinds, motif):
+        report.append({
+            "action": "signalement",
+            "eleves": [f"{sa['prenom']} {sa['nom']}", f"{sb['prenom']} {sb['nom']}"],
+            "cles": sorted(kinds),
+            "motif": motif,
+        })
+
+    report = []
+    merged_pairs = []
+    for (a, b), kinds in sorted(pairs.items()):
+        sa, sb = students[a], students[b]
+        names = similar_names(name_tokens(sa), name_tokens(sb))
+        email_a, email_b = student_email(sa), student_email(sb)
+        date_a, date_b = format_date(sa.get("date_naissance")), format_date(sb.get("date_naissance"))
+        if names is None:
+            if "email" in kinds:
+                signal(sa, sb, kinds, "même email, noms différents")
+        elif email_a and email_b and email_a != email_b:
+            signal(sa, sb, kinds, "emails différents")
+        elif date_a and date_b and date_a != date_b:
+            signal(sa, sb, kinds, "dates de naissance différentes")
+        elif names == "proches":
+            signal(sa, sb, kinds, "noms proches seulement")
+        elif not merge:
+            report.append({
+                "action": "fusion_proposee",
+                "eleves": [f"{sa['prenom']} {sa['nom']}", f"{sb['prenom']} {sb['nom']}"],
+                "cles": sorted(kinds),
+                "fichiers": [bulletin_filename_base(sa), bulletin_filename_base(sb)],
+            })
+        else:
+            root_a, root_b = find(a), find(b)
+            if root_a == root_b:
+                continue
+            if len(emails[root_a] | emails[root_b]) > 1 or len(dates[root_a] | dates[root_b]) > 1:
+                signal(sa, sb, kinds, "groupe de doublons en conflit (emails ou dates)")
+                continue
+            merged_pairs.append((a, b, kinds))
+            parent[root_b] = root_a
+            emails[root_a] |= emails[root_b]
+            dates[root_a] |= dates[root_b]
+
+    groups = {}
+    for i in range(len(students)):
+        groups.setdefault(find(i), []).append(i)
+
+    # Eleve conserve : le plus de notes, puis celui de notes/, puis le premier lu
+    def rank(i):
+        s = students[i]
+        nb_notes = sum(1 for v in s["notes"].values() if v is not None)
+        return (-nb_notes, bool(s.get("_is_new")), i)
+
+    absorbed = set()
+    kinds_by_index = {}
+    for a, b, kinds in merged_pairs:
+        kinds_by_index.setdefault(a, set()).update(kinds)
+        kinds_by_index.setdefault(b, set()).update(kinds)
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        members.sort(key=rank)
+        primary = students[members[0]]
+        for i in members[1:]:
+            other = students[i]
+            merge_student(primary, other)
+            absorbed.add(i)
+            report.append({
+                "action": "fusion",
+                "conserve": f"{primary['prenom']} {primary['nom']}",
+                "absorbe": f"{other['prenom']} {other['nom']}",
+                "cles": sorted(kinds_by_index.get(i, ())),
+                "fichier_absorbe": bulletin_filename_base(other),
+                "fichier_conserve": bulletin_filename_base(primary),
+            })
+
+    kept = [s for i, s in enumerate(students) if i not in absorbed]
+    return kept, report
+
+
+def remove_merged_outputs(report, contexts, manifest):
+    """Supprime les bulletins deja generes pour les eleves absorbes par une fusion"""
+    removed = 0
+    for entry in report:
+        if entry["action"] != "fusion" or entry["fichier_absorbe"] == entry["fichier_conserve"]:
+            continue
+        for ctx in contexts:
+            manifest[ctx["cle"]].pop(entry["fichier_absorbe"], None)
+            for path in (ctx["html_dir"] / f"{entry['fichier_absorbe']}.html",
+                         ctx["pdf_dir"] / f"{entry['fichier_absorbe']}.pdf"):
+                if path.exists():
+                    path.unlink()
+                    removed += 1
+    return removed
+
+
+def iter_adjusted_students(students, adjusted_matrix, matieres_config, contexts=()):
+    """Etape notes ajustees : attache a chaque eleve sa ligne de la matrice
+    des notes ajustees, au moment ou l'etape suivante le demande.
+    Avec contexts, les niveaux d'appreciation de chaque profil sont calcules
+    pour toute la cohorte en une operation et attaches de la meme facon."""
+    matiere_noms = [m["nom"] for m in matieres_config]
+    band_rows = [(ctx["cle"], appreciation_bands(adjusted_matrix[:, ctx["colonnes"]],
+                                                 ctx["appreciations_table"]["seuils"]).tolist())
+                 for ctx in contexts]
+    for i, (student, row) in enumerate(zip(students, adjusted_matrix)):
+        student["adjusted_notes"] = dict(zip(matiere_noms, row.tolist()))
+        student["appreciation_bands"] = {cle: rows[i] for cle, rows in band_rows}
+        yield student
+
+
+def bulletin_filename_base(student):
+    """Nom de fichier (sans extension) des bulletins d'un eleve"""
+    prenom = student['prenom'] or 'inconnu'
+    nom = student['nom'] or 'inconnu'
+    return f"bulletin_{sanitize_filename(prenom)}_{sanitize_filename(nom)}"
+
+
+def render_bulletin_values(student, ctx):
+    """Valeurs des champs du bulletin d'un eleve pour un contexte de rendu (profil)"""
+    return bulletin_values(student, ctx["stats"], ctx["profil"], ctx["matieres"],
+                           ctx["appreciations_table"], notes_key_fn=ctx["notes_key_fn"],
+                           bands=student.get("appreciation_bands", {}).get(ctx["cle"]))
+
+
+def render_bulletin_html(student, ctx):
+    """HTML du bulletin d'un eleve pour un contexte de rendu (profil)"""
+    return render_template(ctx["template"], render_bulletin_values(student, ctx))
+
+
+def iter_rendered_bulletins(students, contexts, manifest, force=False, html_archive=None,
+                            html_files=False):
+    """Etape rendu HTML : pour chaque eleve, produit (eleve, [(contexte, filename_base, html, hash)])
+    avec uniquement les bulletins dont le PDF manque, est tronque ou dont l'empreinte a change
+    (tous les bulletins si force). Le HTML d'un bulletin a jour mais absent de html_archive,
+    ou de son dossier avec html_files (--sorties pdf-html), est ecrit directement : son PDF
+    n'est pas rendu a nouveau.
+    contexts: un dict par profil (cle, template, profil, matieres, appreciations,
+    appreciations_table, colonnes, stats, notes_key_fn, digest, html_dir, pdf_dir)"""
+    for student in students:
+        filename_base = bulletin_filename_base(student)
+        rendus = []
+        for ctx in contexts:
+            inputs_hash = student_inputs_hash(student, ctx["digest"], ctx["matieres"], ctx["notes_key_fn"])
+            pdf_path = ctx["pdf_dir"] / f"{filename_base}.pdf"
+            if not force and manifest[ctx["cle"]].get(filename_base) == inputs_hash \
+                    and is_complete_pdf(pdf_path):
+                archive_name = html_archive_name(ctx["cle"], filename_base)
+                html_path = ctx["html_dir"] / f"{filename_base}.html"
+                if html_archive is not None and html_archive.missing(archive_name):
+                    with profile_stage("archive_html", profil=ctx["cle"], eleve=filename_base):
+                        html_archive.add(archive_name, render_bulletin_html(student, ctx))
+                elif html_files and not html_path.exists():
+                    with profile_stage("ecriture_html", profil=ctx["cle"], eleve=filename_base):
+                        write_text_atomic(html_path, render_bulletin_html(student, ctx))
+                continue
+            with profile_stage("generate_bulletin_html", profil=ctx["cle"], eleve=filename_base):
+                html = render_bulletin_html(student, ctx)
+            rendus.append((ctx, filename_base, html, inputs_hash))
+        yield student, rendus
+
+
+def write_bulletins(rendered, total, manifest, workers, output_dirs, fsync_mode=FSYNC_MODE_DEFAUT,
+                    output_mode=OUTPUT_MODE_DEFAUT, html_archive=None, exporter=None, contexts=(),
+                    pool=None):
+    """Etape ecriture : ecrit le HTML et rend le PDF de chaque bulletin produit par
+    iter_rendered_bulletins. Le rendu PDF peut etre reparti sur un pool de processus
+    (--workers N) ; les lignes [i/N] restent affichees dans l'ordre des eleves : on
+    attend les PDF du plus ancien eleve en cours des que la fenetre d'attente est pleine.
+    Les dossiers de sortie sont synchronises par lot, juste avant chaque sauvegarde du
+    manifeste : le manifeste ne reference que des fichiers deja sur disque.
+    Selon output_mode, le HTML est ecrit dans son dossier, ajoute a html_archive
+    ou seulement passe en memoire au rendu PDF ; "html" ne rend aucun PDF.
+    Avec exporter, chaque PDF rendu est ajoute aux archives depuis la memoire ;
+    les PDF des contexts deja a jour sont repris du disque.
+    Les profils qui ont un fond commun (prepare_page_backgrounds) posent les champs de
+    l'eleve sur ce fond (stamp_pdf) au lieu de refaire toute la mise en page.
+    Un pool fourni (partage entre cohortes) n'est pas arrete a la fin."""
+    fsync_files = fsync_mode == "fichier"
+    write_html = output_mode in ("html", "pdf-html")
+    write_pdf = output_mode != "html"
+    own_pool = pool is None
+    if not write_pdf:
+        pool = None
+    elif own_pool:
+        pool = create_render_pool(workers)
+    max_pending = workers * 2 if pool else 0
+    pending = deque()  # (i, eleve, [(future PDF, profil, filename_base, hash)])
+    nb_pdf = {"fond": 0, "complet": 0}
+
+    def submit_pdf(html_string, pdf_path, fond=None, values=None):
+        fn, args = render_pdf, (html_string, str(pdf_path) if pool else pdf_path,
+                                fsync_files, exporter is not None)
+        if fond is not None:
+            fn, args = stamp_pdf, (fond, values) + args
+        if pool:
+            return pool.submit(fn, *args)
+        future = Future()
+        future.set_result(fn(*args))
+        gc.collect()
+        return future
+
+    def flush_pending(limit):
+        while len(pending) > limit:
+            done_i, done_student, jobs = pending.popleft()
+            rendered_profiles = set()
+            for future, profil_key, done_filename, inputs_hash in jobs:
+                mesure = future.result()
+                pdf_data = mesure.pop("pdf", None)
+                sur_fond = mesure.pop("fond", False)
+                nb_pdf["fond" if sur_fond else "complet"] += 1
+                record_profile_event("stamp_pdf" if sur_fond else "write_pdf", mesure,
+                                     profil=profil_key, eleve=done_filename)
+                manifest[profil_key][done_filename] = inputs_hash
+                if exporter is not None:
+                    exporter.add(done_student, profil_key, done_filename, pdf_data)
+                    rendered_profiles.add(profil_key)
+            if exporter is not None:
+                with profile_stage("export_archives", eleve=bulletin_filename_base(done_student)):
+                    for ctx in contexts:
+                        if ctx["cle"] not in rendered_profiles:
+                            exporter.add_from_disk(done_student, ctx["cle"],
+                                                   ctx["pdf_dir"] / f"{bulletin_filename_base(done_student)}.pdf")
+            print(f"  [{done_i}/{total}] {done_student['prenom'] or 'inconnu'} {done_student['nom'] or 'inconnu'} OK")
+            if done_i % MANIFEST_SAVE_EVERY == 0:
+                if fsync_mode != "aucune":
+                    sync_directories(output_dirs)
+                save_manifest(manifest)
+
+    try:
+        for i, (student, rendus) in enumerate(rendered, start=1):
+            jobs = []
+            for ctx, filename_base, html, inputs_hash in rendus:
+                if write_html:
+                    with profile_stage("ecriture_html", profil=ctx["cle"], eleve=filename_base):
+                        write_text_atomic(ctx["html_dir"] / f"{filename_base}.html", html, fsync_files)
+                elif html_archive is not None:
+                    with profile_stage("archive_html", profil=ctx["cle"], eleve=filename_base):
+                        html_archive.add(html_archive_name(ctx["cle"], filename_base), html)
+                if write_pdf:
+                    values = fond = None
+                    if ctx.get("fonds"):
+                        values = render_bulletin_values(student, ctx)
+                        fond = page_background(ctx, values)
+                    future = submit_pdf(html, ctx["pdf_dir"] / f"{filename_base}.pdf", fond, values)
+                    jobs.append((future, ctx["cle"], filename_base, inputs_hash))
+            del rendus
+            pending.append((i, student, jobs))
+            flush_pending(max_pending)
+
+        flush_pending(0)
+        if any(ctx.get("fonds") for ctx in contexts) and sum(nb_pdf.values()):
+            print(f"[OK] {nb_pdf['fond']} PDF posés sur fond commun, {nb_pdf['complet']} rendus "
+                  f"complètement (texte trop long pour sa zone ou autre mise en page)")
+    finally:
+        if pool and own_pool:
+            pool.shutdown(cancel_futures=True)
+        with profile_stage("ecriture_manifeste"):
+            if fsync_mode != "aucune":
+                sync_directories(output_dirs)
+            save_manifest(manifest)
+
+
+def load_workbooks(registry, workers=1):
+    """Lit une seule fois les classeurs de toutes les cohortes (lecture seule,
+    en parallele avec --workers)"""
+    print(f"[...] Lecture des classeurs Excel...")
+    with profile_stage("preload_workbooks"):
+        nb_workbooks, nb_cached = preload_workbooks(registry, workers)
+    print(f"[OK] {nb_workbooks} classeurs lus ({nb_cached} depuis le cache)")
+
+
+def load_students(cohort, merge=False):
+    """Ingestion complete d'une cohorte : sources de notes, dates de naissance,
+    nouveaux resultats, eleves sans notes, notes complementaires, formulaires
+    d'identite puis detection des doublons. Chaque source est lue une seule fois
+    (classeurs deja charges par load_workbooks / le cache).
+    Retourne (eleves, rapport des doublons)"""
+    print(f"[...] Lecture des sources de {cohort['cohorte']}...")
+    sources = {role: [] for role in SOURCE_ROLES}
+    with profile_stage("lecture_sources", cohorte=cohort["cohorte"]):
+        for source in cohort["sources"]:
+            records = read_source(source)
+            # Formulaires d'identite : le premier present suffit, les autres sont optionnels
+            if records is None and source["role"] != "identites":
+                print(f"  [WARN] Fichier non trouvé: {source['chemin']}")
+            sources[source["role"]].append((source, records))
+    print(f"[OK] {len(cohort['sources'])} sources lues")
+
+    students = students_from_note_sources(sources["notes"])
+    print(f"[OK] {len(students)} élèves chargés depuis les classeurs de notes")
     if not students:
-        print("[ERREUR] Aucun élève trouvé. Vérifiez les fichiers Excel dans le dossier notes/")
-        return
+        print(f"[ERREUR] Aucun élève trouvé. Vérifiez les classeurs de notes de {cohort['source']}")
+        return [], []
+
+    if sources["dates"]:
+        matched = apply_birth_dates(sources["dates"], students)
+        print(f"  [OK] {matched} dates de naissance associées")
 
-    # Charger les nouveaux étudiants depuis nouveauxresultats/
-    print(f"[...] Chargement des nouveaux résultats depuis {NOUVEAUX_RESULTATS_DIR}...")
-    existing_keys = set(
-        make_student_key(s.get("prenom") or "", s.get("nom") or "")
-        for s in students
-    )
-    new_students_with_notes = load_nouveaux_resultats(existing_keys)
-    nouveaux_keys = set(
-        make_student_key(s.get("prenom") or "", s.get("nom") or "")
-        for s in new_students_with_notes
-    )
+    # Nouveaux étudiants : absents des classeurs de notes
+    existing_ids = set(s["_id"] for s in students)
+    new_students_with_notes = students_from_note_sources(sources["nouveaux"], existing_ids, is_new=True)
+    nouveaux_ids = set(s["_id"] for s in new_students_with_notes)
     print(f"[OK] {len(new_students_with_notes)} nouveaux élèves avec notes médecine")
 
-    # Charger les étudiants de Bulletins PAES sans aucune note
-    new_students_no_notes = load_bulletins_paes_only_students(existing_keys, nouveaux_keys)
-    print(f"[OK] {len(new_students_no_notes)} élèves supplémentaires depuis Bulletins PAES (sans notes)")
+    # Étudiants des identites des nouveaux sans aucune note
+    new_students_no_notes = students_from_identity_sources(cohort, sources["identites_nouveaux"],
+                                                           existing_ids | nouveaux_ids)
+    if sources["identites_nouveaux"]:
+        print(f"[OK] {len(new_students_no_notes)} élèves supplémentaires sans notes")
 
     # Fusionner tous les étudiants
     students.extend(new_students_with_notes)
     students.extend(new_students_no_notes)
     print(f"[OK] Total: {len(students)} élèves")
 
+    if sources["complement"]:
+        added = apply_complement_notes(sources["complement"], students)
+        print(f"[OK] {added} notes complémentaires ajoutées "
+              f"({', '.join(sorted({s['matiere'] for s, _ in sources['complement']}))})")
+
     # Enrichir les élèves avec les données du formulaire identité (date + choix)
     print(f"[...] Chargement du formulaire identité...")
-    identity_dict = load_identity_choices()
-    bulletins_paes_identities = load_bulletins_paes_identities()
-    enriched_students = []
-    for s in students:
-        key = make_student_key(s.get("prenom") or "", s.get("nom") or "")
-        if key in identity_dict:
-            enriched_students.append({
-                **s,
-                "date_naissance": identity_dict[key]["date_naissance"],
-                "choix": identity_dict[key]["choix"],
-            })
-        elif key in bulletins_paes_identities:
-            enriched_students.append({
-                **s,
-                "date_naissance": s.get("date_naissance") or bulletins_paes_identities[key]["date_naissance"],
-                "choix": s.get("choix") or bulletins_paes_identities[key]["choix"],
-            })
+    identity_dict = identity_choices(cohort, sources["identites"])
+    bulletins_paes_identities = identity_choices(cohort, sources["identites_nouveaux"])
+    enrich_students(students, identity_dict, bulletins_paes_identities)
+
+    # Doublons probables (ex: "Ambre Juston" / "Ambre Juston-Chimot") avant le rendu
+    print(f"[...] Détection des doublons...")
+    with profile_stage("find_duplicates", cohorte=cohort["cohorte"]):
+        students, duplicates_report = find_duplicates(students, merge=merge)
+    for entry in duplicates_report:
+        if entry["action"] == "fusion":
+            print(f"  [OK] Fusion: {entry['absorbe']} -> {entry['conserve']} ({', '.join(entry['cles'])})")
+        elif entry["action"] == "fusion_proposee":
+            print(f"  [INFO] Fusion proposée (--fusion): {' / '.join(entry['eleves'])} "
+                  f"({', '.join(entry['cles'])})")
         else:
-            enriched_students.append({
-                **s,
-                "choix": s.get("choix", "Formulaire non rempli"),
-            })
+            print(f"  [WARN] Doublon possible: {' / '.join(entry['eleves'])} "
+                  f"({', '.join(entry['cles'])}, {entry['motif']})")
+    nb_fusions = sum(1 for entry in duplicates_report if entry["action"] == "fusion")
+    nb_proposees = sum(1 for entry in duplicates_report if entry["action"] == "fusion_proposee")
+    print(f"[OK] {nb_fusions} doublons fusionnés, {nb_proposees} fusions proposées, "
+          f"{len(duplicates_report) - nb_fusions - nb_proposees} signalés, {len(students)} élèves")
+
+    return students, duplicates_report
+
+
+def prepare_notes(students, cohort):
+    """Notes ajustees et statistiques de classe : la seule etape qui demande un
+    passage complet sur les eleves (trie les eleves sur place, existants d'abord).
+    Retourne (matrice des notes ajustees, stats par matiere de la cohorte)"""
+    # Pre-calculer les notes ajustees UNE SEULE FOIS par eleve/matiere de la cohorte
+    # pour que tous les profils aient exactement les memes moyennes
+    # Seed fixe pour que les notes soient identiques si on relance le script
+    # On traite les eleves existants AVANT les nouveaux pour preserver le seed
+    libelles = "/".join(p["libelle"] for p in cohort["profils"])
+    print(f"[...] Pré-calcul des notes ajustées (identiques {libelles})...")
+    random.seed(42)
+    # Tri stable : les eleves du dossier de notes sont deja en tete, les nouveaux a la suite
+    students.sort(key=lambda s: bool(s.get("_is_new")))
+    nb_new = sum(1 for s in students if s.get("_is_new"))
+
+    with profile_stage("precalcul_notes", cohorte=cohort["cohorte"]):
+        raw_matrix = build_grade_matrix(students, cohort["matieres"])
+        # Matieres hors bulletin (ex: concours blanc) : pas de note aleatoire
+        adjusted_matrix = adjust_grade_matrix(raw_matrix, cohort_transforms(cohort),
+                                              [m.get("bulletin", True) for m in cohort["matieres"]])
+        del raw_matrix
+    print(f"[OK] Notes ajustées pré-calculées ({len(students) - nb_new} existants + {nb_new} nouveaux)")
+
+    print(f"[...] Calcul des statistiques de classe...")
+    with profile_stage("calcul_statistiques", cohorte=cohort["cohorte"]):
+        class_stats = class_stats_from_matrix(adjusted_matrix, cohort["matieres"])
+    print(f"[OK] Statistiques de classe calculées")
+
+    return adjusted_matrix, class_stats
+
+
+def build_render_contexts(cohort, class_stats):
+    """Contextes de rendu des profils d'une cohorte (template compile, referentiel,
+    statistiques de classe, empreinte du profil et dossiers de sortie).
+    Les statistiques d'un profil sont celles des matieres sources de la cohorte,
+    simplement remappees (pas de recalcul)."""
+    colonnes = {m["nom"]: j for j, m in enumerate(cohort["matieres"])}
+    contexts = []
+    for profil in cohort["profils"]:
+        template_text = profil["template"].read_text(encoding="utf-8")
+        with profile_stage("calcul_statistiques", profil=profil["cle"]):
+            stats = remap_class_stats(class_stats, profil["matieres"], matiere_notes_key)
+        html_dir, pdf_dir = profile_output_dirs(profil["cle"])
+        contexts.append({
+            "cle": profil["cle"], "cohorte": cohort["cohorte"],
+            "template": compile_template(template_text), "profil": profil["etablissement"],
+            "matieres": profil["matieres"], "appreciations": profil["appreciations"],
+            # Appreciations compilees une fois par profil, indexees par (matiere, niveau)
+            "appreciations_table": compile_appreciations(profil["matieres"], profil["appreciations"],
+                                                         profil["seuils_appreciation"]),
+            # Colonnes de la matrice des notes ajustees de la cohorte pour les matieres du profil
+            "colonnes": [colonnes[matiere_notes_key(m)] for m in profil["matieres"]],
+            "stats": stats, "notes_key_fn": matiere_notes_key,
+            "digest": profile_inputs_digest(template_text, profil["etablissement"], profil["matieres"],
+                                            profil["appreciations"], stats, profil["seuils_appreciation"]),
+            "html_dir": html_dir, "pdf_dir": pdf_dir,
+        })
+    return contexts
+
+
+def print_notes_stats(cohort, class_stats, transforms, duree):
+    """Tableau moyenne/min/max de chaque matiere d'une cohorte (--dry-run-stats)"""
+    print(f"\n[OK] Statistiques {cohort['cohorte']} en {duree * 1000:.1f} ms")
+    print(f"  {'Matière':<36} {'Moyenne':>8} {'Min':>6} {'Max':>6}  Transformation")
+    for matiere, spec in zip(cohort["matieres"], transforms):
+        stats = class_stats[matiere["nom"]]
+        print(f"  {matiere['nom'][:36]:<36} {format_note(stats['moyenne']):>8} "
+              f"{format_note(stats['min']):>6} {format_note(stats['max']):>6}  {spec['nom']}")
+
+
+def cohort_ranking(adjusted_matrix, matieres_config):
+    """Classement de la cohorte par moyenne generale des matieres du bulletin
+    (meme moyenne que sur les bulletins). Retourne (moyennes, rangs, ordre) :
+    ex aequo au meme rang, ordre = indices des eleves du premier au dernier."""
+    bulletin = np.array([m.get("bulletin", True) for m in matieres_config], dtype=bool)
+    moyennes = adjusted_matrix[:, bulletin].mean(axis=1)
+    # Rang = 1 + nombre d'eleves de moyenne strictement superieure
+    rangs = len(moyennes) - np.searchsorted(np.sort(moyennes), moyennes, side="right") + 1
+    ordre = np.argsort(-moyennes, kind="stable")
+    return moyennes, rangs, ordre
+
+
+def subject_histograms(adjusted_matrix, matieres_config):
+    """Effectifs de chaque matiere par tranche de REPORT_HISTOGRAM_BINS (notes manquantes ignorees)"""
+    return {m["nom"]: np.histogram(colonne[~np.isnan(colonne)], bins=REPORT_HISTOGRAM_BINS)[0].tolist()
+            for m, colonne in zip(matieres_config, adjusted_matrix.T)}
+
+
+def report_columns(matieres_config):
+    """En-tetes de l'export des notes ajustees"""
+    return (["Rang", "Prenom", "Nom", "Email", "Choix", "Nouveau", "Moyenne generale"]
+            + [m["nom"] for m in matieres_config])
+
+
+def write_notes_csv(path, students, adjusted_matrix, matieres_config, moyennes, rangs, ordre):
+    """Export CSV des notes ajustees dans l'ordre du classement (separateur ";" et
+    virgule decimale pour Excel ; note manquante = cellule vide)"""
+    def write(f):
+        text = io.TextIOWrapper(f, encoding="utf-8-sig", newline="")
+        writer = csv.writer(text, delimiter=";")
+        writer.writerow(report_columns(matieres_config))
+        for i in ordre:
+            student = students[i]
+            notes = ["" if np.isnan(note) else f"{note:.2f}".replace(".", ",") for note in adjusted_matrix[i]]
+            writer.writerow([int(rangs[i]), student["prenom"], student["nom"], student.get("email") or "",
+                             student.get("choix", "Formulaire non rempli"), 1 if student.get("_is_new") else 0,
+                             f"{moyennes[i]:.2f}".replace(".", ",")] + notes)
+        text.flush()
+        text.detach()
+    write_atomic(path, write)
+
+
+def write_notes_parquet(path, students, adjusted_matrix, matieres_config, moyennes, rangs, ordre):
+    """Export Parquet des notes ajustees (colonnes typees, note manquante = null)"""
+    eleves = [students[i] for i in ordre]
+    colonnes = report_columns(matieres_config)
+    valeurs = [rangs[ordre].tolist(), [s["prenom"] for s in eleves], [s["nom"] for s in eleves],
+               [s.get("email") or "" for s in eleves],
+               [s.get("choix", "Formulaire non rempli") for s in eleves],
+               [bool(s.get("_is_new")) for s in eleves], moyennes[ordre].tolist()]
+    valeurs += [pyarrow.array(adjusted_matrix[ordre, j], from_pandas=True) for j in range(len(matieres_config))]
+    table = pyarrow.table(dict(zip(colonnes, valeurs)))
+    write_atomic(path, lambda f: pyarrow.parquet.write_table(table, f))
+
+
+def generate_report_html(cohort, students, class_stats, histograms, moyennes, rangs, ordre):
+    """Rapport de cohorte (A4 paysage) : statistiques et histogramme de chaque matiere,
+    puis classement general"""
+    etablissements = " / ".join(p["etablissement"]["nom"] for p in cohort["profils"])
+    bornes = REPORT_HISTOGRAM_BINS
+    tranches = "".join(f"<th>{bornes[k]:g}-{bornes[k + 1]:g}</th>" for k in range(len(bornes) - 1))
+
+    lignes_matieres = []
+    for matiere in cohort["matieres"]:
+        stats = class_stats[matiere["nom"]]
+        effectifs = histograms[matiere["nom"]]
+        plus_grand = max(effectifs) or 1
+        barres = "".join(
+            f'<td class="barre"><div style="height:{round(REPORT_BAR_HEIGHT_PX * n / plus_grand)}px"></div>'
+            f'<span>{n}</span></td>' for n in effectifs)
+        lignes_matieres.append(
+            f"<tr><td class=\"nom\">{escape(matiere['nom'])}</td><td>{format_note(stats['moyenne'])}</td>"
+            f"<td>{format_note(stats['min'])}</td><td>{format_note(stats['max'])}</td>"
+            f"<td>{sum(effectifs)}</td>{barres}</tr>")
+
+    lignes_classement = []
+    for i in ordre:
+        student = students[i]
+        lignes_classement.append(
+            f"<tr><td>{int(rangs[i])}</td><td class=\"nom\">{escape(student['prenom'])} "
+            f"{escape(student['nom'])}</td><td>{escape(student.get('choix', 'Formulaire non rempli'))}</td>"
+            f"<td>{format_note(float(moyennes[i]))}</td></tr>")
+
+    return f"""<!DOCTYPE html>
+<html lang="fr">
+<head>
+<meta charset="UTF-8">
+<title>Rapport {escape(cohort['cohorte'])}</title>
+<style>
+@page {{ size: A4 landscape; margin: 12mm; }}
+body {{ font-family: 'Open Sans', Arial, sans-serif; font-size: 9pt; color: #222; }}
+h1 {{ font-size: 15pt; margin: 0 0 2mm; }}
+h2 {{ font-size: 11pt; margin: 6mm 0 2mm; }}
+table {{ border-collapse: collapse; width: 100%; }}
+th, td {{ border: 1px solid #ccc; padding: 1mm 2mm; text-align: center; }}
+th {{ background: #f0f0f0; }}
+td.nom {{ text-align: left; }}
+td.barre {{ vertical-align: bottom; width: 6%; }}
+td.barre div {{ background: #4a7bb7; margin: 0 auto; width: 70%; }}
+td.barre span {{ font-size: 7pt; color: #666; }}
+tr {{ page-break-inside: avoid; }}
+.classement {{ page-break-before: always; }}
+</style>
+</head>
+<body>
+<h1>Rapport de cohorte {escape(cohort['cohorte'])}</h1>
+<p>{escape(etablissements)} - {len(students)} élèves</p>
+<h2>Statistiques et répartition des notes ajustées par matière</h2>
+<table>
+<thead><tr><th>Matière</th><th>Moyenne</th><th>Min</th><th>Max</th><th>Notes</th>{tranches}</tr></thead>
+<tbody>
+{chr(10).join(lignes_matieres)}
+</tbody>
+</table>
+<h2 class="classement">Classement général</h2>
+<table>
+<thead><tr><th>Rang</th><th>Élève</th><th>Choix</th><th>Moyenne générale</th></tr></thead>
+<tbody>
+{chr(10).join(lignes_classement)}
+</tbody>
+</table>
+</body>
+</html>
+"""
+
+
+def write_cohort_reports(cohort, students, adjusted_matrix, class_stats, output_mode=OUTPUT_MODE_DEFAUT):
+    """Etape rapports (--rapports) : classement, histogrammes par matiere et export des
+    notes ajustees de la cohorte, en un passage sur la matrice deja calculee.
+    Ecrit notes_<cohorte>.csv (+ .parquet si pyarrow est installe) et
+    rapport_<cohorte>.pdf (.html avec --sorties html) dans REPORT_DIR.
+    Retourne la liste des fichiers ecrits."""
+    REPORT_DIR.mkdir(exist_ok=True)
+    matieres = cohort["matieres"]
+    moyennes, rangs, ordre = cohort_ranking(adjusted_matrix, matieres)
+    histograms = subject_histograms(adjusted_matrix, matieres)
+
+    paths = [REPORT_DIR / f"notes_{cohort['cohorte']}.csv"]
+    write_notes_csv(paths[0], students, adjusted_matrix, matieres, moyennes, rangs, ordre)
+    if pyarrow is not None:
+        paths.append(REPORT_DIR / f"notes_{cohort['cohorte']}.parquet")
+        write_notes_parquet(paths[-1], students, adjusted_matrix, matieres, moyennes, rangs, ordre)
+
+    html = generate_report_html(cohort, students, class_stats, histograms, moyennes, rangs, ordre)
+    if output_mode == "html":
+        paths.append(REPORT_DIR / f"rapport_{cohort['cohorte']}.html")
+        write_text_atomic(paths[-1], html)
+    else:
+        paths.append(REPORT_DIR / f"rapport_{cohort['cohorte']}.pdf")
+        render_pdf(html, paths[-1])
+    return paths
+
+
+def print_cohort_reports(cohort, students, adjusted_matrix, class_stats, output_mode=OUTPUT_MODE_DEFAUT):
+    """Ecrit les rapports d'une cohorte et affiche les fichiers produits"""
+    start = time.perf_counter()
+    with profile_stage("rapports_cohorte", cohorte=cohort["cohorte"]):
+        paths = write_cohort_reports(cohort, students, adjusted_matrix, class_stats, output_mode)
+    duree = time.perf_counter() - start
+    print(f"[OK] Rapports {cohort['cohorte']} en {duree * 1000:.0f} ms: {', '.join(p.name for p in paths)}")
+
+
+def dry_run_stats(registry, workers):
+    """--dry-run-stats : notes ajustees et statistiques de classe de chaque cohorte,
+    sans rendu ni ecriture de bulletins (avec --rapports, rapports de cohorte en plus)"""
+    load_workbooks(registry, workers)
+    for cohort in registry.values():
+        students, _ = load_students(cohort, merge="--fusion" in sys.argv)
+        if not students:
+            continue
+        start = time.perf_counter()
+        adjusted_matrix, class_stats = prepare_notes(students, cohort)
+        duree = time.perf_counter() - start
+        print_notes_stats(cohort, class_stats, cohort_transforms(cohort), duree)
+        if "--rapports" in sys.argv:
+            print_cohort_reports(cohort, students, adjusted_matrix, class_stats, get_output_mode())
+
+
+def index_paths(cohort):
+    """(page, donnees) de l'index d'une cohorte : index.html pour la premiere cohorte
+    configuree, index_<cohorte>.html pour les suivantes"""
+    if cohort["rang"] == 0:
+        return BASE_DIR / "index.html", INDEX_DATA_FILE
+    return (BASE_DIR / f"index_{cohort['cohorte']}.html",
+            INDEX_DATA_FILE.with_name(f"{INDEX_DATA_FILE.stem}_{cohort['cohorte']}.js"))
+
+
+def main():
+    if "--profile" in sys.argv:
+        enable_profiling()
+
+    print("=" * 60)
+    print("GENERATEUR DE BULLETINS SCOLAIRES")
+    print("=" * 60)
+
+    # Cohortes et profils a generer (config/)
+    try:
+        registry = get_registry()
+    except (ValueError, OSError) as e:
+        print(f"[ERREUR] Configuration des cohortes invalide: {e}")
+        return
+    profils = registry_profiles(registry)
+    for cohort in registry.values():
+        print(f"[OK] Cohorte {cohort['cohorte']}: "
+              f"{' + '.join(p['etablissement']['nom'] for p in cohort['profils'])} ({cohort['source']})")
+
+    # Statistiques seules : aucun dossier, image ou bulletin touche
+    if "--dry-run-stats" in sys.argv:
+        dry_run_stats(registry, get_workers_count())
+        return
+
+    # Creer les dossiers de sortie
+    output_dirs = [d for profil in profils for d in profile_output_dirs(profil["cle"])]
+    for d in output_dirs:
+        d.mkdir(exist_ok=True)
+
+    print(f"\n[OK] Dossiers de sortie créés")
+
+    # Charger les templates
+    # Compiler des maintenant : un placeholder inconnu arrete le script avant la lecture des classeurs
+    print(f"[...] Chargement des templates...")
+    for profil in profils:
+        compile_template(profil["template"].read_text(encoding="utf-8"))
+    print(f"[OK] Templates chargés: {' + '.join(p['libelle'] for p in profils)} (1 page)")
+
+    # Logos et tampons reduits une fois a la resolution d'impression (cache disque)
+    with profile_stage("optimisation_images"):
+        image_sizes = prepare_print_assets(registry)
+    check_local_assets()
+    for profil_key, (avant, apres) in image_sizes.items():
+        print(f"[OK] Images {profil_key.upper()}: {avant / 1024:.0f} Ko -> {apres / 1024:.0f} Ko par bulletin")
+
+    workers = get_workers_count()
+    profil_keys = [profil["cle"] for profil in profils]
 
     # Vérifier s'il faut nettoyer (première exécution avec --clean ou --force-clean)
     # ou si on reprend après un crash (bulletins existants gardés)
-    import sys
-    if "--clean" in sys.argv:
+    clean = "--clean" in sys.argv
+    if clean:
         print(f"[...] Suppression de tous les anciens bulletins (--clean)...")
-        for d in [html_paes_dir, pdf_paes_dir, html_linova_dir, pdf_linova_dir]:
+        for d in output_dirs:
             if d.exists():
                 for f in d.glob("*"):
                     if f.is_file():
                         f.unlink()
         print(f"[OK] Anciens bulletins supprimés")
     else:
-        existing_paes = len(list(pdf_paes_dir.glob("*.pdf"))) if pdf_paes_dir.exists() else 0
-        existing_linova = len(list(pdf_linova_dir.glob("*.pdf"))) if pdf_linova_dir.exists() else 0
-        print(f"[INFO] Reprise : {existing_paes} PAES et {existing_linova} Linova déjà générés")
+        nb_temp = remove_temp_files(output_dirs)
+        if nb_temp:
+            print(f"[INFO] {nb_temp} fichiers temporaires d'une exécution interrompue supprimés")
+        existing = [f"{len(list(profile_output_dirs(p['cle'])[1].glob('*.pdf')))} {p['libelle']}" for p in profils]
+        print(f"[INFO] Reprise : {' et '.join(existing)} déjà générés")
+
+    # Empreintes des entrees : un bulletin n'est regenere que si son PDF manque
+    # ou si l'empreinte de ses donnees a change depuis le dernier rendu
+    manifest = load_manifest(profil_keys)
+    if clean:
+        for profil_key in profil_keys:
+            manifest[profil_key] = {}
+
+    # Classeurs lus une seule fois pour toutes les cohortes
+    load_workbooks(registry, workers)
+
+    output_mode = get_output_mode()
+    html_archive = HtmlArchive(HTML_ARCHIVE_FILE) if output_mode == "pdf-html-gz" else None
+    exporter = create_exporter(registry)
+    if exporter is not None and output_mode == "html":
+        print(f"[WARN] --export ignoré avec --sorties html (aucun PDF rendu)")
+        exporter = None
+    fsync_mode = get_fsync_mode()
+    # Un seul pool de rendu PDF pour toutes les cohortes
+    pool = create_render_pool(workers) if output_mode != "html" else None
+    duplicates_reports = {}
+    html_names = set()
+    index_files = []
 
-    # Pre-calculer les notes ajustees UNE SEULE FOIS par eleve/matiere PAES
-    # pour que PAES et Linova aient exactement les memes moyennes
-    # Seed fixe pour que les notes soient identiques si on relance le script
-    # On traite les eleves existants AVANT les nouveaux pour preserver le seed
-    print(f"[...] Pré-calcul des notes ajustées (identiques PAES/Linova)...")
-    random.seed(42)
-    existing_enriched = [s for s in enriched_students if not s.get("_is_new")]
-    new_enriched = [s for s in enriched_students if s.get("_is_new")]
-
-    for student in existing_enriched:
-        adjusted = {}
-        for matiere in MATIERES_PAES:
-            raw_note = student["notes"].get(matiere["nom"])
-            adjusted[matiere["nom"]] = adjust_grade(raw_note)
-        student["adjusted_notes"] = adjusted
-
-    for student in new_enriched:
-        adjusted = {}
-        for matiere in MATIERES_PAES:
-            raw_note = student["notes"].get(matiere["nom"])
-            adjusted[matiere["nom"]] = adjust_grade(raw_note)
-        student["adjusted_notes"] = adjusted
-
-    enriched_students = existing_enriched + new_enriched
-    print(f"[OK] Notes ajustées pré-calculées ({len(existing_enriched)} existants + {len(new_enriched)} nouveaux)")
-
-    # Calculer les statistiques de classe pour PAES (avec notes pre-calculees)
-    print(f"[...] Calcul des statistiques de classe PAES...")
-    class_stats_paes = calculate_class_stats_from_adjusted(enriched_students, MATIERES_PAES)
-    print(f"[OK] Statistiques PAES calculées")
-
-    # Calculer les statistiques de classe pour Linova (memes notes via mapping source_paes)
-    print(f"[...] Calcul des statistiques de classe Linova...")
-    linova_key_fn = lambda m: m.get("source_paes", m["nom"])
-    class_stats_linova = calculate_class_stats_from_adjusted(enriched_students, MATIERES_LINOVA, notes_key_fn=linova_key_fn)
-    print(f"[OK] Statistiques Linova calculées")
-
-    # Generer les bulletins
-    print(f"\n[...] Génération des bulletins...")
-
-    for i, student in enumerate(enriched_students, start=1):
-        prenom = student['prenom'] or 'inconnu'
-        nom = student['nom'] or 'inconnu'
-        filename_base = f"bulletin_{sanitize_filename(prenom)}_{sanitize_filename(nom)}"
-
-        # === Bulletin PAES ===
-        html_path_paes = html_paes_dir / f"{filename_base}.html"
-        pdf_path_paes = pdf_paes_dir / f"{filename_base}.pdf"
-        if not pdf_path_paes.exists():
-            html_paes = generate_bulletin_html(
-                student, class_stats_paes, template,
-                PROFIL_PAES, MATIERES_PAES, APPRECIATIONS_PAES
-            )
-            with open(html_path_paes, 'w', encoding='utf-8') as f:
-                f.write(html_paes)
-            HTML(string=html_paes, base_url=str(BASE_DIR)).write_pdf(pdf_path_paes)
-            del html_paes
-            gc.collect()
-
-        # === Bulletin Linova (meme mise en page A4 que PAES) ===
-        html_path_linova = html_linova_dir / f"{filename_base}.html"
-        pdf_path_linova = pdf_linova_dir / f"{filename_base}.pdf"
-        if not pdf_path_linova.exists():
-            html_linova = generate_bulletin_html(
-                student, class_stats_linova, template_linova,
-                PROFIL_LINOVA, MATIERES_LINOVA, APPRECIATIONS_LINOVA,
-                notes_key_fn=linova_key_fn
-            )
-            with open(html_path_linova, 'w', encoding='utf-8') as f:
-                f.write(html_linova)
-            HTML(string=html_linova, base_url=str(BASE_DIR)).write_pdf(pdf_path_linova)
-            del html_linova
-            gc.collect()
-
-        print(f"  [{i}/{len(enriched_students)}] {prenom} {nom} OK")
-
-    print(f"\n[OK] {len(enriched_students)} x 2 bulletins générés ({len(enriched_students)} PAES + {len(enriched_students)} Linova)")
-
-    # Generer l'index HTML (tous les élèves des notes, enrichis avec choix + date)
-    print(f"\n[...] Génération de la plateforme index.html...")
-    index_html = generate_index_html(enriched_students, PROFIL_PAES, PROFIL_LINOVA)
-    index_path = BASE_DIR / "index.html"
-
-    with open(index_path, 'w', encoding='utf-8') as f:
-        f.write(index_html)
-
-    print(f"[OK] Plateforme créée: {index_path}")
+    try:
+        for cohort in registry.values():
+            print(f"\n{'=' * 60}\nCOHORTE {cohort['cohorte']}\n{'=' * 60}")
+            students, duplicates_report = load_students(cohort, merge="--fusion" in sys.argv)
+            duplicates_reports[cohort["cohorte"]] = duplicates_report
+            if not students:
+                continue
+
+            adjusted_matrix, class_stats = prepare_notes(students, cohort)
+            contexts = build_render_contexts(cohort, class_stats)
+            if "--rapports" in sys.argv:
+                print_cohort_reports(cohort, students, adjusted_matrix, class_stats, output_mode)
+
+            nb_removed = remove_merged_outputs(duplicates_report, contexts, manifest)
+            if nb_removed:
+                print(f"[OK] {nb_removed} anciens bulletins de doublons fusionnés supprimés")
+
+            # Generer les bulletins : notes ajustees -> HTML -> ecriture/PDF, eleve par eleve
+            if output_mode == "html":
+                print(f"\n[...] Génération des bulletins HTML (sans PDF)...")
+            elif workers > 1:
+                print(f"\n[...] Génération des bulletins ({workers} processus de rendu PDF)...")
+            else:
+                print(f"\n[...] Génération des bulletins...")
+            adjusted = iter_adjusted_students(students, adjusted_matrix, cohort["matieres"], contexts)
+            if "--pdf-fond" in sys.argv and output_mode != "html":
+                # Valeurs de toute la cohorte connues avant le rendu : notes ajustees attachees d'abord
+                adjusted = list(adjusted)
+                prepare_page_backgrounds(adjusted, contexts)
+            cohort_dirs = [d for ctx in contexts for d in (ctx["html_dir"], ctx["pdf_dir"])]
+            # En mode html, pas de PDF de reference : tous les HTML sont reecrits
+            write_bulletins(iter_rendered_bulletins(adjusted, contexts, manifest, force=output_mode == "html",
+                                                    html_archive=html_archive,
+                                                    html_files=output_mode == "pdf-html"),
+                            len(students), manifest, workers, cohort_dirs, fsync_mode,
+                            output_mode, html_archive, exporter, contexts, pool)
+            html_names.update(html_archive_name(ctx["cle"], bulletin_filename_base(s))
+                              for ctx in contexts for s in students)
+
+            detail = " + ".join(f"{len(students)} {p['libelle']}" for p in cohort["profils"])
+            print(f"\n[OK] {len(students)} x {len(contexts)} bulletins générés ({detail})")
+
+            # PDF de cohorte : tous les bulletins d'un profil dans un seul fichier
+            if "--pdf-cohorte" in sys.argv and output_mode == "html":
+                print("[WARN] --pdf-cohorte ignoré en sortie html (aucun PDF individuel)")
+            elif "--pdf-cohorte" in sys.argv and pypdf is None:
+                print("[WARN] --pdf-cohorte ignoré : pypdf non installé (pip install pypdf)")
+            elif "--pdf-cohorte" in sys.argv:
+                print(f"\n[...] Génération des PDF de cohorte...")
+                for ctx in contexts:
+                    cohort_pdf = BASE_DIR / f"bulletins_cohorte_{ctx['cle']}.pdf"
+                    pdf_paths = [ctx["pdf_dir"] / f"{bulletin_filename_base(s)}.pdf" for s in students]
+                    with profile_stage("write_cohort_pdf", profil=ctx["cle"]):
+                        nb_pages = write_cohort_pdf((path for path in pdf_paths if path.exists()),
+                                                    cohort_pdf)
+                    print(f"[OK] {cohort_pdf.name}: {nb_pages} pages")
+
+            # Generer l'index HTML (tous les élèves des notes, enrichis avec choix + date)
+            index_path, index_data_path = index_paths(cohort)
+            print(f"\n[...] Génération de la plateforme {index_path.name}...")
+            with profile_stage("generate_index_html", cohorte=cohort["cohorte"]):
+                index_data = generate_index_data(students)
+                data_version = hashlib.sha256(index_data.encode("utf-8")).hexdigest()[:12]
+                index_html = generate_index_html(students, cohort, index_data_path.name, data_version)
+
+            with profile_stage("ecriture_index", cohorte=cohort["cohorte"]):
+                write_text_atomic(index_data_path, index_data)
+                write_text_atomic(index_path, index_html)
+            index_files.append((index_path, index_data_path))
+
+            print(f"[OK] Plateforme créée: {index_path}")
+
+        if exporter is not None:
+            with profile_stage("ecriture_exports"):
+                exports = exporter.close()
+            for path in exports:
+                print(f"[OK] Export: {path.name} ({path.stat().st_size / (1024 * 1024):.1f} Mo)")
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+        if html_archive is not None:
+            with profile_stage("ecriture_archive_html"):
+                html_archive.close(keep_names=html_names, fsync=fsync_mode == "fichier")
+        with open(DUPLICATES_REPORT_FILE, 'w', encoding='utf-8') as f:
+            json.dump(duplicates_reports, f, ensure_ascii=False, indent=2)
+
+    if not index_files:
+        return
 
     # Resume
     print("\n" + "=" * 60)
     print("RÉSUMÉ")
     print("=" * 60)
-    print(f"  Bulletins PAES HTML:   {html_paes_dir}")
-    print(f"  Bulletins PAES PDF:    {pdf_paes_dir}")
-    print(f"  Bulletins Linova HTML: {html_linova_dir}")
-    print(f"  Bulletins Linova PDF:  {pdf_linova_dir}")
-    print(f"  Plateforme:            {index_path}")
-    print(f"\nOuvrez index.html dans votre navigateur pour accéder aux bulletins.")
+    for profil in profils:
+        html_dir, pdf_dir = profile_output_dirs(profil["cle"])
+        if output_mode in ("html", "pdf-html"):
+            print(f"  {'Bulletins ' + profil['libelle'] + ' HTML:':<23}{html_dir}")
+        if output_mode != "html":
+            print(f"  {'Bulletins ' + profil['libelle'] + ' PDF:':<23}{pdf_dir}")
+    if html_archive is not None:
+        print(f"  Archive HTML:          {HTML_ARCHIVE_FILE}")
+    if exporter is not None:
+        print(f"  Exports:               {EXPORT_DIR}")
+    for profil_key, (avant, apres) in image_sizes.items():
+        gain = 100 * (avant - apres) / avant if avant else 0
+        print(f"  Images {profil_key.upper() + ':':<15}{avant / 1024:.0f} Ko -> {apres / 1024:.0f} Ko "
+              f"par bulletin (-{gain:.0f}%)")
+    for index_path, index_data_path in index_files:
+        print(f"  Plateforme:            {index_path}")
+        print(f"  Données plateforme:    {index_data_path}")
+    print(f"  Rapport doublons:      {DUPLICATES_REPORT_FILE}")
+    if "--rapports" in sys.argv:
+        print(f"  Rapports de cohorte:   {REPORT_DIR}")
+    print(f"\nOuvrez {index_files[0][0].name} dans votre navigateur pour accéder aux bulletins.")
     print("=" * 60)
 
+    if _profile_events is not None:
+        resume = print_profile_report(_profile_events)
+        write_profile_trace(_profile_events, resume, PROFILE_FILE)
+        print(f"\n[OK] Profil détaillé (format Chrome trace): {PROFILE_FILE}")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Service de regeneration des bulletins a la demande
+Garde en memoire les eleves, les notes ajustees, les statistiques de classe et les
+templates compiles de generate_bulletins.py, et regenere sur demande le bulletin
+d'un eleve, un profil entier ou toute la cohorte sans relire les classeurs Excel.
+Les demandes passent par une file asyncio ; le rendu PDF est fait par un pool de
+processus borne (--workers N) et chaque chemin de PDF est renvoye des qu'il est ecrit.
+
+Protocole : une demande JSON par connexion (une ligne), une reponse JSON par ligne.
+    {"prenom": "Ambre", "nom": "Juston-Chimot"}      -> tous les bulletins de l'eleve
+    {"fichier": "bulletin_ambre_juston_chimot", "profil": "paes"}
+    {"profil": "linova"}                             -> tous les bulletins Linova
+    {}                                               -> toutes les cohortes
+    {"action": "recharger"}                          -> relit les classeurs et la configuration
+
+Usage:
+    python serveur_bulletins.py [--port 8765] [--workers N] [--sorties pdf|html|pdf-html]
+                                [--config f1,f2] [--cohortes a,b] [--fusion]
+    python serveur_bulletins.py --client [--prenom P --nom N | --fichier F]
+                                [--profil CLE] [--recharger] [--port 8765]
+"""
+
+import asyncio
+import json
+import sys
+from multiprocessing import get_context
+
+import generate_bulletins as gb
+
+HOST = "127.0.0.1"
+PORT_DEFAUT = 8765
+
+# Etat charge une fois au demarrage puis a chaque demande "recharger"
+_state = None
+
+
+def load_state(workers):
+    """Charge, pour chaque cohorte configuree, les eleves, notes ajustees,
+    statistiques et contextes de rendu"""
+    # Les classeurs non modifies sont relus depuis le cache disque
+    gb._workbook_rows.clear()
+    registry = gb.get_registry()
+    gb.load_workbooks(registry, workers)
+    # Images reduites preparees ici, pas en parallele par les processus de rendu
+    gb.prepare_print_assets(registry)
+
+    cohortes = []
+    for cohort in registry.values():
+        students, _ = gb.load_students(cohort, merge="--fusion" in sys.argv)
+        if not students:
+            continue
+        adjusted_matrix, class_stats = gb.prepare_notes(students, cohort)
+        contexts = gb.build_render_contexts(cohort, class_stats)
+        for _ in gb.iter_adjusted_students(students, adjusted_matrix, cohort["matieres"], contexts):
+            pass
+        for ctx in contexts:
+            ctx["html_dir"].mkdir(exist_ok=True)
+            ctx["pdf_dir"].mkdir(exist_ok=True)
+        cohortes.append({
+            "students": students,
+            "contexts": contexts,
+            "par_id": {s["_id"]: s for s in students},
+            "par_fichier": {gb.bulletin_filename_base(s): s for s in students},
+        })
+
+    return {
+        "cohortes": cohortes,
+        "profils": {ctx["cle"] for c in cohortes for ctx in c["contexts"]},
+        "nb_eleves": sum(len(c["students"]) for c in cohortes),
+    }
+
+
+def resolve_jobs(state, demande):
+    """Liste des (eleve, contexte) a regenerer pour une demande.
+    Leve ValueError si l'eleve ou le profil est inconnu."""
+    profil = demande.get("profil")
+    if profil and profil not in state["profils"]:
+        raise ValueError(f"Profil inconnu: {profil}")
+
+    todo = []
+    for cohorte in state["cohortes"]:
+        contexts = [ctx for ctx in cohorte["contexts"] if not profil or ctx["cle"] == profil]
+        if not contexts:
+            continue
+        if demande.get("fichier"):
+            student = cohorte["par_fichier"].get(demande["fichier"])
+        elif demande.get("prenom") or demande.get("nom"):
+            sid = gb.student_id(demande.get("prenom") or "", demande.get("nom") or "")
+            student = cohorte["par_id"].get(sid)
+        else:
+            todo += [(s, ctx) for ctx in contexts for s in cohorte["students"]]
+            continue
+        if student is not None:
+            todo += [(student, ctx) for ctx in contexts]
+
+    if not todo and (demande.get("fichier") or demande.get("prenom") or demande.get("nom")):
+        raise ValueError("Eleve inconnu")
+    return todo
+
+
+async def render_worker(jobs, pool, manifest, output_mode):
+    """Consomme la file : HTML dans la boucle, PDF dans le pool de processus.
+    L'archive HTML n'est pas mise a jour par le service : en mode pdf-html-gz,
+    seul le PDF est produit."""
+    loop = asyncio.get_running_loop()
+    while True:
+        student, ctx, replies = await jobs.get()
+        filename_base = gb.bulletin_filename_base(student)
+        reponse = {"profil": ctx["cle"], "eleve": f"{student['prenom']} {student['nom']}"}
+        try:
+            html = gb.render_bulletin_html(student, ctx)
+            if output_mode in ("html", "pdf-html"):
+                html_path = ctx["html_dir"] / f"{filename_base}.html"
+                gb.write_text_atomic(html_path, html)
+                reponse["html"] = str(html_path)
+            if output_mode != "html":
+                pdf_path = ctx["pdf_dir"] / f"{filename_base}.pdf"
+                await loop.run_in_executor(pool, gb.render_pdf, html, str(pdf_path))
+                # Un profil ajoute par "recharger" n'a pas encore d'entree dans le manifeste
+                manifest.setdefault(ctx["cle"], {})[filename_base] = gb.student_inputs_hash(
+                    student, ctx["digest"], ctx["matieres"], ctx["notes_key_fn"])
+                reponse["pdf"] = str(pdf_path)
+        except Exception as e:
+            reponse["erreur"] = str(e)
+        finally:
+            jobs.task_done()
+        await replies.put(reponse)
+
+
+async def send_line(writer, data):
+    writer.write((json.dumps(data, ensure_ascii=False) + "\n").encode("utf-8"))
+    await writer.drain()
+
+
+async def handle_client(reader, writer, jobs, manifest, workers, reload_lock):
+    """Traite une demande : met les bulletins en file et renvoie chaque PDF ecrit"""
+    global _state
+    try:
+        demande = json.loads(await reader.readline() or b"{}")
+        if demande.get("action") == "recharger":
+            async with reload_lock:
+                _state = await asyncio.to_thread(load_state, workers)
+            print(f"[OK] Données rechargées: {_state['nb_eleves']} élèves")
+            await send_line(writer, {"termine": True, "eleves": _state["nb_eleves"]})
+            return
+
+        todo = resolve_jobs(_state, demande)
+        replies = asyncio.Queue()
+
+        async def enqueue():
+            for student, ctx in todo:
+                await jobs.put((student, ctx, replies))
+
+        # Mise en file en parallele : les premiers PDF repartent avant la fin de la file
+        enqueue_task = asyncio.create_task(enqueue())
+        nb_ok = 0
+        for _ in todo:
+            reponse = await replies.get()
+            nb_ok += "erreur" not in reponse
+            await send_line(writer, reponse)
+        await enqueue_task
+        # Un lot = une demande : dossiers synchronises avant la sauvegarde du manifeste
+        gb.sync_directories({d for _, ctx in todo for d in (ctx["html_dir"], ctx["pdf_dir"])})
+        gb.save_manifest(manifest)
+        print(f"[OK] Demande {demande}: {nb_ok}/{len(todo)} bulletins")
+        await send_line(writer, {"termine": True, "bulletins": nb_ok})
+    except (ValueError, OSError) as e:
+        await send_line(writer, {"erreur": str(e)})
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+async def serve(port, workers, output_mode):
+    global _state
+    # Polices locales avant les empreintes des profils (calculees par load_state)
+    gb.check_local_assets()
+    print(f"[...] Chargement des données...")
+    _state = await asyncio.to_thread(load_state, workers)
+    manifest = gb.load_manifest(_state["profils"])
+
+    # Le rendu PDF ne se fait jamais dans la boucle asyncio, meme avec --workers 1.
+    # Processus lances par un serveur forkserver : un fork du service heriterait des
+    # connexions clientes ouvertes et le client n'en verrait jamais la fin.
+    mp_context = get_context("forkserver")
+    pool = gb.create_render_pool(workers, mp_context, min_workers=1)
+    jobs = asyncio.Queue(maxsize=workers * 2)
+    reload_lock = asyncio.Lock()
+    workers_tasks = [asyncio.create_task(render_worker(jobs, pool, manifest, output_mode)) for _ in range(workers)]
+
+    server = await asyncio.start_server(
+        lambda r, w: handle_client(r, w, jobs, manifest, workers, reload_lock), HOST, port)
+    print(f"[OK] Service prêt sur {HOST}:{port} ({_state['nb_eleves']} élèves, "
+          f"{workers} processus de rendu PDF)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        for task in workers_tasks:
+            task.cancel()
+        pool.shutdown(cancel_futures=True)
+        gb.save_manifest(manifest)
+
+
+async def send_request(port, demande):
+    """Client : envoie une demande et affiche chaque bulletin des qu'il est pret"""
+    reader, writer = await asyncio.open_connection(HOST, port)
+    await send_line(writer, demande)
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        reponse = json.loads(line)
+        if "pdf" in reponse or "html" in reponse:
+            print(f"  [OK] {reponse['profil']} {reponse['eleve']}: {reponse.get('pdf', reponse.get('html'))}")
+        elif "erreur" in reponse:
+            print(f"  [ERREUR] {reponse.get('eleve', 'Demande')}: {reponse['erreur']}")
+        elif reponse.get("termine"):
+            print(f"[OK] Terminé: {reponse}")
+    writer.close()
+    await writer.wait_closed()
+
+
+def main():
+    port = int(gb.get_cli_option("--port", str(PORT_DEFAUT)))
+    if "--client" in sys.argv:
+        if "--recharger" in sys.argv:
+            demande = {"action": "recharger"}
+        else:
+            demande = {key: gb.get_cli_option(f"--{key}") for key in ("prenom", "nom", "fichier", "profil")}
+            demande = {key: value for key, value in demande.items() if value}
+        asyncio.run(send_request(port, demande))
+        return
+
+    print("=" * 60)
+    print("SERVICE DE REGENERATION DES BULLETINS")
+    print("=" * 60)
+    try:
+        asyncio.run(serve(port, gb.get_workers_count(), gb.get_output_mode()))
+    except KeyboardInterrupt:
+        print(f"\n[OK] Service arrêté")
+
+
+if __name__ == "__main__":
+    main()